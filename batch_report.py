@@ -0,0 +1,380 @@
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from weather_data_download import WeatherDataDownload
+from weather_data_statistics import WeatherDataStatistics
+
+#Columns of every report row, in CSV order
+REPORT_FIELDS = [
+    'city', 'latitude', 'longitude', 'year', 'month',
+    'max_day_temp_month', 'min_day_temp_month', 'max_night_temp_month',
+    'min_night_temp_month', 'today_max_day_temp', 'today_min_night_temp',
+    'day_message', 'night_message'
+]
+
+#Statistics processes are started while download threads hold locks (metrics,
+#HTTP cache, SQLite), a forked worker could inherit one held and deadlock
+PROCESS_START_METHOD = ('forkserver' if 'forkserver' in 
+                        multiprocessing.get_all_start_methods() else 'spawn')
+
+def download_city(city, year):
+    """
+    I/O stage of the batch report, runs in a thread. Geocodes the city and
+    downloads its historical data and today's forecast.
+
+    Parameters
+    ----------
+    city : str
+        The name of the city.
+    year : int
+        The year of the historical data.
+
+    Returns
+    -------
+    dict or None
+        The downloaded data, or None if the city could not be found.
+    """
+    weather_downloader = WeatherDataDownload(city)
+    if weather_downloader.latitude == 0 and weather_downloader.longitude == 0:
+        return None
+    weather_downloader.get_historical_data(year)
+    weather_downloader.get_forecast_data()
+    return {
+        'city': city,
+        'latitude': weather_downloader.latitude,
+        'longitude': weather_downloader.longitude,
+        'year': year,
+        'daily_temperature_2m_max': weather_downloader.daily_temperature_2m_max,
+        'daily_temperature_2m_min': weather_downloader.daily_temperature_2m_min,
+        'today_max_day_temp': weather_downloader.today_max_day_temp,
+        'today_min_night_temp': weather_downloader.today_min_night_temp
+    }
+
+
+def analyze_city(city_data, month):
+    """
+    CPU stage of the batch report, runs in a worker process. Compares
+    today's forecast with the city's historical data for the given month.
+
+    Parameters
+    ----------
+    city_data : dict
+        The data returned by download_city().
+    month : int
+        The month to compare against (1 = January, ..., 12 = December).
+
+    Returns
+    -------
+    dict
+        One report row, keyed by REPORT_FIELDS.
+    """
+    weather_stat = WeatherDataStatistics(city_data['city'])
+    month_stats = weather_stat.match_against_historical_weather(
+        month, city_data['year'],
+        city_data['daily_temperature_2m_max'],
+        city_data['daily_temperature_2m_min']
+    )
+    day = weather_stat.compare_day_temps(city_data['today_max_day_temp'],
+                                         month_stats)
+    night = weather_stat.compare_night_temps(
+        city_data['today_min_night_temp'], month_stats)
+
+    return {
+        'city': city_data['city'],
+        'latitude': city_data['latitude'],
+        'longitude': city_data['longitude'],
+        'year': city_data['year'],
+        'month': month,
+        'max_day_temp_month': float(month_stats.max_day_temp_month),
+        'min_day_temp_month': float(month_stats.min_day_temp_month),
+        'max_night_temp_month': float(month_stats.max_night_temp_month),
+        'min_night_temp_month': float(month_stats.min_night_temp_month),
+        'today_max_day_temp': float(city_data['today_max_day_temp']),
+        'today_min_night_temp': float(city_data['today_min_night_temp']),
+        'day_message': day.message,
+        'night_message': night.message
+    }
+
+
+def read_cities(source):
+    """
+    Reads one city name per line, skipping blank lines and duplicates.
+
+    Parameters
+    ----------
+    source : file
+        An open text file, such as sys.stdin.
+
+    Returns
+    -------
+    list of str
+        The city names in their original order.
+    """
+    cities = (line.strip() for line in source)
+    return list(dict.fromkeys(city for city in cities if city))
+
+
+def read_progress(path):
+    """
+    Reads the cities a previous run already finished, reported or failed 
+    for good.
+
+    Parameters
+    ----------
+    path : str or None
+        The progress file, one finished city per line, a failed city is 
+        followed by a tab and the reason.
+
+    Returns
+    -------
+    set of str
+        The finished cities, empty if there is no progress file yet.
+    """
+    if path is None or not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as progress_file:
+        return set(read_cities(line.split('\t', 1)[0] 
+                               for line in progress_file))
+
+
+class ReportWriter:
+    """
+    Streams report rows as JSON Lines or CSV, flushing after every row, and
+    records every finished city in the progress file so an interrupted run
+    can resume where it stopped. Cities that can never be reported, e.g. 
+    cities that are not found, are recorded as failed so they are skipped 
+    too.
+
+    Attributes
+    ----------
+    output_format : str
+        'jsonl' or 'csv'.
+
+    Methods
+    -------
+    __init__(output, output_format='jsonl', progress_path=None, 
+             fields=REPORT_FIELDS)
+        Initializes the writer, writing the CSV header to an empty output.
+    write(row)
+        Writes a report row and marks its city as finished.
+    write_failure(city, reason)
+        Marks a city as failed for good.
+    close()
+        Closes the progress file.
+    """
+
+    def __init__(self, output, output_format='jsonl', progress_path=None,
+                 fields=REPORT_FIELDS):
+        """
+        Initializes the writer, writing the CSV header to an empty output.
+
+        Parameters
+        ----------
+        output : file
+            The open text file the rows are written to.
+        output_format : str, optional
+            'jsonl' (default) or 'csv'.
+        progress_path : str, optional
+            The progress file finished cities are appended to.
+        fields : list of str, optional
+            The columns of every row, in CSV order, defaults to 
+            REPORT_FIELDS.
+        """
+        self.output_format = output_format
+        self._output = output
+        self._progress = None
+        if progress_path is not None:
+            self._progress = open(progress_path, 'a', encoding='utf-8')
+        if output_format == 'csv':
+            self._csv = csv.DictWriter(output, fieldnames=fields)
+            if not output.seekable() or output.tell() == 0:
+                self._csv.writeheader()
+
+    def write(self, row):
+        """
+        Writes a report row and marks its city as finished.
+
+        Parameters
+        ----------
+        row : dict
+            One report row, keyed by the writer's fields.
+        """
+        if self.output_format == 'csv':
+            self._csv.writerow(row)
+        else:
+            self._output.write(json.dumps(row) + '\n')
+        self._output.flush()
+
+        #Only mark the city finished once its row is safely written
+        if self._progress is not None:
+            self._progress.write(row['city'] + '\n')
+            self._progress.flush()
+
+    def write_failure(self, city, reason):
+        """
+        Marks a city as failed for good, so a resumed run skips it. No row is 
+        written.
+
+        Parameters
+        ----------
+        city : str
+            The name of the city.
+        reason : str
+            Why the city cannot be reported, e.g. 'not found'.
+        """
+        if self._progress is not None:
+            self._progress.write(f'{city}\t{reason}\n')
+            self._progress.flush()
+
+    def close(self):
+        """
+        Closes the progress file.
+        """
+        if self._progress is not None:
+            self._progress.close()
+
+
+def run_batch_report(cities, month, year, writer, io_threads=16,
+                     workers=None):
+    """
+    Runs the batch report: downloads run in a thread pool, statistics run in
+    a process pool, and each city's row is written as soon as it is ready.
+    At most a few downloads per thread are in flight, so memory stays
+    bounded for long city lists.
+
+    Parameters
+    ----------
+    cities : list of str
+        The names of the cities.
+    month : int
+        The month to compare against (1 = January, ..., 12 = December).
+    year : int
+        The year of the historical data.
+    writer : ReportWriter
+        Receives the report rows.
+    io_threads : int, optional
+        The number of download threads, defaults to 16.
+    workers : int, optional
+        The number of statistics processes, defaults to the number of CPUs.
+
+    Returns
+    -------
+    int
+        The number of cities that could not be reported.
+    """
+    failures = 0
+    pending_cities = iter(cities)
+    max_downloads = io_threads * 4
+
+    with concurrent.futures.ThreadPoolExecutor(io_threads) as io_pool, \
+         concurrent.futures.ProcessPoolExecutor(
+             workers, mp_context=multiprocessing.get_context(
+                 PROCESS_START_METHOD)) as cpu_pool:
+        downloads = {}
+        analyses = {}
+
+        def refill():
+            #Keep the download stage full without queueing every city
+            while len(downloads) < max_downloads:
+                city = next(pending_cities, None)
+                if city is None:
+                    return
+                downloads[io_pool.submit(download_city, city, year)] = city
+
+        refill()
+        while downloads or analyses:
+            done, _ = concurrent.futures.wait(
+                list(downloads) + list(analyses),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    city = downloads.pop(future)
+                    try:
+                        city_data = future.result()
+                    except Exception as error:
+                        print(f'{city}: {error}', file=sys.stderr)
+                        failures += 1
+                        continue
+                    if city_data is None:
+                        #Looking the city up again would not find it either
+                        writer.write_failure(city, 'not found')
+                        failures += 1
+                        continue
+                    analyses[cpu_pool.submit(analyze_city, city_data,
+                                             month)] = city
+                else:
+                    city = analyses.pop(future)
+                    try:
+                        writer.write(future.result())
+                    except Exception as error:
+                        print(f'{city}: {error}', file=sys.stderr)
+                        failures += 1
+            refill()
+
+    return failures
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `python batch_report.py --help`.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments, defaults to sys.argv.
+
+    Returns
+    -------
+    int
+        The exit status, 1 if any city could not be reported.
+    """
+    parser = argparse.ArgumentParser(
+        description='Compares today\'s weather with the historical weather '
+                    'of many cities.')
+    parser.add_argument('cities', nargs='?', default='-',
+                        help='file with one city per line, - for stdin')
+    parser.add_argument('--month', type=int, required=True,
+                        help='month to compare against (1-12)')
+    parser.add_argument('--year', type=int, default=2023,
+                        help='year of the historical data')
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        default='jsonl', dest='output_format')
+    parser.add_argument('--output', default='-',
+                        help='report file, appended to, - for stdout')
+    parser.add_argument('--progress',
+                        help='progress file used to resume interrupted runs')
+    parser.add_argument('--io-threads', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.cities == '-':
+        cities = read_cities(sys.stdin)
+    else:
+        with open(args.cities, encoding='utf-8') as city_file:
+            cities = read_cities(city_file)
+
+    #Skip the cities a previous run already reported
+    finished = read_progress(args.progress)
+    cities = [city for city in cities if city not in finished]
+
+    if args.output == '-':
+        output = contextlib.nullcontext(sys.stdout)
+    else:
+        output = open(args.output, 'a', encoding='utf-8', newline='')
+    with output as report_file:
+        writer = ReportWriter(report_file, args.output_format, args.progress)
+        try:
+            failures = run_batch_report(cities, args.month, args.year, writer,
+                                        args.io_threads, args.workers)
+        finally:
+            writer.close()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,396 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from climate_store import ClimateStore
+from geocoding_cache import GeocodingCache
+from openmeteo_fixtures import (FixtureSessionManager, decode_responses,
+                                synthetic_response)
+from query_planner import DAILY_VARIABLES
+from temperature_classifier import QuantileTable, classify_day
+from weather_data_download import WeatherDataDownload, archive_params
+from weather_data_statistics import WeatherDataStatistics
+from weather_variables import decode_response
+
+#Offline benchmarks of the hot paths, from geocoding to rendering. Requests
+#are answered by synthetic FlatBuffers fixtures, so only our own code is
+#timed. Run `python benchmark.py`, results go to bench_output.txt and are
+#appended to the history file with the current commit, and every benchmark
+#is compared with the last run of an earlier commit. The history file is
+#local by default, in CI point --history or BENCH_HISTORY at a file that is
+#restored from and saved as a build artifact, so runs of every commit are
+#compared on the same machine type.
+
+CITY_SCALES = (1, 100, 10000)
+YEAR_SCALES = (1, 10, 50)
+QUICK_CITY_SCALES = (1, 100)
+QUICK_YEAR_SCALES = (1, 10)
+
+#A benchmark this much slower than on the previous commit is a regression
+REGRESSION_RATIO = 1.25
+
+#Where runs are recorded, unless --history is given
+HISTORY_PATH = os.environ.get('BENCH_HISTORY', '.bench_history.jsonl')
+
+def time_call(function, rounds):
+    """
+    Times a function over a few rounds.
+
+    Parameters
+    ----------
+    function : callable
+        Called without arguments.
+    rounds : int
+        The number of timed calls.
+
+    Returns
+    -------
+    dict
+        The fastest and the median time of a call, in seconds.
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': statistics.median(timings)}
+
+
+def city_names(count):
+    """
+    Returns made-up city names with coordinates spread over the US.
+
+    Parameters
+    ----------
+    count : int
+        The number of cities.
+
+    Returns
+    -------
+    dict
+        Maps each city name to its geocoding result.
+    """
+    rng = np.random.default_rng(0)
+    latitudes = np.round(rng.uniform(25, 49, count), 5)
+    longitudes = np.round(rng.uniform(-124, -67, count), 5)
+    return {f'City {index}': {'latitude': float(latitude),
+                              'longitude': float(longitude)}
+            for index, (latitude, longitude)
+            in enumerate(zip(latitudes, longitudes))}
+
+
+def _bench_geocoding(directory, cities, rounds):
+    cache = GeocodingCache(os.path.join(directory,
+                                        f'geocoding{cities}.sqlite'))
+    names = city_names(cities)
+    for name, result in names.items():
+        cache.put(name, result)
+
+    def lookup():
+        for name in names:
+            cache.lookup(name)
+
+    results = {'geocode_lookup': time_call(lookup, rounds)}
+    cache.close()
+    return results
+
+
+def _bench_decoding(cities, rounds):
+    names = city_names(cities)
+    params = archive_params(
+        ','.join(str(result['latitude']) for result in names.values()),
+        ','.join(str(result['longitude']) for result in names.values()),
+        '2023-01-01', '2023-12-31')
+    data = synthetic_response(params)
+
+    def decode():
+        for response in decode_responses(data):
+            decode_response(response, DAILY_VARIABLES)
+
+    return {'decode_historical': time_call(decode, rounds)}
+
+
+def _bench_historical_data(directory, years, rounds):
+    cache = GeocodingCache(os.path.join(directory, f'history{years}.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    start_date = datetime.date(2023 - years + 1, 1, 1)
+    end_date = datetime.date(2023, 12, 31)
+    rounds_done = [0]
+
+    def download():
+        #A fresh store every round, so every round decodes and stores
+        store = ClimateStore(os.path.join(directory,
+                             f'store{years}_{rounds_done[0]}'))
+        rounds_done[0] += 1
+        downloader = WeatherDataDownload('Irvine', cache,
+            FixtureSessionManager(), store)
+        downloader.sync_historical_data(start_date, end_date)
+
+    def read_back():
+        store = ClimateStore(os.path.join(directory, f'store{years}_0'))
+        downloader = WeatherDataDownload('Irvine', cache,
+            FixtureSessionManager(), store)
+        downloader.sync_historical_data(start_date, end_date)
+
+    results = {'get_historical_data': time_call(download, rounds),
+               'historical_data_from_store': time_call(read_back, rounds)}
+    cache.close()
+    return results
+
+
+def _bench_statistics(cities, years, rounds):
+    rng = np.random.default_rng(0)
+    series = rng.normal(65, 10, (years, 365)).astype(np.float32)
+    weather_stat = WeatherDataStatistics('Irvine')
+
+    def extract():
+        for _ in range(cities):
+            for daily_temp in series:
+                month = weather_stat.extract_data_for_month(daily_temp, 12)
+                weather_stat.max_temp(month)
+                weather_stat.min_temp(month)
+
+    return {'extract_max_min': time_call(extract, rounds)}
+
+
+def _bench_compare(cities, rounds):
+    rng = np.random.default_rng(0)
+    temps = rng.normal(65, 10, (cities, 2))
+    daily = rng.normal(65, 10, 365).astype(np.float32)
+    weather_stat = WeatherDataStatistics('Irvine')
+    month_stats = weather_stat.match_against_historical_weather(
+        12, 2023, daily, daily - 15)
+
+    def compare():
+        for today_max, today_min in temps:
+            weather_stat.compare_day_temps(today_max, month_stats)
+            weather_stat.compare_night_temps(today_min, month_stats)
+
+    tables = np.tile(QuantileTable.from_range(50, 80).breakpoints,
+                     (cities, 1))
+
+    def classify():
+        classify_day(tables, temps[:, 0])
+
+    return {'compare_temps': time_call(compare, rounds),
+            'classify_fleet': time_call(classify, rounds)}
+
+
+def _bench_rendering(cities, rounds):
+    rng = np.random.default_rng(0)
+    ranges = [(low, low + 20, today) for low, today in
+              zip(rng.uniform(30, 60, cities), rng.uniform(20, 90, cities))]
+    weather_stat = WeatherDataStatistics('Irvine')
+
+    def render():
+        #Print to a null stream, so the terminal is not timed
+        with open(os.devnull, 'w', encoding='utf-8') as null, \
+                contextlib.redirect_stdout(null):
+            for low, high, today in ranges:
+                weather_stat.print_range(low, high, today)
+
+    return {'print_range': time_call(render, rounds)}
+
+
+def run_benchmarks(city_scales=CITY_SCALES, year_scales=YEAR_SCALES,
+                   rounds=5):
+    """
+    Runs every benchmark at every scale.
+
+    Parameters
+    ----------
+    city_scales : tuple of int, optional
+        The numbers of cities, defaults to 1, 100 and 10000.
+    year_scales : tuple of int, optional
+        The numbers of years, defaults to 1, 10 and 50.
+    rounds : int, optional
+        The number of timed calls of each benchmark, defaults to 5.
+
+    Returns
+    -------
+    dict
+        Maps each benchmark name, with its scale, to its timings.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for cities in city_scales:
+            for name, timing in {
+                **_bench_geocoding(directory, cities, rounds),
+                **_bench_decoding(cities, rounds),
+                **_bench_compare(cities, rounds),
+                **_bench_rendering(cities, rounds),
+            }.items():
+                results[f'{name}[cities={cities}]'] = timing
+        for years in year_scales:
+            for name, timing in _bench_historical_data(directory, years,
+                                                      rounds).items():
+                results[f'{name}[years={years}]'] = timing
+            for cities in city_scales:
+                for name, timing in _bench_statistics(cities, years,
+                                                     rounds).items():
+                    results[f'{name}[cities={cities},years={years}]'] = timing
+    return results
+
+
+def current_commit():
+    """
+    Returns the commit the working tree is at.
+
+    Returns
+    -------
+    str or None
+        The commit hash, or None outside of a git repository.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(path):
+    """
+    Reads the results of earlier runs.
+
+    Parameters
+    ----------
+    path : str
+        The history file, one JSON run per line.
+
+    Returns
+    -------
+    list of dict
+        The runs in the order they were recorded.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+
+def find_regressions(results, baseline, ratio=REGRESSION_RATIO):
+    """
+    Compares the fastest times of two runs.
+
+    Parameters
+    ----------
+    results : dict
+        The timings of this run.
+    baseline : dict
+        The timings of the run to compare with.
+    ratio : float, optional
+        How much slower counts as a regression, defaults to
+        REGRESSION_RATIO.
+
+    Returns
+    -------
+    dict
+        Maps each regressed benchmark to how many times slower it is.
+    """
+    regressions = {}
+    for name, timing in results.items():
+        if name in baseline and baseline[name]['min'] > 0:
+            slowdown = timing['min'] / baseline[name]['min']
+            if slowdown > ratio:
+                regressions[name] = slowdown
+    return regressions
+
+
+def format_results(results, baseline=None):
+    """
+    Formats the timings as a table, with the change since the baseline.
+
+    Parameters
+    ----------
+    results : dict
+        The timings of this run.
+    baseline : dict, optional
+        The timings of the run to compare with.
+
+    Returns
+    -------
+    str
+        One line per benchmark.
+    """
+    baseline = baseline or {}
+    name_width = max(len(name) for name in results)
+    lines = [f'{"benchmark":<{name_width}}  {"min (ms)":>12}  '
+             f'{"median (ms)":>12}  {"change":>8}']
+    for name, timing in results.items():
+        change = ''
+        if name in baseline and baseline[name]['min'] > 0:
+            change = f'{timing["min"] / baseline[name]["min"] - 1:+.0%}'
+        lines.append(f'{name:<{name_width}}  {timing["min"] * 1000:>12.3f}  '
+                     f'{timing["median"] * 1000:>12.3f}  {change:>8}')
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `python benchmark.py --help`.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments, defaults to sys.argv.
+
+    Returns
+    -------
+    int
+        The exit status, 1 if --fail-on-regression is given and any
+        benchmark regressed.
+    """
+    parser = argparse.ArgumentParser(
+        description='Times the hot paths offline and tracks them per commit.')
+    parser.add_argument('--quick', action='store_true',
+                        help='skip the largest scales')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--output', default='bench_output.txt')
+    parser.add_argument('--history', default=HISTORY_PATH,
+                        help='the runs to compare with, e.g. a CI artifact, '
+                             'defaults to $BENCH_HISTORY or '
+                             '.bench_history.jsonl')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        results = run_benchmarks(QUICK_CITY_SCALES, QUICK_YEAR_SCALES,
+                                 args.rounds)
+    else:
+        results = run_benchmarks(rounds=args.rounds)
+
+    #Compare with the last run of an earlier commit
+    commit = current_commit()
+    earlier = [run for run in read_history(args.history)
+               if run['commit'] != commit]
+    baseline = earlier[-1]['results'] if earlier else {}
+    regressions = find_regressions(results, baseline)
+
+    report = format_results(results, baseline)
+    if earlier:
+        report += f'\ncompared with {earlier[-1]["commit"]}\n'
+    for name, slowdown in regressions.items():
+        report += f'REGRESSION {name}: {slowdown:.2f}x slower\n'
+    with open(args.output, 'w', encoding='utf-8') as output:
+        output.write(report)
+    sys.stdout.write(report)
+
+    with open(args.history, 'a', encoding='utf-8') as history_file:
+        history_file.write(json.dumps({
+            'commit': commit,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'results': results
+        }) + '\n')
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
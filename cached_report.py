@@ -0,0 +1,133 @@
+import argparse
+import sys
+import numpy as np
+from climate_store import get_default_climate_store
+from geocoding_cache import get_default_geocoding_cache
+from spatial_index import snap_to_grid
+from weather_calendar import local_today, resolve_timezone
+from weather_data_statistics import WeatherDataStatistics
+from weather_report import print_comparison, print_month_stats
+
+#Lightweight entry point for cron jobs: answers from the local geocoding cache
+#and climate store only, so the HTTP stack is never imported. Fill the stores
+#with main.py or batch_report.py first.
+
+def cached_month_stats(city_name, month, year, geocoding_cache=None,
+                       climate_store=None, grid_resolution=None):
+    """
+    Computes a month's historical extremes from the local stores only,
+    without sending any request.
+
+    Parameters
+    ----------
+    city_name : str
+        The name of the city.
+    month : int
+        The month (1 = January, 2 = February, ..., 12 = December).
+    year : int
+        The year of the historical data.
+    geocoding_cache : GeocodingCache, optional
+        Defaults to the cache shared by the whole process.
+    climate_store : ClimateStore, optional
+        Defaults to the store shared by the whole process.
+    grid_resolution : float, optional
+        The grid spacing in degrees the store was filled with, see
+        WeatherDataDownload, so the series are read at the coordinates of
+        the city's grid cell. Defaults to None, the exact coordinates.
+
+    Returns
+    -------
+    tuple of (WeatherDataStatistics, MonthStats) or None
+        The statistics instance and the month's extremes, or None if the
+        city or the month is not in the local stores.
+    """
+    if geocoding_cache is None:
+        geocoding_cache = get_default_geocoding_cache()
+    if climate_store is None:
+        climate_store = get_default_climate_store()
+
+    location = geocoding_cache.get(city_name)
+    if not location:
+        return None
+    if grid_resolution:
+        latitude, longitude = snap_to_grid(location['latitude'],
+                                           location['longitude'],
+                                           grid_resolution)
+    else:
+        latitude = str(location['latitude'])
+        longitude = str(location['longitude'])
+    timezone = resolve_timezone(location)
+
+    #The store keeps whole years, read them memory-mapped
+    series = [climate_store.read_year(latitude, longitude, variable, year, 
+                                      timezone)
+              for variable in ('temperature_2m_max', 'temperature_2m_min')]
+    if any(values is None for values in series):
+        return None
+
+    #Some day of the month was never downloaded
+    weather_stat = WeatherDataStatistics(city_name)
+    if any(np.isnan(weather_stat.extract_data_for_month(values, month,
+                                                        year)).any()
+           for values in series):
+        return None
+
+    month_stats = weather_stat.match_against_historical_weather(
+        month, year, *series)
+    return weather_stat, month_stats
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `python cached_report.py --help`.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments, defaults to sys.argv.
+
+    Returns
+    -------
+    int
+        The exit status, 1 if the city or month is not in the local stores.
+    """
+    parser = argparse.ArgumentParser(
+        description='Prints a month\'s historical weather from the local '
+                    'cache, without going to the network.')
+    parser.add_argument('city')
+    parser.add_argument('--month', type=int,
+                        help='month to report (1-12), defaults to the '
+                             'current month in the city\'s timezone')
+    parser.add_argument('--year', type=int, default=2023,
+                        help='year of the historical data')
+    parser.add_argument('--today-max', type=float,
+                        help='today\'s maximum temperature to compare')
+    parser.add_argument('--today-min', type=float,
+                        help='today\'s minimum temperature to compare')
+    parser.add_argument('--grid-resolution', type=float,
+                        help='grid spacing in degrees the stores were '
+                             'filled with, defaults to exact coordinates')
+    args = parser.parse_args(argv)
+
+    if args.month is None:
+        location = get_default_geocoding_cache().get(args.city)
+        args.month = local_today(resolve_timezone(location)).month
+
+    cached = cached_month_stats(args.city, args.month, args.year,
+                                grid_resolution=args.grid_resolution)
+    if cached is None:
+        print(f'{args.city}: {args.year}-{args.month:02d} is not cached, '
+              'run main.py or batch_report.py first', file=sys.stderr)
+        return 1
+
+    weather_stat, month_stats = cached
+    print_month_stats(month_stats)
+    if args.today_max is not None:
+        print_comparison(weather_stat.compare_day_temps(args.today_max))
+    if args.today_min is not None:
+        print_comparison(weather_stat.compare_night_temps(args.today_min))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
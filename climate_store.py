@@ -0,0 +1,477 @@
+import contextlib
+import datetime
+import os
+import threading
+import numpy as np
+from quantile_sketch import KLLSketch
+from weather_calendar import AUTO_TIMEZONE, day_of_year_index, days_in_year
+
+try:
+    import fcntl
+except ImportError: #Windows
+    fcntl = None
+    import msvcrt
+
+class ClimateStore:
+    """
+    Local columnar store of downloaded daily weather series, keyed by
+    (latitude, longitude, variable, date). Every location, variable and year
+    is kept in its own `.npy` file with one float32 value per day, so a series
+    is read back memory-mapped without copying, HTTP or FlatBuffers decoding.
+    Days that have not been downloaded are stored as NaN. A mask of the days
+    that were downloaded is kept next to every year, so a day the archive has
+    no data for is told apart from a day that was never asked for.
+
+    Writes to a location's variable hold a lock file, so worker processes
+    sharing a store never lose each other's days.
+
+    Quantile sketches of a month's values are kept next to the series, so
+    approximate percentiles over many years never read the series again.
+
+    Days are local to a timezone, so series counted in a named timezone are
+    kept under their own location, e.g. `<latitude>_<longitude>_Europe-Berlin`
+    for 'Europe/Berlin'. Cities that share coordinates but not a timezone
+    then never share days.
+
+    Layout: <root>/<location>/<variable>/<year>.npy,
+    <root>/<location>/<variable>/fetched/<year>.npy and
+    <root>/<location>/<variable>/sketches/<year>-<month>.npy
+
+    Attributes
+    ----------
+    root : str
+        The directory holding the store.
+
+    Methods
+    -------
+    __init__(root='.climate_store')
+        Initializes the store in the given directory.
+    has_year(latitude, longitude, variable, year, timezone=None)
+        Checks whether any data of the given year is stored.
+    read_year(latitude, longitude, variable, year, timezone=None)
+        Returns the stored series of the given year, memory-mapped.
+    write_year(latitude, longitude, variable, year, values, fetched=None,
+               timezone=None)
+        Stores the series of a whole year.
+    read_range(latitude, longitude, variable, start_date, end_date,
+               timezone=None)
+        Returns the stored series between two dates.
+    read_fetched(latitude, longitude, variable, start_date, end_date,
+                 timezone=None)
+        Returns which days between two dates have been downloaded.
+    write_range(latitude, longitude, variable, start_date, values,
+                fetched=None, timezone=None)
+        Stores a series starting at the given date, merging it with the data
+        already stored.
+    read_sketch(latitude, longitude, variable, year, month, timezone=None)
+        Returns the stored quantile sketch of a month.
+    write_sketch(latitude, longitude, variable, year, month, sketch,
+                 timezone=None)
+        Stores the quantile sketch of a month.
+    """
+
+    def __init__(self, root='.climate_store'):
+        """
+        Initializes the store in the given directory.
+
+        Parameters
+        ----------
+        root : str, optional
+            The directory holding the store, defaults to '.climate_store' in
+            the working directory.
+        """
+        self.root = root
+        self._lock = threading.Lock()
+
+    def has_year(self, latitude, longitude, variable, year, timezone=None):
+        """
+        Checks whether any data of the given year is stored.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        year : int
+            The year to check.
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+
+        Returns
+        -------
+        bool
+            True if the year's file exists.
+        """
+        return os.path.exists(self._path(latitude, longitude, variable, year,
+                                         timezone))
+
+    def read_year(self, latitude, longitude, variable, year, timezone=None):
+        """
+        Returns the stored series of the given year, memory-mapped read-only
+        so that no data is copied.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        year : int
+            The year to read.
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            One value per day of the year, NaN for days not downloaded, or
+            None if nothing is stored for the year.
+        """
+        path = self._path(latitude, longitude, variable, year, timezone)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def write_year(self, latitude, longitude, variable, year, values,
+                   fetched=None, timezone=None):
+        """
+        Stores the series of a whole year, replacing what was stored before.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        year : int
+            The year of the series.
+        values : numpy.ndarray
+            One value per day of the year.
+        fetched : numpy.ndarray of bool, optional
+            The days the archive has answered for, even with NaN, so they are
+            not downloaded again. Defaults to the days with known values.
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+        """
+        values = np.asarray(values, dtype=np.float32)
+        if len(values) != days_in_year(year):
+            raise ValueError(
+                f'{year} has {days_in_year(year)} days, got {len(values)}')
+        fetched = _fetched_mask(values, fetched)
+        with self._lock, _file_lock(self._lock_path(latitude, longitude,
+                                                    variable, timezone)):
+            self._save(self._path(latitude, longitude, variable, year,
+                                  timezone), values)
+            self._save(self._fetched_path(latitude, longitude, variable,
+                                          year, timezone), fetched)
+
+    def read_range(self, latitude, longitude, variable, start_date,
+                   end_date, timezone=None):
+        """
+        Returns the stored series between two dates, both included. A range
+        within a single year is a view of the memory-mapped file.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        start_date : datetime.date
+            The first day of the range.
+        end_date : datetime.date
+            The last day of the range.
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+
+        Returns
+        -------
+        numpy.ndarray
+            One value per day of the range, NaN for days not stored.
+        """
+        parts = []
+        for year in range(start_date.year, end_date.year + 1):
+            first = max(start_date, datetime.date(year, 1, 1))
+            last = min(end_date, datetime.date(year, 12, 31))
+            start = day_of_year_index(first)
+            end = day_of_year_index(last) + 1
+
+            stored = self.read_year(latitude, longitude, variable, year,
+                                    timezone)
+            if stored is None:
+                parts.append(np.full(end - start, np.nan, dtype=np.float32))
+            else:
+                parts.append(stored[start:end])
+
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def read_fetched(self, latitude, longitude, variable, start_date,
+                     end_date, timezone=None):
+        """
+        Returns which days between two dates, both included, have been
+        downloaded, including the days the archive has no data for.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        start_date : datetime.date
+            The first day of the range.
+        end_date : datetime.date
+            The last day of the range.
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            One flag per day of the range, True for days downloaded before.
+        """
+        parts = []
+        for year in range(start_date.year, end_date.year + 1):
+            first = max(start_date, datetime.date(year, 1, 1))
+            last = min(end_date, datetime.date(year, 12, 31))
+            start = day_of_year_index(first)
+            end = day_of_year_index(last) + 1
+
+            stored = self.read_year(latitude, longitude, variable, year,
+                                    timezone)
+            if stored is None:
+                parts.append(np.zeros(end - start, dtype=bool))
+                continue
+            #Days with a value are downloaded, also in stores without masks
+            fetched = ~np.isnan(stored[start:end])
+            path = self._fetched_path(latitude, longitude, variable, year,
+                                      timezone)
+            if os.path.exists(path):
+                fetched |= np.load(path)[start:end]
+            parts.append(fetched)
+        return np.concatenate(parts)
+
+    def write_range(self, latitude, longitude, variable, start_date, values,
+                    fetched=None, timezone=None):
+        """
+        Stores a series starting at the given date, merging it with the data
+        already stored. NaN values never overwrite stored values.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        start_date : datetime.date
+            The day of the first value.
+        values : numpy.ndarray
+            One value per day starting at `start_date`.
+        fetched : numpy.ndarray of bool, optional
+            The days the archive has answered for, even with NaN, so they are
+            not downloaded again. Defaults to the days with known values.
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+        """
+        values = np.asarray(values, dtype=np.float32)
+        fetched = _fetched_mask(values, fetched)
+        end_date = start_date + datetime.timedelta(days=len(values) - 1)
+        offset = 0
+        #Read, merge and save under one lock, other processes may write the
+        #same years
+        with self._lock, _file_lock(self._lock_path(latitude, longitude,
+                                                    variable, timezone)):
+            for year in range(start_date.year, end_date.year + 1):
+                first = max(start_date, datetime.date(year, 1, 1))
+                last = min(end_date, datetime.date(year, 12, 31))
+                start = day_of_year_index(first)
+                count = day_of_year_index(last) + 1 - start
+
+                path = self._path(latitude, longitude, variable, year,
+                                  timezone)
+                fetched_path = self._fetched_path(latitude, longitude,
+                                                  variable, year, timezone)
+                if os.path.exists(path):
+                    merged = np.array(np.load(path))
+                else:
+                    merged = np.full(days_in_year(year), np.nan,
+                                     dtype=np.float32)
+                if os.path.exists(fetched_path):
+                    merged_fetched = np.array(np.load(fetched_path))
+                else:
+                    merged_fetched = ~np.isnan(merged)
+
+                #Only overwrite stored days with values that are known
+                new_values = values[offset:offset + count]
+                known = ~np.isnan(new_values)
+                merged[start:start + count][known] = new_values[known]
+                merged_fetched[start:start + count] |= (
+                    fetched[offset:offset + count])
+                self._save(path, merged)
+                self._save(fetched_path, merged_fetched)
+                offset += count
+
+    def read_sketch(self, latitude, longitude, variable, year, month,
+                    timezone=None):
+        """
+        Returns the stored quantile sketch of a month's daily values.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        year : int
+            The year of the month.
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+
+        Returns
+        -------
+        KLLSketch or None
+            The sketch, or None if none is stored.
+        """
+        path = self._sketch_path(latitude, longitude, variable, year, month,
+                                 timezone)
+        if not os.path.exists(path):
+            return None
+        return KLLSketch.from_array(np.load(path))
+
+    def write_sketch(self, latitude, longitude, variable, year, month,
+                     sketch, timezone=None):
+        """
+        Stores the quantile sketch of a month's daily values, replacing what 
+        was stored before.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the location.
+        longitude : str or float
+            The longitude of the location.
+        variable : str
+            The name of the variable, e.g. 'temperature_2m_max'.
+        year : int
+            The year of the month.
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+        sketch : KLLSketch
+            The sketch of the month's values.
+        timezone : str, optional
+            The timezone the days are counted in, series of other timezones
+            are kept apart. Defaults to None, stored like AUTO_TIMEZONE.
+        """
+        with self._lock:
+            self._save(self._sketch_path(latitude, longitude, variable, year,
+                                         month, timezone), sketch.to_array())
+
+    def _path(self, latitude, longitude, variable, year, timezone):
+        return os.path.join(self.root,
+                            _location(latitude, longitude, timezone),
+                            variable, f'{year}.npy')
+
+    def _lock_path(self, latitude, longitude, variable, timezone):
+        return os.path.join(self.root,
+                            _location(latitude, longitude, timezone),
+                            variable, '.lock')
+
+    def _fetched_path(self, latitude, longitude, variable, year, timezone):
+        return os.path.join(self.root,
+                            _location(latitude, longitude, timezone),
+                            variable, 'fetched', f'{year}.npy')
+
+    def _sketch_path(self, latitude, longitude, variable, year, month,
+                     timezone):
+        return os.path.join(self.root,
+                            _location(latitude, longitude, timezone),
+                            variable, 'sketches', f'{year}-{month:02d}.npy')
+
+    def _save(self, path, values):
+        #Write to a temporary file first so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            np.save(file, values)
+        os.replace(temporary_path, path)
+
+
+def _location(latitude, longitude, timezone):
+    #Directory of a location, days counted in a named timezone are kept apart
+    location = f'{float(latitude):.5f}_{float(longitude):.5f}'
+    if timezone is None or timezone == AUTO_TIMEZONE:
+        return location
+    return f"{location}_{timezone.replace('/', '-')}"
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    #Hold an exclusive lock on the file, shared by every process
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+b') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _fetched_mask(values, fetched):
+    #Days with known values are always downloaded, NaN days only if flagged
+    known = ~np.isnan(values)
+    if fetched is None:
+        return known
+    return known | np.asarray(fetched, dtype=bool)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_default_climate_store():
+    """
+    Returns the climate store shared by every WeatherDataDownload instance in
+    this process, creating it on first use.
+
+    Returns
+    -------
+    ClimateStore
+        The process-wide climate store.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ClimateStore()
+        return _default_store
@@ -0,0 +1,230 @@
+import datetime
+import warnings
+import numpy as np
+
+#Number of days in each month of the 366-day, leap-aligned year used for the
+#columns of a climatology
+DAYS_PER_MONTH_LEAP = np.array([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30,
+                                31])
+MONTH_STARTS_LEAP = np.concatenate(([0], np.cumsum(DAYS_PER_MONTH_LEAP)[:-1]))
+FEB_29_INDEX = 59
+
+class Climatology:
+    """
+    Multi-year climatology of daily maximum and minimum temperatures for one
+    city. The daily series of N years are held in two 2-D arrays (years x
+    day-of-year) on a leap-aligned 366-day calendar, where non-leap years
+    have NaN on February 29. Minimum, maximum, mean, standard deviation and
+    percentiles are computed once, per month and per day of the year, so
+    later lookups are O(1).
+
+    Attributes
+    ----------
+    years : list of int
+        The years the climatology is built from, one row each.
+    daily_temperature_2m_max : numpy.ndarray
+        The daily maximum temperatures(°F), shape (years, 366).
+    daily_temperature_2m_min : numpy.ndarray
+        The daily minimum temperatures(°F), shape (years, 366).
+    percentiles : tuple of float
+        The percentiles computed for every month and day of the year.
+    by_month : dict
+        Maps each variable name to a dict of statistics ('min', 'max',
+        'mean', 'std', 'count' with shape (12,) and 'percentiles' with shape
+        (12, len(percentiles))).
+    by_day_of_year : dict
+        Same as `by_month`, with 366 rows instead of 12.
+
+    Methods
+    -------
+    __init__(years, daily_max, daily_min, percentiles=(10, 25, 50, 75, 90))
+        Builds the climatology from the per-year daily series.
+    month_stats(variable, month)
+        Returns the statistics of a variable for the given month.
+    day_stats(variable, date)
+        Returns the statistics of a variable for the given day of the year.
+    month_values(variable, month)
+        Returns every known daily value of a variable in the given month.
+    """
+
+    variables = ('temperature_2m_max', 'temperature_2m_min')
+
+    def __init__(self, years, daily_max, daily_min,
+                 percentiles=(10, 25, 50, 75, 90)):
+        """
+        Builds the climatology from the per-year daily series.
+
+        Parameters
+        ----------
+        years : list of int
+            The years of the series.
+        daily_max : list of numpy.ndarray
+            The daily maximum temperatures of every year, 365 or 366 values
+            each.
+        daily_min : list of numpy.ndarray
+            The daily minimum temperatures of every year, 365 or 366 values
+            each.
+        percentiles : tuple of float, optional
+            The percentiles to compute, defaults to (10, 25, 50, 75, 90).
+        """
+        self.years = list(years)
+        self.percentiles = tuple(percentiles)
+        self.daily_temperature_2m_max = np.vstack(
+            [leap_aligned(series) for series in daily_max])
+        self.daily_temperature_2m_min = np.vstack(
+            [leap_aligned(series) for series in daily_min])
+
+        self.by_month = {}
+        self.by_day_of_year = {}
+        for variable in self.variables:
+            values = getattr(self, 'daily_' + variable)
+            self.by_day_of_year[variable] = _day_of_year_stats(
+                values, self.percentiles)
+            self.by_month[variable] = _month_stats(values, self.percentiles)
+
+    def month_stats(self, variable, month):
+        """
+        Returns the statistics of a variable for the given month.
+
+        Parameters
+        ----------
+        variable : str
+            'temperature_2m_max' or 'temperature_2m_min'.
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+
+        Returns
+        -------
+        dict
+            Maps 'min', 'max', 'mean', 'std' and 'count' to a float and
+            'percentiles' to an array matching `percentiles`.
+        """
+        stats = self.by_month[variable]
+        return {name: stats[name][month - 1] for name in stats}
+
+    def day_stats(self, variable, date):
+        """
+        Returns the statistics of a variable for the given day of the year.
+
+        Parameters
+        ----------
+        variable : str
+            'temperature_2m_max' or 'temperature_2m_min'.
+        date : datetime.date
+            Any date, only its month and day are used.
+
+        Returns
+        -------
+        dict
+            Same as `month_stats()`.
+        """
+        index = leap_aligned_index(date)
+        stats = self.by_day_of_year[variable]
+        return {name: stats[name][index] for name in stats}
+
+    def month_values(self, variable, month):
+        """
+        Returns every known daily value of a variable in the given month,
+        across all years.
+
+        Parameters
+        ----------
+        variable : str
+            'temperature_2m_max' or 'temperature_2m_min'.
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+
+        Returns
+        -------
+        numpy.ndarray
+            The known values, without NaN.
+        """
+        start = MONTH_STARTS_LEAP[month - 1]
+        end = start + DAYS_PER_MONTH_LEAP[month - 1]
+        values = getattr(self, 'daily_' + variable)[:, start:end].ravel()
+        return values[~np.isnan(values)]
+
+
+def leap_aligned(series):
+    """
+    Places a year of daily values on the 366-day, leap-aligned calendar by
+    inserting NaN on February 29 for non-leap years.
+
+    Parameters
+    ----------
+    series : numpy.ndarray
+        365 or 366 daily values.
+
+    Returns
+    -------
+    numpy.ndarray
+        366 float values.
+    """
+    series = np.asarray(series, dtype=np.float64)
+    if len(series) == 366:
+        return series
+    return np.insert(series, FEB_29_INDEX, np.nan)
+
+
+def leap_aligned_index(date):
+    """
+    Returns the column of the given date on the 366-day, leap-aligned
+    calendar.
+
+    Parameters
+    ----------
+    date : datetime.date
+        Any date, only its month and day are used.
+
+    Returns
+    -------
+    int
+        0 for January 1, 59 for February 29, 365 for December 31.
+    """
+    return datetime.date(2000, date.month, date.day).timetuple().tm_yday - 1
+
+
+def _day_of_year_stats(values, percentiles):
+    #Reduce over the years, one row per day of the year. Days without data
+    #in any year (February 29 without a leap year) stay NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return {
+            'min': np.nanmin(values, axis=0),
+            'max': np.nanmax(values, axis=0),
+            'mean': np.nanmean(values, axis=0),
+            'std': np.nanstd(values, axis=0),
+            'count': np.sum(~np.isnan(values), axis=0),
+            'percentiles': np.nanpercentile(values, percentiles, axis=0).T
+        }
+
+
+def _month_stats(values, percentiles):
+    #The columns are in calendar order, so every month is a contiguous block
+    #and min, max, sums and counts reduce per block in one pass
+    known = ~np.isnan(values)
+    filled = np.where(known, values, 0)
+    count = np.add.reduceat(known.sum(axis=0), MONTH_STARTS_LEAP)
+    total = np.add.reduceat(filled.sum(axis=0), MONTH_STARTS_LEAP)
+    squares = np.add.reduceat((filled ** 2).sum(axis=0), MONTH_STARTS_LEAP)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = total / count
+        minimum = np.fmin.reduceat(np.nanmin(values, axis=0),
+                                   MONTH_STARTS_LEAP)
+        maximum = np.fmax.reduceat(np.nanmax(values, axis=0),
+                                   MONTH_STARTS_LEAP)
+        std = np.sqrt(np.maximum(squares / count - mean ** 2, 0))
+
+    #Percentiles need the values themselves, one sort per month
+    month_percentiles = np.full((12, len(percentiles)), np.nan)
+    for month in range(12):
+        start = MONTH_STARTS_LEAP[month]
+        block = values[:, start:start + DAYS_PER_MONTH_LEAP[month]]
+        block = block[~np.isnan(block)]
+        if len(block):
+            month_percentiles[month] = np.percentile(block, percentiles)
+
+    return {'min': minimum, 'max': maximum, 'mean': mean, 'std': std,
+            'count': count, 'percentiles': month_percentiles}
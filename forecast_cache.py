@@ -0,0 +1,219 @@
+import concurrent.futures
+import threading
+import time
+from typing import NamedTuple
+from session_manager import get_default_session_manager
+from weather_calendar import AUTO_TIMEZONE, local_today
+from weather_data_download import fetch_forecast
+
+class ForecastReading(NamedTuple):
+    """
+    A forecast served by ForecastCache.get(), with its staleness metadata.
+    """
+    today_max_day_temp: float
+    today_min_night_temp: float
+    fetched_at: float
+    age: float
+    stale: bool
+    refreshing: bool
+    error: Exception
+
+
+class ForecastCache:
+    """
+    Stale-while-revalidate cache of today's forecast per location. After the
+    first download a forecast is always served immediately from memory; once
+    it gets close to expiring it is refreshed by a background worker thread,
+    so callers never wait on the forecast API at the top of the hour. If a
+    refresh fails the last good forecast keeps being served, marked stale,
+    for at most `max_stale` seconds. A forecast is never served after the
+    day it was downloaded on ends in the location's timezone, since it is
+    the forecast of another day.
+
+    Attributes
+    ----------
+    ttl : float
+        Seconds a forecast is fresh, the same hour as the HTTP cache.
+    refresh_ahead : float
+        Seconds before expiry at which a background refresh starts.
+    max_stale : float
+        Seconds after which a forecast is no longer served, a failed download
+        is raised instead.
+
+    Methods
+    -------
+    __init__(session_manager=None, ttl=3600, refresh_ahead=300,
+             max_workers=4, fetch=None, clock=time.time, max_stale=None)
+        Initializes an empty cache.
+    get(latitude, longitude, hourly=False, timezone=AUTO_TIMEZONE)
+        Returns the last good forecast of a location, downloading it only if
+        the location was never seen.
+    refresh(latitude, longitude, hourly=False, timezone=AUTO_TIMEZONE)
+        Starts a background refresh of a location's forecast.
+    close()
+        Waits for running refreshes and stops the worker threads.
+    """
+
+    def __init__(self, session_manager=None, ttl=3600, refresh_ahead=300,
+                 max_workers=4, fetch=None, clock=time.time, max_stale=None):
+        """
+        Initializes an empty cache.
+
+        Parameters
+        ----------
+        session_manager : SessionManager, optional
+            Provides the forecast API client, defaults to the session
+            manager shared by the whole process.
+        ttl : float, optional
+            Seconds a forecast is fresh, defaults to 3600.
+        refresh_ahead : float, optional
+            Seconds before expiry at which a background refresh starts,
+            defaults to 300.
+        max_workers : int, optional
+            The number of background refresh threads, defaults to 4.
+        fetch : callable, optional
+            fetch(latitude, longitude, refresh, hourly, timezone) returns
+            today's max and min temperatures, `refresh` is True for
+            background refreshes that must bypass the HTTP cache, `hourly`
+            asks for the hourly aggregates and `timezone` decides what today
+            is. Defaults to the forecast API.
+        clock : callable, optional
+            Returns the current time in seconds, defaults to time.time.
+        max_stale : float, optional
+            Seconds after which a forecast whose refreshes keep failing is no
+            longer served, defaults to six times `ttl`.
+        """
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.max_stale = 6 * ttl if max_stale is None else max_stale
+        self._session_manager = session_manager
+        self._fetch = self._download if fetch is None else fetch
+        self._clock = clock
+        self._entries = {}
+        self._refreshing = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix='forecast-refresh')
+
+    def get(self, latitude, longitude, hourly=False,
+            timezone=AUTO_TIMEZONE):
+        """
+        Returns the last good forecast of a location, downloading it only if
+        the location was never seen, or if its forecast is older than
+        `max_stale` or from an earlier day. A forecast close to expiry is
+        returned as is while a background refresh replaces it.
+
+        Parameters
+        ----------
+        latitude : str
+            The latitude of the location.
+        longitude : str
+            The longitude of the location.
+        hourly : bool, optional
+            Serves today's high between 06:00 and 18:00 and tonight's low
+            from 18:00 to 06:00 instead of the daily max and min, cached
+            separately. Defaults to False.
+        timezone : str, optional
+            The location's timezone, which decides what today is. Defaults
+            to AUTO_TIMEZONE.
+
+        Returns
+        -------
+        ForecastReading
+            The forecast and how old it is.
+
+        Raises
+        ------
+        Exception
+            The download's error, when there is no forecast to serve.
+        """
+        key = (latitude, longitude, hourly, timezone)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+        expired = entry is not None and (
+            now - entry[2] >= self.max_stale or
+            entry[3] != local_today(timezone, now))
+        if entry is None or expired:
+            #Nothing to serve, wait for a download shared by concurrent
+            #callers
+            self._schedule(key, refresh=expired).result()
+            with self._lock:
+                entry = self._entries[key]
+        elif now - entry[2] >= self.ttl - self.refresh_ahead:
+            self._schedule(key, refresh=True)
+
+        today_max_day_temp, today_min_night_temp, fetched_at, _ = entry
+        age = self._clock() - fetched_at
+        with self._lock:
+            refreshing = key in self._refreshing
+            error = self._errors.get(key)
+        return ForecastReading(today_max_day_temp, today_min_night_temp,
+                               fetched_at, age, age >= self.ttl, refreshing,
+                               error)
+
+    def refresh(self, latitude, longitude, hourly=False,
+                timezone=AUTO_TIMEZONE):
+        """
+        Starts a background refresh of a location's forecast, e.g. to warm
+        the cache for a list of cities.
+
+        Parameters
+        ----------
+        latitude : str
+            The latitude of the location.
+        longitude : str
+            The longitude of the location.
+        hourly : bool, optional
+            Refreshes the hourly aggregates, defaults to False.
+        timezone : str, optional
+            The location's timezone, defaults to AUTO_TIMEZONE.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Done once the forecast is refreshed.
+        """
+        return self._schedule((latitude, longitude, hourly, timezone),
+                              refresh=True)
+
+    def close(self):
+        """
+        Waits for running refreshes and stops the worker threads.
+        """
+        self._executor.shutdown(wait=True)
+
+    def _schedule(self, key, refresh):
+        #At most one download per location at a time
+        with self._lock:
+            future = self._refreshing.get(key)
+            if future is None:
+                future = self._executor.submit(self._update, key, refresh)
+                self._refreshing[key] = future
+            return future
+
+    def _update(self, key, refresh):
+        try:
+            today_max_day_temp, today_min_night_temp = self._fetch(
+                *key[:2], refresh, *key[2:])
+        except Exception as error:
+            #Keep serving the last good forecast, first downloads re-raise
+            with self._lock:
+                self._errors[key] = error
+                del self._refreshing[key]
+            raise
+        fetched_at = self._clock()
+        with self._lock:
+            self._entries[key] = (today_max_day_temp, today_min_night_temp,
+                                  fetched_at, local_today(key[3], fetched_at))
+            self._errors.pop(key, None)
+            del self._refreshing[key]
+
+    def _download(self, latitude, longitude, refresh, hourly, timezone):
+        session_manager = self._session_manager
+        if session_manager is None:
+            session_manager = get_default_session_manager()
+        return fetch_forecast(session_manager.forecast_client(), latitude,
+                              longitude, hourly, timezone,
+                              force_refresh=refresh)
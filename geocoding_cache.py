@@ -0,0 +1,303 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+#Point the API at another server, e.g. the local stand-in server of 
+#openmeteo_stub_server.py, with the OPENMETEO_GEOCODING_URL variable
+GEOCODING_URL = os.environ.get('OPENMETEO_GEOCODING_URL',
+    'https://geocoding-api.open-meteo.com/v1/search')
+
+class GeocodingCache:
+    """
+    Persistent store of Open-Meteo geocoding results, keyed on the normalized
+    city name. Results are kept in an on-disk SQLite index with an in-process
+    LRU in front of it, so a repeated lookup never touches the network.
+
+    Attributes
+    ----------
+    path : str
+        The location of the SQLite file that holds the geocoding index.
+    max_memory_entries : int
+        The number of results kept in the in-process LRU.
+
+    Methods
+    -------
+    __init__(path='.geocoding.sqlite', max_memory_entries=4096)
+        Opens (or creates) the on-disk index at the given path.
+    normalize_name(city_name)
+        Normalizes a city name into the key used by the cache.
+    get(city_name)
+        Returns the cached geocoding result for the city, if any.
+    put(city_name, result)
+        Stores a geocoding result for the city in memory and on disk.
+    lookup(city_name)
+        Returns the geocoding result for the city, fetching it from the Open-
+        Meteo geocoding API only when it is not cached yet.
+    items()
+        Returns every city found so far with its geocoding result.
+    close()
+        Closes the on-disk index.
+    """
+
+    def __init__(self, path='.geocoding.sqlite', max_memory_entries=4096):
+        """
+        Opens (or creates) the on-disk index at the given path.
+
+        Parameters
+        ----------
+        path : str, optional
+            The location of the SQLite file, defaults to
+            '.geocoding.sqlite' in the working directory.
+        max_memory_entries : int, optional
+            The number of results kept in the in-process LRU, defaults to
+            4096.
+        """
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        #One connection shared by all threads, guarded by the lock above
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS geocoding '
+            '(name TEXT PRIMARY KEY, result TEXT NOT NULL)'
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def normalize_name(city_name):
+        """
+        Normalizes a city name into the key used by the cache, so that
+        'Irvine', ' irvine ' and 'IRVINE' share one entry.
+
+        Parameters
+        ----------
+        city_name : str
+            The name of the city.
+
+        Returns
+        -------
+        str
+            The case-folded city name with collapsed whitespace.
+        """
+        return ' '.join(city_name.split()).casefold()
+
+    def get(self, city_name):
+        """
+        Returns the cached geocoding result for the city, if any.
+
+        Parameters
+        ----------
+        city_name : str
+            The name of the city.
+
+        Returns
+        -------
+        dict or None
+            The first geocoding result for the city, an empty dict if the
+            city is known not to exist, or None if the city is not cached.
+        """
+        key = self.normalize_name(city_name)
+        with self._lock:
+            #Fast path, the result is already in memory
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            row = self._connection.execute(
+                'SELECT result FROM geocoding WHERE name = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            result = json.loads(row[0])
+            self._remember(key, result)
+            return result
+
+    def put(self, city_name, result):
+        """
+        Stores a geocoding result for the city in memory and on disk.
+
+        Parameters
+        ----------
+        city_name : str
+            The name of the city.
+        result : dict
+            The first geocoding result for the city, or an empty dict if the
+            city could not be found.
+        """
+        key = self.normalize_name(city_name)
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO geocoding (name, result) VALUES (?, ?)',
+                (key, json.dumps(result))
+            )
+            self._connection.commit()
+            self._remember(key, result)
+
+    def lookup(self, city_name):
+        """
+        Returns the geocoding result for the city, fetching it from the Open-
+        Meteo geocoding API only when it is not cached yet.
+
+        Parameters
+        ----------
+        city_name : str
+            The name of the city.
+
+        Returns
+        -------
+        dict
+            The first geocoding result for the city, or an empty dict if the
+            city could not be found.
+
+        Raises
+        ------
+        requests.HTTPError
+            If the geocoding API answers with an error status, nothing is 
+            cached so the next lookup asks again.
+        ValueError
+            If the geocoding API answers with an error body.
+        """
+        result = self.get(city_name)
+        if result is None:
+            result = fetch_geocoding_result(city_name)
+            self.put(city_name, result)
+        return result
+
+    def items(self):
+        """
+        Returns every city found so far with its geocoding result, e.g. to 
+        build a SpatialIndex. Cities known not to exist are left out.
+
+        Returns
+        -------
+        list of tuple
+            (normalized city name, geocoding result) pairs.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT name, result FROM geocoding').fetchall()
+        items = []
+        for name, result in rows:
+            result = json.loads(result)
+            if result:
+                items.append((name, result))
+        return items
+
+    def close(self):
+        """
+        Closes the on-disk index.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def _remember(self, key, result):
+        #Keep the most recently used results in memory, drop the oldest
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+
+def fetch_geocoding_result(city_name):
+    """
+    Finds the given city using the Open-Meteo geocoding API.
+
+    Parameters
+    ----------
+    city_name : str
+        The name of the city.
+
+    Returns
+    -------
+    dict
+        The first geocoding result for the city, or an empty dict if the city
+        could not be found.
+
+    Raises
+    ------
+    requests.HTTPError
+        If the geocoding API answers with an error status, e.g. 429.
+    ValueError
+        If the geocoding API answers with an error body.
+    """
+    #Import the HTTP stack on first use, so cache hits never load it
+    import requests
+
+    #Send a request to Open-Meteo geocoding API to fetch the city's location
+    #data. Errors must not be mistaken for a city that does not exist.
+    result_city = requests.get(url = GEOCODING_URL,
+                               params = geocoding_params(city_name))
+    result_city.raise_for_status()
+    return first_geocoding_result(result_city.json())
+
+
+def geocoding_params(city_name):
+    """
+    Builds the query parameters of an Open-Meteo geocoding request.
+
+    Parameters
+    ----------
+    city_name : str
+        The name of the city.
+
+    Returns
+    -------
+    dict
+        The query parameters for the geocoding API.
+    """
+    return {'name': city_name, 'count': 1, 'language': 'en', 
+            'format': 'json'}
+
+
+def first_geocoding_result(location):
+    """
+    Extracts the first result from a decoded geocoding API response.
+
+    Parameters
+    ----------
+    location : dict
+        The decoded JSON body of a geocoding API response.
+
+    Returns
+    -------
+    dict
+        The first geocoding result, or an empty dict if the city could not 
+        be found.
+
+    Raises
+    ------
+    ValueError
+        If the response is an API error, e.g. {'error': True, 'reason': 
+        ...}, which must not be cached as a city not found.
+    """
+    if location.get('error'):
+        raise ValueError(f"geocoding failed: {location.get('reason')}")
+    if 'results' in location:
+        return location['results'][0]
+    return {}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_geocoding_cache():
+    """
+    Returns the geocoding cache shared by every WeatherDataDownload and
+    WeatherDataStatistics instance in this process, creating it on first use.
+
+    Returns
+    -------
+    GeocodingCache
+        The process-wide geocoding cache.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = GeocodingCache()
+        return _default_cache
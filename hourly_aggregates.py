@@ -0,0 +1,205 @@
+import numpy as np
+
+#Daily series derived from hourly data, by our own definitions of day and
+#night. Every aggregate is a reshape of the hourly buffer into one row per day
+#and a reduce along the rows, without a Python loop over days or hours.
+
+#The hourly variables the hourly ingestion mode downloads
+HOURLY_VARIABLES = ('temperature_2m',)
+
+#(first hour, hour after the last) in local time, a night runs from 18:00 to
+#06:00 of the next morning
+DAY_WINDOW = (6, 18)
+NIGHT_WINDOW = (18, 6)
+
+#Maps each derived daily variable to its (hourly variable, window, reduce)
+HOURLY_AGGREGATES = {
+    'temperature_2m_day_max': ('temperature_2m', DAY_WINDOW, np.fmax),
+    'temperature_2m_night_min': ('temperature_2m', NIGHT_WINDOW, np.fmin),
+}
+
+def window_length(window):
+    """
+    Returns the number of hours in a window.
+
+    Parameters
+    ----------
+    window : tuple of int
+        The first hour and the hour after the last, e.g. (18, 6) for 18:00 to
+        06:00. (0, 0) is the whole day.
+
+    Returns
+    -------
+    int
+        The number of hours, from 1 to 24.
+    """
+    return (window[1] - window[0]) % 24 or 24
+
+
+def hours_needed(days, window):
+    """
+    Returns the number of hourly values needed for every window of a number
+    of days, more than `days * 24` for windows past midnight.
+
+    Parameters
+    ----------
+    days : int
+        The number of days.
+    window : tuple of int
+        The first hour and the hour after the last.
+
+    Returns
+    -------
+    int
+        The number of hours from midnight of the first day.
+    """
+    return (days - 1) * 24 + window[0] + window_length(window)
+
+
+def window_view(hourly, days, window, day_starts=None):
+    """
+    Returns the hours of every day's window as one row per day. The rows are
+    a view of the hourly buffer when it covers every window and every day
+    starts at `day * 24`, otherwise the missing hours at the end are NaN.
+
+    Parameters
+    ----------
+    hourly : numpy.ndarray
+        Hourly values starting at midnight of the first day.
+    days : int
+        The number of days.
+    window : tuple of int
+        The first hour and the hour after the last.
+    day_starts : numpy.ndarray, optional
+        The row of every local midnight, see 
+        weather_calendar.day_start_hours(). By default day d starts at row 
+        `d * 24`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (days, window length).
+    """
+    hourly = np.asarray(hourly, dtype=np.float32)
+    start = window[0]
+    if day_starts is None:
+        end = start + days * 24
+    else:
+        #Gather every window's hours at once
+        rows = (np.asarray(day_starts)[:, None] + start + 
+                np.arange(window_length(window)))
+        end = int(rows.max()) + 1
+    if len(hourly) < end:
+        hourly = np.concatenate(
+            (hourly, np.full(end - len(hourly), np.nan, dtype=np.float32)))
+    if day_starts is None:
+        return hourly[start:end].reshape(days, 24)[:, :window_length(window)]
+    return hourly[rows]
+
+
+def reduce_window(hourly, days, window, reduce=np.fmax, day_starts=None):
+    """
+    Reduces the hours of every day's window to one value per day. NaN hours
+    are skipped, a day is NaN only when its whole window is.
+
+    Parameters
+    ----------
+    hourly : numpy.ndarray
+        Hourly values starting at midnight of the first day.
+    days : int
+        The number of days.
+    window : tuple of int
+        The first hour and the hour after the last.
+    reduce : numpy.ufunc, optional
+        The reduction, defaults to numpy.fmax.
+    day_starts : numpy.ndarray, optional
+        The row of every local midnight, by default `day * 24`.
+
+    Returns
+    -------
+    numpy.ndarray
+        One float32 value per day.
+    """
+    return reduce.reduce(window_view(hourly, days, window, day_starts), 
+                         axis=1)
+
+
+def daily_aggregates(hourly, days, aggregates=HOURLY_AGGREGATES, 
+                     day_starts=None):
+    """
+    Derives daily series from hourly series.
+
+    Parameters
+    ----------
+    hourly : dict
+        Maps each hourly variable to its values, starting at midnight of the
+        first day.
+    days : int
+        The number of days.
+    aggregates : dict, optional
+        Maps each derived variable to its (hourly variable, window, reduce),
+        defaults to HOURLY_AGGREGATES.
+    day_starts : numpy.ndarray, optional
+        The row of every local midnight, by default `day * 24`.
+
+    Returns
+    -------
+    dict
+        Maps each derived variable to one float32 value per day.
+    """
+    return {name: reduce_window(hourly[variable], days, window, reduce,
+                                day_starts)
+            for name, (variable, window, reduce) in aggregates.items()}
+
+
+def rolling(values, window, reduce=np.fmax):
+    """
+    Reduces every trailing window of days, e.g. the warmest day of each
+    week.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        One value per day.
+    window : int
+        The number of days in a window.
+    reduce : numpy.ufunc, optional
+        The reduction, defaults to numpy.fmax.
+
+    Returns
+    -------
+    numpy.ndarray
+        One value per day, for the window ending on that day. NaN for the
+        first `window - 1` days.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    result = np.full(len(values), np.nan, dtype=np.float32)
+    if len(values) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        result[window - 1:] = reduce.reduce(windows, axis=1)
+    return result
+
+
+def rolling_mean(values, window):
+    """
+    Averages every trailing window of days.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        One value per day.
+    window : int
+        The number of days in a window.
+
+    Returns
+    -------
+    numpy.ndarray
+        One value per day, for the window ending on that day. NaN for the
+        first `window - 1` days and for windows with missing days.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    result = np.full(len(values), np.nan, dtype=np.float32)
+    if len(values) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        result[window - 1:] = windows.mean(axis=1, dtype=np.float64)
+    return result
@@ -1,5 +1,6 @@
 from weather_data_download import WeatherDataDownload
 from weather_data_statistics import WeatherDataStatistics
+from weather_report import print_comparison, print_month_stats
 
 #To run this program, input 2 parameters:
 city = 'La Jolla' #where the weather data will be downloaded from
@@ -13,9 +14,11 @@ month = 12 #the current month for current weather, or other inputted months
 weather_downloader = WeatherDataDownload(city)
 weather_downloader.get_historical_data()
 weather_downloader.get_forecast_data()
-weather_stat = WeatherDataStatistics(city)
+weather_stat = WeatherDataStatistics(city, weather_downloader)
 
-weather_stat.match_against_historical_weather(month)
+print_month_stats(weather_stat.match_against_historical_weather(month))
 
-weather_stat.compare_day_temps(weather_downloader.today_max_day_temp)
-weather_stat.compare_night_temps(weather_downloader.today_min_night_temp)
\ No newline at end of file
+print_comparison(
+    weather_stat.compare_day_temps(weather_downloader.today_max_day_temp))
+print_comparison(
+    weather_stat.compare_night_temps(weather_downloader.today_min_night_temp))
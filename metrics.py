@@ -0,0 +1,271 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+#Shared by every disabled timer, so a disabled timer costs one attribute check
+_NULL_TIMER = contextlib.nullcontext()
+
+class Metrics:
+    """
+    Per-stage timers and counters of the download and statistics hot paths,
+    exported as Prometheus text or as a JSON snapshot. When disabled every
+    call returns right away, so instrumentation can stay in the hot paths.
+
+    Counters and timers are keyed by name and labels, e.g.
+    `count('api_calls', api='archive')`. Labels should have few values,
+    one per city would grow the export without bound. Counts by city are
+    kept as tallies instead, e.g. `tally('api_calls', 'Irvine')`, which are
+    in the JSON snapshot but not in the Prometheus export.
+
+    Attributes
+    ----------
+    enabled : bool
+        Whether anything is recorded.
+    prefix : str
+        Prepended to every metric name on export.
+
+    Methods
+    -------
+    __init__(enabled=False, prefix='weather')
+        Initializes empty metrics.
+    count(name, value=1, **labels)
+        Adds to a counter.
+    tally(name, key, value=1)
+        Adds to a counter split by a key with many values, e.g. the city.
+    timer(name, **labels)
+        Returns a context manager timing the code it wraps.
+    snapshot()
+        Returns every counter, tally and timer.
+    to_json()
+        Returns the snapshot as JSON.
+    to_prometheus()
+        Returns every counter and timer in Prometheus text format.
+    reset()
+        Clears every counter, tally and timer.
+    """
+
+    def __init__(self, enabled=False, prefix='weather'):
+        """
+        Initializes empty metrics.
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Whether anything is recorded, defaults to False.
+        prefix : str, optional
+            Prepended to every metric name on export, defaults to 'weather'.
+        """
+        self.enabled = enabled
+        self.prefix = prefix
+        self._counters = {}
+        self._tallies = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """
+        Adds to a counter.
+
+        Parameters
+        ----------
+        name : str
+            The counter, e.g. 'cache_hits'.
+        value : float, optional
+            The amount to add, defaults to 1.
+        **labels
+            Label values that split the counter, e.g. api='archive'.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def tally(self, name, key, value=1):
+        """
+        Adds to a tally, a counter split by a key with many values, e.g. API
+        calls per city. Tallies are in snapshot() and to_json() only, a
+        Prometheus series per key would grow without bound.
+
+        Parameters
+        ----------
+        name : str
+            The tally, e.g. 'api_calls'.
+        key : str
+            What the tally is split by, e.g. the city's name.
+        value : float, optional
+            The amount to add, defaults to 1.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._tallies[(name, key)] = (
+                self._tallies.get((name, key), 0) + value)
+
+    def timer(self, name, **labels):
+        """
+        Returns a context manager timing the code it wraps.
+
+        Parameters
+        ----------
+        name : str
+            The stage, e.g. 'decode'.
+        **labels
+            Label values that split the timer.
+
+        Returns
+        -------
+        context manager
+            Records the elapsed time on exit.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, (name, tuple(sorted(labels.items()))))
+
+    def snapshot(self):
+        """
+        Returns every counter, tally and timer.
+
+        Returns
+        -------
+        dict
+            'counters', 'tallies' and 'timers' lists, each entry with its
+            name, labels and value, name, key and value for tallies, or
+            count, total and max seconds for timers.
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self._counters.items()]
+            tallies = [{'name': name, 'key': key, 'value': value}
+                       for (name, key), value in self._tallies.items()]
+            timers = [{'name': name, 'labels': dict(labels), 'count': count,
+                       'total_seconds': total, 'max_seconds': maximum}
+                      for (name, labels), (count, total, maximum)
+                      in self._timers.items()]
+        return {'counters': counters, 'tallies': tallies, 'timers': timers}
+
+    def to_json(self):
+        """
+        Returns the snapshot as JSON.
+
+        Returns
+        -------
+        str
+            The JSON snapshot, see snapshot().
+        """
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """
+        Returns every counter and timer in Prometheus text format. Counters
+        are exported as `<prefix>_<name>_total` and timers as summaries
+        `<prefix>_<name>_seconds` with `_count` and `_sum`. Tallies are left
+        out.
+
+        Returns
+        -------
+        str
+            The exposition text.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in sorted(snapshot['counters'],
+                              key=lambda entry: entry['name']):
+            metric = f'{self.prefix}_{counter["name"]}_total'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{metric}{_labels(counter["labels"])} '
+                         f'{counter["value"]}')
+        for timer in sorted(snapshot['timers'],
+                            key=lambda entry: entry['name']):
+            metric = f'{self.prefix}_{timer["name"]}_seconds'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} summary')
+                typed.add(metric)
+            labels = _labels(timer['labels'])
+            lines.append(f'{metric}_count{labels} {timer["count"]}')
+            lines.append(f'{metric}_sum{labels} {timer["total_seconds"]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """
+        Clears every counter, tally and timer.
+        """
+        with self._lock:
+            self._counters = {}
+            self._tallies = {}
+            self._timers = {}
+
+    def _record(self, key, seconds):
+        with self._lock:
+            count, total, maximum = self._timers.get(key, (0, 0.0, 0.0))
+            self._timers[key] = (count + 1, total + seconds,
+                                 max(maximum, seconds))
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_key', '_start')
+
+    def __init__(self, metrics, key):
+        self._metrics = metrics
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics._record(self._key, time.perf_counter() - self._start)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def record_response(response, *args, **kwargs):
+    """
+    Response hook of the API sessions, counts every HTTP response by host as
+    a cache hit or an API call, with the bytes transferred and the retries
+    it took.
+
+    Parameters
+    ----------
+    response : requests.Response
+        The response, cached or not.
+
+    Returns
+    -------
+    requests.Response
+        The same response.
+    """
+    #The cache dispatches the hook again for responses it stores
+    if not metrics.enabled or getattr(response, '_metrics_recorded', False):
+        return response
+    response._metrics_recorded = True
+    host = response.url.split('/')[2] if '://' in response.url else ''
+    if getattr(response, 'from_cache', False):
+        metrics.count('cache_hits', host=host)
+        return response
+
+    metrics.count('cache_misses', host=host)
+    metrics.count('http_requests', host=host, status=response.status_code)
+    metrics.count('bytes_received', len(response.content), host=host)
+    retries = getattr(getattr(response.raw, 'retries', None), 'history', ())
+    if retries:
+        metrics.count('retries', len(retries), host=host)
+    return response
+
+
+#The metrics of this process, enabled by setting WEATHER_METRICS=1 or by
+#setting `metrics.enabled = True`
+metrics = Metrics(enabled=os.environ.get('WEATHER_METRICS') == '1')
@@ -0,0 +1,284 @@
+import datetime
+import flatbuffers
+import numpy as np
+from openmeteo_sdk.Variable import Variable
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+from weather_variables import WEATHER_VARIABLES
+
+#Synthetic Open-Meteo API responses for offline tests and benchmarks. They are
+#encoded with the same FlatBuffers schema as the real API, so decoding them
+#runs the same code as decoding a live response.
+
+#(variable, altitude, aggregation) of every variable the fixtures can encode
+FIXTURE_VARIABLES = {name: variable.key
+                     for name, variable in WEATHER_VARIABLES.items()}
+
+#Field slots of the schema, see the openmeteo_sdk readers
+_RESPONSE_FIELDS = 12
+_RESPONSE_LATITUDE = 0
+_RESPONSE_LONGITUDE = 1
+_RESPONSE_UTC_OFFSET = 6
+_RESPONSE_TIMEZONE = 7
+_RESPONSE_DAILY = 10
+_RESPONSE_HOURLY = 11
+_SERIES_FIELDS = 4
+_VARIABLE_FIELDS = 7
+
+def encode_response(latitude, longitude, start_time, daily=None, hourly=None,
+                    utc_offset_seconds=0, timezone='GMT'):
+    """
+    Encodes one location of an Open-Meteo API response, prefixed with its
+    length like every message of the API's response stream.
+
+    Parameters
+    ----------
+    latitude : float
+        The latitude of the location.
+    longitude : float
+        The longitude of the location.
+    start_time : int
+        The Unix time of the first value.
+    daily : dict, optional
+        Maps daily variable names, see FIXTURE_VARIABLES, to their values.
+    hourly : dict, optional
+        Maps hourly variable names to their values.
+    utc_offset_seconds : int, optional
+        The offset of the location's timezone, defaults to 0.
+    timezone : str, optional
+        The name of the location's timezone, defaults to 'GMT'.
+
+    Returns
+    -------
+    bytes
+        The length-prefixed message.
+    """
+    builder = flatbuffers.Builder(1024)
+    series = {}
+    for slot, variables, interval in ((_RESPONSE_DAILY, daily, 86400),
+                                      (_RESPONSE_HOURLY, hourly, 3600)):
+        if variables:
+            series[slot] = _encode_series(builder, start_time, interval,
+                                          variables)
+    timezone_offset = builder.CreateString(timezone)
+
+    builder.StartObject(_RESPONSE_FIELDS)
+    builder.PrependFloat32Slot(_RESPONSE_LATITUDE, latitude, 0)
+    builder.PrependFloat32Slot(_RESPONSE_LONGITUDE, longitude, 0)
+    builder.PrependInt32Slot(_RESPONSE_UTC_OFFSET, utc_offset_seconds, 0)
+    builder.PrependUOffsetTRelativeSlot(_RESPONSE_TIMEZONE, timezone_offset,
+                                        0)
+    for slot, offset in series.items():
+        builder.PrependUOffsetTRelativeSlot(slot, offset, 0)
+    builder.Finish(builder.EndObject())
+
+    message = bytes(builder.Output())
+    return len(message).to_bytes(4, byteorder='little') + message
+
+
+def decode_responses(data):
+    """
+    Decodes a response stream into one response per location, the same way
+    openmeteo_requests does.
+
+    Parameters
+    ----------
+    data : bytes
+        Length-prefixed messages, e.g. from encode_response().
+
+    Returns
+    -------
+    list of WeatherApiResponse
+        The decoded responses.
+    """
+    responses = []
+    position = 0
+    while position < len(data):
+        length = int.from_bytes(data[position:position + 4],
+                                byteorder='little')
+        responses.append(WeatherApiResponse.GetRootAs(data, position + 4))
+        position += length + 4
+    return responses
+
+
+def synthetic_response(params, seed=0):
+    """
+    Answers the query parameters of an archive or forecast request with
+    deterministic, seasonal temperatures(°F) for every requested location.
+    Other variables, e.g. precipitation, get plausible random values.
+
+    Parameters
+    ----------
+    params : dict
+        The query parameters, as built by archive_params() or
+        forecast_params(), with comma-separated coordinates for many
+        locations.
+    seed : int, optional
+        Changes the generated values, defaults to 0.
+
+    Returns
+    -------
+    bytes
+        The response stream, one message per location.
+    """
+    if 'start_date' in params:
+        start_date = datetime.date.fromisoformat(params['start_date'])
+        end_date = datetime.date.fromisoformat(params['end_date'])
+    else:
+        start_date = datetime.date.today()
+        end_date = start_date + datetime.timedelta(
+            days=int(params.get('forecast_days', 7)) - 1)
+    days = (end_date - start_date).days + 1
+    start_time = int(datetime.datetime(start_date.year, start_date.month,
+        start_date.day, tzinfo=datetime.timezone.utc).timestamp())
+
+    latitudes = [float(value) for value in str(params['latitude']).split(',')]
+    longitudes = [float(value)
+                  for value in str(params['longitude']).split(',')]
+    day_of_year = np.arange(start_date.timetuple().tm_yday - 1,
+                            start_date.timetuple().tm_yday - 1 + days)
+    hour = np.arange(days * 24)
+
+    messages = []
+    for index, (latitude, longitude) in enumerate(zip(latitudes,
+                                                      longitudes)):
+        rng = np.random.default_rng(seed * 100003 + index)
+        season = 65 - 15 * np.cos(2 * np.pi * (day_of_year - 15) / 365.25)
+        season = season - (abs(latitude) - 30) / 2
+        daily = {}
+        for name in params.get('daily', []):
+            if FIXTURE_VARIABLES[name][0] != Variable.temperature:
+                daily[name] = _other_values(name, rng, days)
+                continue
+            offset = {'max': 8, 'min': -8}.get(name.rsplit('_', 1)[-1], 0)
+            daily[name] = season + offset + rng.normal(0, 3, days)
+        hourly = {}
+        for name in params.get('hourly', []):
+            if FIXTURE_VARIABLES[name][0] != Variable.temperature:
+                hourly[name] = _other_values(name, rng, days * 24)
+                continue
+            hourly[name] = (np.repeat(season, 24)
+                            - 8 * np.cos(2 * np.pi * (hour % 24 - 3) / 24)
+                            + rng.normal(0, 1, days * 24))
+        messages.append(encode_response(latitude, longitude, start_time,
+                                        daily, hourly))
+    return b''.join(messages)
+
+
+class FixtureClient:
+    """
+    Stands in for openmeteo_requests.Client, answering every request with
+    encoded fixtures instead of going to the network.
+
+    Attributes
+    ----------
+    requests : list of tuple
+        The (url, params) of every request made so far.
+
+    Methods
+    -------
+    __init__(respond=synthetic_response)
+        Initializes the client with the function answering requests.
+    weather_api(url, params, **kwargs)
+        Answers a request with decoded fixture responses.
+    """
+
+    def __init__(self, respond=synthetic_response):
+        """
+        Initializes the client with the function answering requests.
+
+        Parameters
+        ----------
+        respond : callable, optional
+            respond(params) returns the encoded response stream, defaults
+            to synthetic_response().
+        """
+        self.requests = []
+        self._respond = respond
+
+    def weather_api(self, url, params, **kwargs):
+        """
+        Answers a request with decoded fixture responses.
+
+        Parameters
+        ----------
+        url : str
+            The API endpoint.
+        params : dict
+            The query parameters.
+        **kwargs
+            Ignored, accepted for compatibility with the real client.
+
+        Returns
+        -------
+        list of WeatherApiResponse
+            One response per location.
+        """
+        self.requests.append((url, params))
+        return decode_responses(self._respond(params))
+
+
+class FixtureSessionManager:
+    """
+    Stands in for SessionManager, handing out one FixtureClient for both
+    APIs.
+
+    Attributes
+    ----------
+    client : FixtureClient
+        The client answering archive and forecast requests.
+    """
+
+    def __init__(self, respond=synthetic_response):
+        self.client = FixtureClient(respond)
+
+    def archive_client(self):
+        return self.client
+
+    def forecast_client(self):
+        return self.client
+
+    def close(self):
+        pass
+
+
+def _other_values(name, rng, count):
+    #Dry spells with the odd wet day(inch, or hours of precipitation), 
+    #winds(mph) and relative humidities(%)
+    variable = FIXTURE_VARIABLES[name][0]
+    if variable == Variable.relative_humidity:
+        return np.clip(rng.normal(65, 15, count), 0, 100)
+    if variable in (Variable.wind_speed, Variable.wind_gusts):
+        return np.abs(rng.normal(8, 4, count))
+    wet = rng.random(count) < 0.2
+    if variable == Variable.precipitation_hours:
+        return np.where(wet, rng.integers(1, 25, count), 0)
+    return np.where(wet, rng.exponential(0.3, count), 0)
+
+
+def _encode_series(builder, start_time, interval, variables):
+    #Children first: every variable's values, then the variables, then the
+    #series holding them
+    variable_offsets = []
+    for name, values in variables.items():
+        variable, altitude, aggregation = FIXTURE_VARIABLES[name]
+        values_offset = builder.CreateNumpyVector(
+            np.asarray(values, dtype=np.float32))
+        builder.StartObject(_VARIABLE_FIELDS)
+        builder.PrependUint8Slot(0, variable, 0)
+        builder.PrependUOffsetTRelativeSlot(3, values_offset, 0)
+        builder.PrependInt16Slot(5, altitude, 0)
+        builder.PrependUint8Slot(6, aggregation, 0)
+        variable_offsets.append(builder.EndObject())
+
+    builder.StartVector(4, len(variable_offsets), 4)
+    for offset in reversed(variable_offsets):
+        builder.PrependUOffsetTRelative(offset)
+    vector_offset = builder.EndVector()
+
+    end_time = start_time + interval * len(next(iter(variables.values())))
+    builder.StartObject(_SERIES_FIELDS)
+    builder.PrependInt64Slot(0, start_time, 0)
+    builder.PrependInt64Slot(1, end_time, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, vector_offset, 0)
+    return builder.EndObject()
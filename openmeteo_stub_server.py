@@ -0,0 +1,299 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from openmeteo_fixtures import synthetic_response
+
+#Local stand-in for the Open-Meteo geocoding, archive and forecast APIs, for
+#offline tests and load tests of the download engine. Start it with
+#`python openmeteo_stub_server.py` and export the printed variables so the
+#download code sends its requests here.
+
+class StubSettings:
+    """
+    The behavior of the stand-in server, shared by every request.
+
+    Attributes
+    ----------
+    latency : float
+        Seconds every response is delayed by.
+    jitter : float
+        Up to this many seconds are added to the latency at random.
+    error_rate : float
+        The fraction of requests answered with a 500, 502 or 504 error.
+    rate_limit : float
+        Requests per second allowed before answering 429, 0 for no limit.
+    seed : int
+        Seeds the errors, the latency jitter and the generated weather.
+    """
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, rate_limit=0,
+                 seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.seed = seed
+
+
+class StubServer:
+    """
+    Serves synthetic geocoding JSON and FlatBuffers archive and forecast
+    responses, with tunable latency, error rate and rate limit. Counts every
+    request so tests can check throughput and retry behavior.
+
+    Endpoints: /v1/search, /v1/archive, /v1/forecast and /stats.
+
+    Attributes
+    ----------
+    settings : StubSettings
+        The server's behavior, can be changed while it runs.
+    stats : dict
+        Counts of 'requests', 'errors', 'rate_limited' and 'bytes' sent.
+
+    Methods
+    -------
+    __init__(host='127.0.0.1', port=0, settings=None)
+        Binds the server, port 0 picks a free port.
+    start()
+        Serves requests on a background thread.
+    serve_forever()
+        Serves requests on the calling thread until stopped.
+    stop()
+        Stops serving and closes the socket.
+    url(path)
+        Returns the URL of an endpoint.
+    environment()
+        Returns the variables pointing the download code at this server.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, settings=None):
+        """
+        Binds the server, port 0 picks a free port.
+
+        Parameters
+        ----------
+        host : str, optional
+            The address to listen on, defaults to 127.0.0.1.
+        port : int, optional
+            The port to listen on, defaults to a free port.
+        settings : StubSettings, optional
+            The server's behavior, defaults to no latency, errors or limit.
+        """
+        self.settings = StubSettings() if settings is None else settings
+        self.stats = {'requests': 0, 'errors': 0, 'rate_limited': 0,
+                      'bytes': 0}
+        self._lock = threading.Lock()
+        self._random = random.Random(self.settings.seed)
+        self._tokens = self.settings.rate_limit
+        self._refilled_at = time.monotonic()
+        self._thread = None
+
+        stub = self
+        class Handler(_StubHandler):
+            server_stub = stub
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Serves requests on a background thread.
+
+        Returns
+        -------
+        StubServer
+            The server itself.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """
+        Serves requests on the calling thread until stopped.
+        """
+        self._server.serve_forever()
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+    def url(self, path):
+        """
+        Returns the URL of an endpoint.
+
+        Parameters
+        ----------
+        path : str
+            The path, e.g. '/v1/archive'.
+
+        Returns
+        -------
+        str
+            The full URL.
+        """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}{path}'
+
+    def environment(self):
+        """
+        Returns the variables pointing the download code at this server.
+
+        Returns
+        -------
+        dict
+            Maps each variable name to its URL.
+        """
+        return {
+            'OPENMETEO_GEOCODING_URL': self.url('/v1/search'),
+            'OPENMETEO_ARCHIVE_URL': self.url('/v1/archive'),
+            'OPENMETEO_FORECAST_URL': self.url('/v1/forecast'),
+        }
+
+    def _admit(self):
+        #Decides the fate of a request: None to answer it, or an error
+        #status. The rate limit is a token bucket holding one second of
+        #requests
+        settings = self.settings
+        with self._lock:
+            self.stats['requests'] += 1
+            if settings.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(settings.rate_limit, self._tokens +
+                    (now - self._refilled_at) * settings.rate_limit)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    self.stats['rate_limited'] += 1
+                    return 429
+                self._tokens -= 1
+            if self._random.random() < settings.error_rate:
+                self.stats['errors'] += 1
+                return self._random.choice((500, 502, 504))
+            return None
+
+    def _delay(self):
+        with self._lock:
+            delay = (self.settings.latency +
+                     self._random.random() * self.settings.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server_stub = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stub = self.server_stub
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/stats':
+            with stub._lock:
+                body = json.dumps(stub.stats).encode()
+            return self._send(200, body, 'application/json')
+
+        stub._delay()
+        status = stub._admit()
+        if status == 429:
+            return self._send(429, json.dumps({
+                'error': True, 'reason': 'Too many concurrent requests'
+            }).encode(), 'application/json')
+        if status is not None:
+            return self._send(status, b'Server error', 'text/plain')
+
+        if url.path == '/v1/search':
+            body = json.dumps(_geocoding_result(query['name'][0])).encode()
+            return self._send(200, body, 'application/json')
+        if url.path in ('/v1/archive', '/v1/forecast'):
+            params = {name: values[0] for name, values in query.items()}
+            for name in ('daily', 'hourly'):
+                #Lists come as repeated or comma-separated parameters
+                params[name] = [variable for value in query.get(name, [])
+                                for variable in value.split(',')]
+            body = synthetic_response(params, stub.settings.seed)
+            return self._send(200, body, 'application/octet-stream')
+        return self._send(404, b'Not found', 'text/plain')
+
+    def log_message(self, format, *args):
+        #Keep load tests quiet
+        pass
+
+    def _send(self, status, body, content_type):
+        with self.server_stub._lock:
+            self.server_stub.stats['bytes'] += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _geocoding_result(city_name):
+    #Every name is found, at coordinates derived from the name so repeated
+    #runs agree
+    key = zlib.crc32(city_name.strip().lower().encode())
+    latitude = round(25 + (key % 24000) / 1000, 4)
+    longitude = round(-124 + (key // 24000 % 57000) / 1000, 4)
+    return {'results': [{
+        'id': key, 'name': city_name, 'latitude': latitude,
+        'longitude': longitude, 'timezone': 'America/Los_Angeles',
+        'country_code': 'US'
+    }]}
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `python openmeteo_stub_server.py --help`.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments, defaults to sys.argv.
+    """
+    parser = argparse.ArgumentParser(
+        description='Serves a local stand-in for the Open-Meteo APIs.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds every response is delayed by')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='up to this many seconds of extra delay')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests failing with 5xx')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='requests per second before answering 429')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    settings = StubSettings(args.latency, args.jitter, args.error_rate,
+                            args.rate_limit, args.seed)
+    server = StubServer(args.host, args.port, settings)
+    for name, url in server.environment().items():
+        print(f'export {name}={url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
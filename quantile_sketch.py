@@ -0,0 +1,238 @@
+import numpy as np
+
+#Items kept per compactor, the rank error is about 1.65 / k of the count
+DEFAULT_K = 200
+
+#The lowest compactors shrink geometrically, down to this many items
+_MIN_CAPACITY = 8
+_CAPACITY_DECAY = 2 / 3
+
+class KLLSketch:
+    """
+    Mergeable quantile sketch (Karnin, Lang and Liberty) of a stream of
+    values. Keeps a few hundred values however many are added, and answers
+    any quantile within a rank error of about 1.65 / k. The exact minimum and
+    maximum are kept as well. Sketches of different years or workers merge
+    into the sketch of all their values, and serialize to a float array for
+    the climate store.
+
+    Values enter the lowest compactor. A full compactor is sorted and every
+    other value, starting at a random offset, moves up a level with twice
+    the weight.
+
+    Attributes
+    ----------
+    k : int
+        The size of the largest compactor, sets the accuracy.
+    count : int
+        The number of values added, without NaN.
+    minimum : float
+        The smallest value added, NaN before any.
+    maximum : float
+        The largest value added, NaN before any.
+
+    Methods
+    -------
+    __init__(k=DEFAULT_K, seed=0)
+        Initializes an empty sketch.
+    update(values)
+        Adds values, NaN is skipped.
+    merge(other)
+        Adds every value of another sketch.
+    quantiles(fractions)
+        Returns approximate quantiles.
+    rank(value)
+        Returns the approximate fraction of values at or below a value.
+    to_array()
+        Serializes the sketch.
+    from_array(array, seed=0)
+        Rebuilds a serialized sketch.
+    """
+
+    def __init__(self, k=DEFAULT_K, seed=0):
+        """
+        Initializes an empty sketch.
+
+        Parameters
+        ----------
+        k : int, optional
+            The size of the largest compactor, defaults to DEFAULT_K.
+        seed : int, optional
+            Seeds the compaction offsets, so equal inputs give equal
+            sketches. Defaults to 0.
+        """
+        self.k = int(k)
+        self.count = 0
+        self.minimum = np.nan
+        self.maximum = np.nan
+        self._levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        #The number of values kept, not added
+        return sum(len(level) for level in self._levels)
+
+    def update(self, values):
+        """
+        Adds values, NaN is skipped.
+
+        Parameters
+        ----------
+        values : float or numpy.ndarray
+            The values to add.
+        """
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.minimum = np.fmin(self.minimum, values.min())
+        self.maximum = np.fmax(self.maximum, values.max())
+        self._levels[0] = np.concatenate((self._levels[0], values))
+        self._compress()
+
+    def merge(self, other):
+        """
+        Adds every value of another sketch, e.g. of another year or worker.
+
+        Parameters
+        ----------
+        other : KLLSketch
+            The sketch to add, left unchanged.
+        """
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty(0))
+        for level, items in enumerate(other._levels):
+            self._levels[level] = np.concatenate((self._levels[level],
+                                                  items))
+        self._compress()
+
+    def quantiles(self, fractions):
+        """
+        Returns approximate quantiles, the 0 and 1 quantiles are the exact
+        minimum and maximum.
+
+        Parameters
+        ----------
+        fractions : float or list of float
+            Between 0 and 1, e.g. [0.25, 0.5, 0.75] for the quartiles.
+
+        Returns
+        -------
+        numpy.ndarray
+            One value per fraction, NaN for an empty sketch.
+        """
+        fractions = np.atleast_1d(np.asarray(fractions, dtype=np.float64))
+        if self.count == 0:
+            return np.full(len(fractions), np.nan)
+        values, cumulative = self._sorted_weights()
+        index = np.searchsorted(cumulative, fractions * self.count,
+                                side='left')
+        result = values[np.minimum(index, len(values) - 1)]
+        result[fractions <= 0] = self.minimum
+        result[fractions >= 1] = self.maximum
+        return result
+
+    def rank(self, value):
+        """
+        Returns the approximate fraction of values at or below a value.
+
+        Parameters
+        ----------
+        value : float or numpy.ndarray
+            The value or values.
+
+        Returns
+        -------
+        numpy.ndarray
+            Between 0 and 1, NaN for an empty sketch.
+        """
+        value = np.atleast_1d(np.asarray(value, dtype=np.float64))
+        if self.count == 0:
+            return np.full(len(value), np.nan)
+        values, cumulative = self._sorted_weights()
+        index = np.searchsorted(values, value, side='right')
+        below = np.concatenate(([0], cumulative))[index]
+        return below / self.count
+
+    def to_array(self):
+        """
+        Serializes the sketch: k, count, minimum, maximum, the number of
+        levels, the length of every level and then the kept values.
+
+        Returns
+        -------
+        numpy.ndarray
+            The float64 serialization.
+        """
+        lengths = [len(level) for level in self._levels]
+        return np.concatenate((
+            [self.k, self.count, self.minimum, self.maximum,
+             len(self._levels)], lengths, *self._levels))
+
+    @classmethod
+    def from_array(cls, array, seed=0):
+        """
+        Rebuilds a serialized sketch.
+
+        Parameters
+        ----------
+        array : numpy.ndarray
+            The output of to_array().
+        seed : int, optional
+            Seeds later compactions, defaults to 0.
+
+        Returns
+        -------
+        KLLSketch
+            The sketch.
+        """
+        array = np.asarray(array, dtype=np.float64)
+        sketch = cls(int(array[0]), seed)
+        sketch.count = int(array[1])
+        sketch.minimum = float(array[2])
+        sketch.maximum = float(array[3])
+        levels = int(array[4])
+        lengths = array[5:5 + levels].astype(int)
+        offsets = 5 + levels + np.concatenate(([0], np.cumsum(lengths)))
+        sketch._levels = [np.array(array[start:end]) for start, end
+                          in zip(offsets[:-1], offsets[1:])]
+        return sketch
+
+    def _capacity(self, level):
+        depth = len(self._levels) - level - 1
+        return max(_MIN_CAPACITY,
+                   int(np.ceil(self.k * _CAPACITY_DECAY ** depth)))
+
+    def _compress(self):
+        #A new level shrinks the capacity of every level below it, so pass
+        #over the levels until none is over capacity
+        compacted = True
+        while compacted:
+            compacted = False
+            for level in range(len(self._levels)):
+                items = self._levels[level]
+                if len(items) <= self._capacity(level):
+                    continue
+                if level + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                items = np.sort(items)
+                #An odd value out stays behind, so weights add up exactly
+                odd = len(items) % 2
+                promoted = items[odd:][self._rng.integers(2)::2]
+                self._levels[level + 1] = np.concatenate(
+                    (self._levels[level + 1], promoted))
+                self._levels[level] = items[:odd]
+                compacted = True
+
+    def _sorted_weights(self):
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level)
+                                  for level, items in enumerate(self._levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
@@ -0,0 +1,59 @@
+import datetime
+from typing import NamedTuple
+from weather_calendar import year_calendar
+
+#The daily variables every archive request asks for unless told otherwise
+DAILY_VARIABLES = ('temperature_2m_max', 'temperature_2m_min')
+
+class QueryPlan(NamedTuple):
+    """
+    The date windows and daily variables a calculation needs, so that each
+    archive request asks for exactly those and nothing else.
+    """
+    windows: tuple
+    variables: tuple
+
+
+def month_window(year, month):
+    """
+    Returns the first and last day of a month.
+
+    Parameters
+    ----------
+    year : int
+        The year.
+    month : int
+        The month (1 = January, 2 = February, ..., 12 = December).
+
+    Returns
+    -------
+    tuple of datetime.date
+        The first and the last day of the month.
+    """
+    return datetime.date(year, month, 1), year_calendar(year).last_day(month)
+
+
+def plan_month_query(month, years, variables=DAILY_VARIABLES):
+    """
+    Plans the download of one month across many years, e.g. every December
+    from 2014 to 2023, instead of the twelve months of every year.
+
+    Parameters
+    ----------
+    month : int
+        The month (1 = January, 2 = February, ..., 12 = December).
+    years : int or list of int
+        The years of the month.
+    variables : tuple of str, optional
+        The daily variables the calculation uses, defaults to the daily max
+        and min temperatures.
+
+    Returns
+    -------
+    QueryPlan
+        One window per year, in increasing order.
+    """
+    if isinstance(years, int):
+        years = [years]
+    windows = tuple(month_window(year, month) for year in sorted(set(years)))
+    return QueryPlan(windows, tuple(variables))
@@ -0,0 +1,172 @@
+import os
+import threading
+from metrics import record_response
+
+class SessionManager:
+    """
+    Creates the cached, retrying Open-Meteo API clients once and reuses them
+    for every request, instead of reopening the SQLite cache and throwing
+    away keep-alive connections on every call.
+
+    The archive and the forecast clients share one cache file but keep
+    separate expiry policies, since historical data never changes while the
+    forecast is refreshed every hour.
+
+    Attributes
+    ----------
+    cache_name : str
+        The name of the requests-cache SQLite file.
+    archive_expire_after : int
+        Seconds before a cached archive response expires, -1 never expires.
+    forecast_expire_after : int
+        Seconds before a cached forecast response expires.
+    pool_connections : int
+        The number of hosts kept in each client's connection pool.
+    pool_maxsize : int
+        The number of connections kept per host, should be at least the
+        number of threads sharing the clients.
+    retries : int
+        The number of retries on connection errors and server errors.
+    backoff_factor : float
+        The factor used to compute the waiting time between retries.
+
+    Methods
+    -------
+    __init__(cache_name='.cache', archive_expire_after=-1,
+             forecast_expire_after=3600, pool_connections=10,
+             pool_maxsize=10, retries=5, backoff_factor=0.2)
+        Initializes the session manager, clients are created on first use.
+    archive_client()
+        Returns the client used for the historical weather archive API.
+    forecast_client()
+        Returns the client used for the weather forecast API.
+    close()
+        Closes the sessions behind both clients.
+    """
+
+    def __init__(self, cache_name='.cache', archive_expire_after=-1,
+                 forecast_expire_after=3600, pool_connections=10,
+                 pool_maxsize=10, retries=5, backoff_factor=0.2):
+        """
+        Initializes the session manager, clients are created on first use.
+
+        Parameters
+        ----------
+        cache_name : str, optional
+            The name of the requests-cache SQLite file, defaults to '.cache'.
+        archive_expire_after : int, optional
+            Seconds before a cached archive response expires, defaults to -1
+            which never expires.
+        forecast_expire_after : int, optional
+            Seconds before a cached forecast response expires, defaults to
+            3600.
+        pool_connections : int, optional
+            The number of hosts kept in each client's connection pool,
+            defaults to 10.
+        pool_maxsize : int, optional
+            The number of connections kept per host, defaults to 10.
+        retries : int, optional
+            The number of retries on failed requests, defaults to 5.
+        backoff_factor : float, optional
+            The factor used to compute the waiting time between retries,
+            defaults to 0.2.
+        """
+        self.cache_name = cache_name
+        self.archive_expire_after = archive_expire_after
+        self.forecast_expire_after = forecast_expire_after
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._clients = {}
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def archive_client(self):
+        """
+        Returns the client used for the historical weather archive API.
+
+        Returns
+        -------
+        openmeteo_requests.Client
+            The shared archive client.
+        """
+        return self._client('archive', self.archive_expire_after)
+
+    def forecast_client(self):
+        """
+        Returns the client used for the weather forecast API.
+
+        Returns
+        -------
+        openmeteo_requests.Client
+            The shared forecast client.
+        """
+        return self._client('forecast', self.forecast_expire_after)
+
+    def close(self):
+        """
+        Closes the sessions behind both clients, they are recreated on next
+        use.
+        """
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            self._clients = {}
+
+    def _client(self, name, expire_after):
+        #Import the HTTP stack on first use, so answers from the local stores 
+        #never load it
+        import openmeteo_requests
+        import requests_cache
+        from requests.adapters import HTTPAdapter
+        from retry_requests import retry
+
+        with self._lock:
+            if name not in self._clients:
+                # Setup the Open-Meteo API client with cache and retry on
+                #error
+                cache_session = requests_cache.CachedSession(
+                    self.cache_name, expire_after = expire_after)
+                retry_session = retry(cache_session, retries = self.retries,
+                                backoff_factor = self.backoff_factor)
+
+                #Remount the retry adapters with the configured pool size
+                for prefix in ('http://', 'https://'):
+                    max_retries = retry_session.get_adapter(prefix).max_retries
+                    retry_session.mount(prefix, HTTPAdapter(
+                        pool_connections = self.pool_connections,
+                        pool_maxsize = self.pool_maxsize,
+                        max_retries = max_retries
+                    ))
+
+                #Count cache hits, API calls, bytes and retries
+                retry_session.hooks['response'].append(record_response)
+
+                self._sessions.append(retry_session)
+                self._clients[name] = openmeteo_requests.Client(
+                    session = retry_session)
+            return self._clients[name]
+
+
+_default_managers = {}
+_default_managers_lock = threading.Lock()
+
+def get_default_session_manager():
+    """
+    Returns the session manager shared by every WeatherDataDownload instance
+    in this process, creating it on first use. Forked worker processes get
+    their own manager, since connections cannot be shared across processes.
+
+    Returns
+    -------
+    SessionManager
+        The process-wide session manager.
+    """
+    pid = os.getpid()
+    with _default_managers_lock:
+        if pid not in _default_managers:
+            _default_managers.clear()
+            _default_managers[pid] = SessionManager()
+        return _default_managers[pid]
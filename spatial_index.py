@@ -0,0 +1,244 @@
+import numpy as np
+
+#Spacing in degrees of the grid the archive's daily temperatures come from
+#(ERA5-Land, about 9 km). The API answers any coordinates with the nearest
+#grid point, so every city within one cell gets the same series.
+GRID_RESOLUTION = 0.1
+
+EARTH_RADIUS_KM = 6371.0088
+
+def snap_to_grid(latitude, longitude, resolution=GRID_RESOLUTION):
+    """
+    Snaps coordinates to the center of their grid cell, so that cities in
+    the same cell share requests and climate store entries.
+
+    Parameters
+    ----------
+    latitude : str or float
+        The latitude of the city.
+    longitude : str or float
+        The longitude of the city.
+    resolution : float, optional
+        The grid spacing in degrees, defaults to GRID_RESOLUTION.
+
+    Returns
+    -------
+    list of str
+        The latitude and longitude of the cell, as strings like the ones
+        WeatherDataDownload.find_lat_long() returns.
+    """
+    decimals = max(0, int(np.ceil(-np.log10(resolution))))
+    return [
+        f'{round(float(latitude) / resolution) * resolution:.{decimals}f}',
+        f'{round(float(longitude) / resolution) * resolution:.{decimals}f}'
+    ]
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Returns the great-circle distances from one point to many.
+
+    Parameters
+    ----------
+    latitude : float
+        The latitude of the point.
+    longitude : float
+        The longitude of the point.
+    latitudes : numpy.ndarray
+        The latitudes of the other points.
+    longitudes : numpy.ndarray
+        The longitudes of the other points.
+
+    Returns
+    -------
+    numpy.ndarray
+        The distances in kilometers.
+    """
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = (np.sin((latitudes - latitude) / 2) ** 2 + np.cos(latitude) *
+         np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class SpatialIndex:
+    """
+    Index of city coordinates, bucketed by grid cell. Finds the cities that
+    share a cell, e.g. to reuse one download for all of them, and every city
+    within a radius for regional reports.
+
+    Attributes
+    ----------
+    resolution : float
+        The grid spacing in degrees.
+
+    Methods
+    -------
+    __init__(resolution=GRID_RESOLUTION)
+        Initializes an empty index.
+    from_geocoding_cache(geocoding_cache, resolution=GRID_RESOLUTION)
+        Builds an index of every city in a geocoding cache.
+    add(city_name, latitude, longitude)
+        Adds a city to the index.
+    cell(latitude, longitude)
+        Returns the grid cell of the coordinates.
+    cities_in_cell(latitude, longitude)
+        Returns the cities in the same grid cell as the coordinates.
+    within(latitude, longitude, radius_km)
+        Returns every city within a radius, nearest first.
+    nearest(latitude, longitude)
+        Returns the city nearest to the coordinates.
+    """
+
+    def __init__(self, resolution=GRID_RESOLUTION):
+        """
+        Initializes an empty index.
+
+        Parameters
+        ----------
+        resolution : float, optional
+            The grid spacing in degrees, defaults to GRID_RESOLUTION.
+        """
+        self.resolution = resolution
+        self._cells = {}
+        self._names = []
+        self._coordinates = []
+        self._arrays = None
+
+    def __len__(self):
+        return len(self._names)
+
+    @classmethod
+    def from_geocoding_cache(cls, geocoding_cache, resolution=GRID_RESOLUTION):
+        """
+        Builds an index of every city in a geocoding cache.
+
+        Parameters
+        ----------
+        geocoding_cache : GeocodingCache
+            The cache of the cities geocoded so far.
+        resolution : float, optional
+            The grid spacing in degrees, defaults to GRID_RESOLUTION.
+
+        Returns
+        -------
+        SpatialIndex
+            The index, keyed by normalized city name.
+        """
+        index = cls(resolution)
+        for city_name, result in geocoding_cache.items():
+            index.add(city_name, result['latitude'], result['longitude'])
+        return index
+
+    def add(self, city_name, latitude, longitude):
+        """
+        Adds a city to the index.
+
+        Parameters
+        ----------
+        city_name : str
+            The name of the city.
+        latitude : str or float
+            The latitude of the city.
+        longitude : str or float
+            The longitude of the city.
+        """
+        latitude, longitude = float(latitude), float(longitude)
+        self._cells.setdefault(self.cell(latitude, longitude), []).append(
+            city_name)
+        self._names.append(city_name)
+        self._coordinates.append((latitude, longitude))
+        self._arrays = None
+
+    def cell(self, latitude, longitude):
+        """
+        Returns the grid cell of the coordinates.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude.
+        longitude : str or float
+            The longitude.
+
+        Returns
+        -------
+        tuple of int
+            The cell's row and column.
+        """
+        return (round(float(latitude) / self.resolution),
+                round(float(longitude) / self.resolution))
+
+    def cities_in_cell(self, latitude, longitude):
+        """
+        Returns the cities in the same grid cell as the coordinates, whose
+        downloaded series can be reused for them.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude.
+        longitude : str or float
+            The longitude.
+
+        Returns
+        -------
+        list of str
+            The cities of the cell, in the order they were added.
+        """
+        return list(self._cells.get(self.cell(latitude, longitude), []))
+
+    def within(self, latitude, longitude, radius_km):
+        """
+        Returns every city within a radius, nearest first.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude of the center.
+        longitude : str or float
+            The longitude of the center.
+        radius_km : float
+            The radius in kilometers.
+
+        Returns
+        -------
+        list of tuple
+            (city name, distance in km) pairs, nearest first.
+        """
+        if not self._names:
+            return []
+        distances = self._distances(latitude, longitude)
+        inside = np.flatnonzero(distances <= radius_km)
+        inside = inside[np.argsort(distances[inside], kind='stable')]
+        return [(self._names[i], float(distances[i])) for i in inside]
+
+    def nearest(self, latitude, longitude):
+        """
+        Returns the city nearest to the coordinates.
+
+        Parameters
+        ----------
+        latitude : str or float
+            The latitude.
+        longitude : str or float
+            The longitude.
+
+        Returns
+        -------
+        tuple or None
+            (city name, distance in km), or None if the index is empty.
+        """
+        if not self._names:
+            return None
+        distances = self._distances(latitude, longitude)
+        i = int(np.argmin(distances))
+        return self._names[i], float(distances[i])
+
+    def _distances(self, latitude, longitude):
+        #Keep the coordinates as arrays between additions, one vectorized
+        #pass answers a query
+        if self._arrays is None:
+            self._arrays = np.array(self._coordinates).T
+        return haversine_km(float(latitude), float(longitude),
+                            self._arrays[0], self._arrays[1])
@@ -0,0 +1,581 @@
+import argparse
+import contextlib
+import datetime
+import queue
+import sys
+import threading
+from typing import NamedTuple
+import numpy as np
+from batch_report import REPORT_FIELDS, ReportWriter, read_cities
+from quantile_sketch import DEFAULT_K, KLLSketch
+from session_manager import get_default_session_manager
+from temperature_classifier import QuantileTable
+from weather_data_download import (WeatherDataDownload, fetch_forecast,
+                                   _consecutive_year_runs)
+from weather_calendar import AUTO_TIMEZONE, days_in_year, year_calendar
+from weather_data_statistics import MonthStats, WeatherDataStatistics
+
+#Streaming report over decades and thousands of cities: source -> per-month
+#reduce -> classify -> sink, each stage a generator pulling from the one
+#before it. One city-year is in flight at a time (plus the prefetch queue),
+#and each city keeps only running aggregates, never its series.
+
+#Report rows of the streaming pipeline cover a range of years, with the mean
+#and standard deviation of the month
+STREAM_REPORT_FIELDS = REPORT_FIELDS + [
+    'first_year', 'mean_day_temp_month', 'std_day_temp_month',
+    'mean_night_temp_month', 'std_night_temp_month'
+]
+
+class RunningStats:
+    """
+    Running count, minimum, maximum, mean and variance of a stream of values,
+    updated a batch at a time with Welford's algorithm (in the pairwise form
+    of Chan et al.) and mergeable across workers. Holds one aggregate per
+    block, e.g. 12 for the months of a year, so a whole year updates every
+    month in one vectorized pass. Missing values (NaN) are skipped. With a
+    `sketch_k`, every block also keeps a quantile sketch of its values.
+
+    Attributes
+    ----------
+    count : numpy.ndarray
+        The number of known values per block.
+    mean : numpy.ndarray
+        The mean per block, NaN for blocks without values.
+    m2 : numpy.ndarray
+        The sum of squared deviations from the mean per block.
+    minimum : numpy.ndarray
+        The minimum per block, NaN for blocks without values.
+    maximum : numpy.ndarray
+        The maximum per block, NaN for blocks without values.
+    sketches : list of KLLSketch
+        One quantile sketch per block, empty without a `sketch_k`.
+
+    Methods
+    -------
+    __init__(blocks=1, sketch_k=None)
+        Initializes empty aggregates.
+    update(values, starts=(0,))
+        Adds a batch of values, split into blocks at the given indices.
+    merge(other)
+        Adds the aggregates of another RunningStats.
+    variance(ddof=0)
+        Returns the variance per block.
+    std(ddof=0)
+        Returns the standard deviation per block.
+    quantile_table(block=0)
+        Returns the sketched quartiles of a block.
+    """
+
+    def __init__(self, blocks=1, sketch_k=None):
+        """
+        Initializes empty aggregates.
+
+        Parameters
+        ----------
+        blocks : int, optional
+            The number of independent aggregates, defaults to 1.
+        sketch_k : int, optional
+            Keeps a quantile sketch of this accuracy per block, see 
+            KLLSketch. By default no sketches are kept.
+        """
+        self.count = np.zeros(blocks, dtype=np.int64)
+        self.mean = np.full(blocks, np.nan)
+        self.m2 = np.zeros(blocks)
+        self.minimum = np.full(blocks, np.nan)
+        self.maximum = np.full(blocks, np.nan)
+        self.sketches = []
+        if sketch_k is not None:
+            self.sketches = [KLLSketch(sketch_k) for _ in range(blocks)]
+
+    def update(self, values, starts=(0,)):
+        """
+        Adds a batch of values, split into blocks at the given indices.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            The values of the batch.
+        starts : list of int, optional
+            The index of the first value of every block, one per block. By
+            default the whole batch goes to the single block.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        starts = np.asarray(starts)
+        known = ~np.isnan(values)
+        filled = np.where(known, values, 0)
+
+        count = np.add.reduceat(known, starts).astype(np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.add.reduceat(filled, starts) / count
+        lengths = np.diff(np.append(starts, len(values)))
+        deviations = np.where(known, values - np.repeat(mean, lengths), 0)
+        m2 = np.add.reduceat(deviations ** 2, starts)
+
+        self._combine(count, mean, m2, np.fmin.reduceat(values, starts),
+                      np.fmax.reduceat(values, starts))
+        for sketch, block in zip(self.sketches, 
+                                 np.split(values, starts[1:])):
+            sketch.update(block)
+
+    def merge(self, other):
+        """
+        Adds the aggregates of another RunningStats with the same blocks,
+        e.g. from another worker or another range of years.
+
+        Parameters
+        ----------
+        other : RunningStats
+            The aggregates to add.
+        """
+        self._combine(other.count, other.mean, other.m2, other.minimum,
+                      other.maximum)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+
+    def variance(self, ddof=0):
+        """
+        Returns the variance per block.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom, defaults to 0 like numpy.var.
+
+        Returns
+        -------
+        numpy.ndarray
+            NaN for blocks with too few values.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > ddof, self.m2 / (self.count - ddof),
+                            np.nan)
+
+    def std(self, ddof=0):
+        """
+        Returns the standard deviation per block.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom, defaults to 0 like numpy.std.
+
+        Returns
+        -------
+        numpy.ndarray
+            NaN for blocks with too few values.
+        """
+        return np.sqrt(self.variance(ddof))
+
+    def quantile_table(self, block=0):
+        """
+        Returns the sketched minimum, quartiles and maximum of a block.
+
+        Parameters
+        ----------
+        block : int, optional
+            The block, defaults to the first.
+
+        Returns
+        -------
+        QuantileTable
+            The approximate table.
+        """
+        return QuantileTable.from_sketch(self.sketches[block])
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            combined_mean = self.mean + delta * count / total
+            combined_m2 = (self.m2 + m2 +
+                           delta ** 2 * self.count * count / total)
+        #Blocks empty on either side keep the other side's aggregates
+        self.mean = np.where(count == 0, self.mean,
+                             np.where(self.count == 0, mean, combined_mean))
+        self.m2 = np.where(count == 0, self.m2,
+                           np.where(self.count == 0, m2, combined_m2))
+        self.count = total
+        self.minimum = np.fmin(self.minimum, minimum)
+        self.maximum = np.fmax(self.maximum, maximum)
+
+
+class CityYear(NamedTuple):
+    """
+    One year of one city's daily series, the unit flowing out of the source
+    stage. Its days are local to `timezone`.
+    """
+    city: str
+    latitude: str
+    longitude: str
+    year: int
+    daily_max: np.ndarray
+    daily_min: np.ndarray
+    timezone: str = AUTO_TIMEZONE
+
+
+class CitySummary(NamedTuple):
+    """
+    The running aggregates of every month of one city, over all its years,
+    the unit flowing out of the reduce stage. `day` and `night` are the
+    RunningStats of the daily max and min temperatures, one block and one
+    quantile sketch per month. Today is taken in `timezone`, like the days.
+    """
+    city: str
+    latitude: str
+    longitude: str
+    years: tuple
+    day: RunningStats
+    night: RunningStats
+    timezone: str = AUTO_TIMEZONE
+
+    def month_stats(self, month):
+        """
+        Returns the month's extremes over all years, as
+        WeatherDataStatistics.match_against_historical_weather() does for one
+        year.
+
+        Parameters
+        ----------
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+
+        Returns
+        -------
+        MonthStats
+            The extremes, with the last of the years.
+        """
+        index = month - 1
+        return MonthStats(month, self.years[-1],
+                          self.day.maximum[index], self.day.minimum[index],
+                          self.night.maximum[index],
+                          self.night.minimum[index])
+
+
+def read_city_years(cities, years, geocoding_cache=None, session_manager=None,
+                    climate_store=None, grid_resolution=None, on_error=None):
+    """
+    Source stage: yields every year of every city, city by city. Each run of
+    consecutive years is synced with the climate store at once, downloading
+    only what it lacks, and handed on a year at a time. A city whose
+    geocoding or download fails is reported and skipped, the others go on.
+
+    Parameters
+    ----------
+    cities : iterable of str
+        The names of the cities, read lazily.
+    years : list of int
+        The years of every city.
+    geocoding_cache, session_manager, climate_store, grid_resolution
+        Passed on to WeatherDataDownload.
+    on_error : callable, optional
+        on_error(city, error) is called for every city that fails, defaults 
+        to printing the error to stderr.
+
+    Yields
+    ------
+    CityYear
+        One year of one city, cities that cannot be found are skipped.
+    """
+    if on_error is None:
+        on_error = _print_error
+    runs = _consecutive_year_runs(years)
+    for city in cities:
+        #Sync every run before yielding, so a failed city yields no years
+        try:
+            downloader = WeatherDataDownload(city, geocoding_cache,
+                                             session_manager, climate_store,
+                                             grid_resolution=grid_resolution)
+            if downloader.latitude == 0 and downloader.longitude == 0:
+                continue
+            synced = [(first_year, last_year, downloader.sync_historical_data(
+                          datetime.date(first_year, 1, 1),
+                          datetime.date(last_year, 12, 31)))
+                      for first_year, last_year in runs]
+        except Exception as error:
+            on_error(city, error)
+            continue
+        for first_year, last_year, (daily_max, daily_min) in synced:
+            start = 0
+            for year in range(first_year, last_year + 1):
+                end = start + days_in_year(year)
+                yield CityYear(city, downloader.latitude,
+                               downloader.longitude, year,
+                               daily_max[start:end], daily_min[start:end],
+                               downloader.timezone)
+                start = end
+
+
+def reduce_months(city_years, sketch_k=DEFAULT_K):
+    """
+    Reduce stage: folds the years of every city into the running aggregates
+    of its twelve months. Years of a city must come one after another, as
+    read_city_years() yields them.
+
+    Parameters
+    ----------
+    city_years : iterable of CityYear
+        The years of every city.
+    sketch_k : int, optional
+        The accuracy of every month's quantile sketch, defaults to 
+        DEFAULT_K.
+
+    Yields
+    ------
+    CitySummary
+        One per city, as soon as its last year has been reduced.
+    """
+    summary = None
+    for city_year in city_years:
+        if summary is None or summary.city != city_year.city:
+            if summary is not None:
+                yield summary
+            summary = CitySummary(city_year.city, city_year.latitude,
+                                  city_year.longitude, (), 
+                                  RunningStats(12, sketch_k),
+                                  RunningStats(12, sketch_k),
+                                  city_year.timezone)
+        starts = year_calendar(city_year.year).month_starts[:-1]
+        summary.day.update(city_year.daily_max, starts)
+        summary.night.update(city_year.daily_min, starts)
+        summary = summary._replace(years=summary.years + (city_year.year,))
+    if summary is not None:
+        yield summary
+
+
+def classify_summaries(summaries, month, forecast, on_error=None):
+    """
+    Classify stage: compares today's forecast of every city with the sketched
+    quartiles of the month over all years, with
+    WeatherDataStatistics.compare_day_temps() and compare_night_temps(). A
+    city whose forecast fails is reported and skipped.
+
+    Parameters
+    ----------
+    summaries : iterable of CitySummary
+        The aggregates of every city.
+    month : int
+        The month to compare against (1 = January, ..., 12 = December).
+    forecast : callable
+        forecast(summary) returns today's max and min temperatures(°F).
+    on_error : callable, optional
+        on_error(city, error) is called for every city that fails, defaults 
+        to printing the error to stderr.
+
+    Yields
+    ------
+    dict
+        One report row per city, keyed by STREAM_REPORT_FIELDS.
+    """
+    if on_error is None:
+        on_error = _print_error
+    index = month - 1
+    for summary in summaries:
+        month_stats = summary.month_stats(month)
+        try:
+            today_max, today_min = forecast(summary)
+        except Exception as error:
+            on_error(summary.city, error)
+            continue
+        weather_stat = WeatherDataStatistics(summary.city)
+        day = weather_stat.compare_day_temps(today_max, month_stats, 
+            summary.day.quantile_table(index))
+        night = weather_stat.compare_night_temps(today_min, month_stats, 
+            summary.night.quantile_table(index))
+        yield {
+            'city': summary.city,
+            'latitude': summary.latitude,
+            'longitude': summary.longitude,
+            'year': summary.years[-1],
+            'month': month,
+            'max_day_temp_month': float(month_stats.max_day_temp_month),
+            'min_day_temp_month': float(month_stats.min_day_temp_month),
+            'max_night_temp_month': float(month_stats.max_night_temp_month),
+            'min_night_temp_month': float(month_stats.min_night_temp_month),
+            'today_max_day_temp': float(today_max),
+            'today_min_night_temp': float(today_min),
+            'day_message': day.message,
+            'night_message': night.message,
+            'first_year': summary.years[0],
+            'mean_day_temp_month': float(summary.day.mean[index]),
+            'std_day_temp_month': float(summary.day.std()[index]),
+            'mean_night_temp_month': float(summary.night.mean[index]),
+            'std_night_temp_month': float(summary.night.std()[index])
+        }
+
+
+def prefetch(items, size):
+    """
+    Runs an upstream stage on a background thread, at most `size` items
+    ahead of the consumer. A full queue blocks the producer, so a slow sink
+    slows the downloads down instead of piling data up in memory. Errors of
+    the producer are raised to the consumer.
+
+    Parameters
+    ----------
+    items : iterable
+        The upstream stage.
+    size : int
+        The most items waiting at a time.
+
+    Yields
+    ------
+    object
+        The items, in order.
+    """
+    buffer = queue.Queue(size)
+    stopped = threading.Event()
+
+    def put(item):
+        #Give up when the consumer is gone, instead of blocking forever
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+        except Exception as error:
+            put((False, error))
+            return
+        put((False, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            more, item = buffer.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def run_streaming_report(cities, month, years, writer, geocoding_cache=None,
+                         session_manager=None, climate_store=None,
+                         forecast=None, prefetch_size=8, on_error=None):
+    """
+    Runs the streaming report: cities are read, reduced, classified and
+    written one at a time, with downloads running up to `prefetch_size`
+    city-years ahead.
+
+    Parameters
+    ----------
+    cities : iterable of str
+        The names of the cities, read lazily.
+    month : int
+        The month to compare against (1 = January, ..., 12 = December).
+    years : list of int
+        The years of the history.
+    writer : ReportWriter
+        Receives the report rows, see STREAM_REPORT_FIELDS.
+    geocoding_cache, session_manager, climate_store
+        Passed on to WeatherDataDownload.
+    forecast : callable, optional
+        forecast(summary) returns today's max and min temperatures(°F),
+        defaults to downloading today's forecast.
+    prefetch_size : int, optional
+        The most city-years downloaded ahead of the reduce stage, defaults
+        to 8.
+    on_error : callable, optional
+        on_error(city, error) is called for every city that fails and is 
+        left out of the report, defaults to printing the error to stderr.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    if forecast is None:
+        forecast_session_manager = (session_manager or 
+                                    get_default_session_manager())
+        def forecast(summary):
+            return fetch_forecast(forecast_session_manager.forecast_client(),
+                                  summary.latitude, summary.longitude,
+                                  timezone=summary.timezone)
+
+    city_years = prefetch(read_city_years(cities, years, geocoding_cache,
+                                          session_manager, climate_store,
+                                          on_error=on_error),
+                          prefetch_size)
+    rows = classify_summaries(reduce_months(city_years), month, forecast,
+                              on_error)
+    written = 0
+    for row in rows:
+        writer.write(row)
+        written += 1
+    return written
+
+
+def main(argv=None):
+    """
+    Command line entry point, see `python streaming_pipeline.py --help`.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments, defaults to sys.argv.
+
+    Returns
+    -------
+    int
+        The exit status, 1 if any city could not be reported.
+    """
+    parser = argparse.ArgumentParser(
+        description='Compares today\'s weather with decades of history of '
+                    'many cities, streaming one city at a time.')
+    parser.add_argument('cities', nargs='?', default='-',
+                        help='file with one city per line, - for stdin')
+    parser.add_argument('--month', type=int, required=True,
+                        help='month to compare against (1-12)')
+    parser.add_argument('--first-year', type=int, required=True)
+    parser.add_argument('--last-year', type=int, default=2023)
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        default='jsonl', dest='output_format')
+    parser.add_argument('--output', default='-',
+                        help='report file, appended to, - for stdout')
+    args = parser.parse_args(argv)
+
+    if args.cities == '-':
+        cities = read_cities(sys.stdin)
+    else:
+        with open(args.cities, encoding='utf-8') as city_file:
+            cities = read_cities(city_file)
+
+    if args.output == '-':
+        output = contextlib.nullcontext(sys.stdout)
+    else:
+        output = open(args.output, 'a', encoding='utf-8', newline='')
+    with output as report_file:
+        writer = ReportWriter(report_file, args.output_format,
+                              fields=STREAM_REPORT_FIELDS)
+        failures = []
+
+        def on_error(city, error):
+            _print_error(city, error)
+            failures.append(city)
+
+        try:
+            run_streaming_report(cities, args.month,
+                                 range(args.first_year, args.last_year + 1),
+                                 writer, on_error=on_error)
+        finally:
+            writer.close()
+    return 1 if failures else 0
+
+
+def _print_error(city, error):
+    print(f'{city}: {error}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import numpy as np
+
+#Category codes shared by day and night classifications, from coldest (0) to
+#warmest (6)
+AVERAGE = 3
+
+DAY_MESSAGES = (
+    'Extremely cold in the day for this month',
+    'Considerably cold in the day for this month',
+    'Moderately cold in the day for this month',
+    'Average temperature in the day for this month',
+    'Moderately warm in the day for this month',
+    'Considerably warm in the day for this month',
+    'Record heat in the day for this month'
+)
+
+NIGHT_MESSAGES = (
+    'Record cold at night for this month',
+    'Considerably cold at night for this month',
+    'Moderately cold at night for this month',
+    'Average temperature at night for this month',
+    'Moderately warm at night for this month',
+    'Considerably warm at night for this month',
+    'Extremely hot at night for this month'
+)
+
+class QuantileTable:
+    """
+    Breakpoints of one month's temperature distribution (minimum, first
+    quartile, median, third quartile, maximum) used to classify temperatures
+    into 7 categories, from 0 (record cold) to 6 (record heat). Temperatures
+    are classified by binary search, so a whole array is classified at once.
+
+    Attributes
+    ----------
+    breakpoints : numpy.ndarray
+        The 5 increasing breakpoints [min, q1, median, q3, max].
+
+    Methods
+    -------
+    __init__(breakpoints)
+        Initializes the table with the given breakpoints.
+    from_values(values)
+        Builds a table from the empirical quartiles of daily temperatures.
+    from_range(low, high)
+        Builds a table that splits the range from low to high into four
+        equal parts.
+    from_sketch(sketch)
+        Builds a table from the approximate quartiles of a quantile sketch.
+    classify_day(temps)
+        Classifies daytime maximum temperatures.
+    classify_night(temps)
+        Classifies nighttime minimum temperatures.
+    """
+
+    def __init__(self, breakpoints):
+        """
+        Initializes the table with the given breakpoints.
+
+        Parameters
+        ----------
+        breakpoints : list of float
+            The 5 increasing breakpoints [min, q1, median, q3, max].
+        """
+        self.breakpoints = np.asarray(breakpoints, dtype=np.float64)
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Builds a table from the empirical quartiles of daily temperatures,
+        missing days (NaN) are ignored.
+
+        Parameters
+        ----------
+        values : list of float
+            The daily temperatures of the month, over one or many years.
+
+        Returns
+        -------
+        QuantileTable
+            The empirical table.
+        """
+        return cls(np.nanpercentile(values, [0, 25, 50, 75, 100]))
+
+    @classmethod
+    def from_sketch(cls, sketch):
+        """
+        Builds a table from the approximate quartiles of a quantile sketch,
+        with its exact minimum and maximum.
+
+        Parameters
+        ----------
+        sketch : KLLSketch
+            The sketch of the month's daily temperatures.
+
+        Returns
+        -------
+        QuantileTable
+            The approximate table.
+        """
+        return cls(sketch.quantiles([0, 0.25, 0.5, 0.75, 1]))
+
+    @classmethod
+    def from_range(cls, low, high):
+        """
+        Builds a table that splits the range from low to high into four
+        equal parts, for when only a month's extremes are known.
+
+        Parameters
+        ----------
+        low : float
+            The lowest temperature of the month.
+        high : float
+            The highest temperature of the month.
+
+        Returns
+        -------
+        QuantileTable
+            The linear table.
+        """
+        range_temp = high - low
+        return cls([low, range_temp / 4 + low, range_temp / 2 + low,
+                    range_temp * 3 / 4 + low, high])
+
+    def classify_day(self, temps):
+        """
+        Classifies daytime maximum temperatures, see DAY_MESSAGES.
+
+        Parameters
+        ----------
+        temps : float or list of float
+            The temperatures to classify.
+
+        Returns
+        -------
+        numpy.ndarray
+            One category code (0 to 6) per temperature.
+        """
+        return classify_day(self.breakpoints, temps)
+
+    def classify_night(self, temps):
+        """
+        Classifies nighttime minimum temperatures, see NIGHT_MESSAGES.
+
+        Parameters
+        ----------
+        temps : float or list of float
+            The temperatures to classify.
+
+        Returns
+        -------
+        numpy.ndarray
+            One category code (0 to 6) per temperature.
+        """
+        return classify_night(self.breakpoints, temps)
+
+
+def classify_day(breakpoints, temps):
+    """
+    Classifies daytime maximum temperatures against breakpoints. A 1-D
+    breakpoints array applies to every temperature; a 2-D array of shape
+    (cities, 5) holds one table per city and classifies one temperature per
+    city.
+
+    A temperature above the maximum is a record, above a breakpoint is the
+    warmer category, and a temperature at or below the median that rounds to
+    the median is average.
+
+    Parameters
+    ----------
+    breakpoints : numpy.ndarray
+        Shape (5,) or (cities, 5).
+    temps : float or list of float
+        The temperatures to classify.
+
+    Returns
+    -------
+    numpy.ndarray
+        One category code (0 to 6) per temperature.
+    """
+    breakpoints = np.asarray(breakpoints)
+    temps = np.atleast_1d(np.asarray(temps, dtype=np.float64))
+
+    #Count the breakpoints strictly below each temperature
+    if breakpoints.ndim == 1:
+        below = np.searchsorted(breakpoints, temps, side='left')
+        median = breakpoints[2]
+    else:
+        below = np.sum(breakpoints < temps[:, None], axis=1)
+        median = breakpoints[:, 2]
+
+    #Skip the average category, then fill it in by rounding
+    codes = below + (below >= AVERAGE)
+    average = (temps <= median) & (np.round(temps) == np.round(median))
+    return np.where(average, AVERAGE, codes)
+
+
+def classify_night(breakpoints, temps):
+    """
+    Classifies nighttime minimum temperatures against breakpoints, see
+    classify_day() for the shapes.
+
+    A temperature below the minimum is a record, below a breakpoint is the
+    colder category, and a temperature at or above the median that rounds to
+    the median is average.
+
+    Parameters
+    ----------
+    breakpoints : numpy.ndarray
+        Shape (5,) or (cities, 5).
+    temps : float or list of float
+        The temperatures to classify.
+
+    Returns
+    -------
+    numpy.ndarray
+        One category code (0 to 6) per temperature.
+    """
+    breakpoints = np.asarray(breakpoints)
+    temps = np.atleast_1d(np.asarray(temps, dtype=np.float64))
+
+    #Count the breakpoints at or below each temperature
+    if breakpoints.ndim == 1:
+        below = np.searchsorted(breakpoints, temps, side='right')
+        median = breakpoints[2]
+    else:
+        below = np.sum(breakpoints <= temps[:, None], axis=1)
+        median = breakpoints[:, 2]
+
+    #Skip the average category, then fill it in by rounding
+    codes = below + (below >= AVERAGE)
+    average = (temps >= median) & (np.round(temps) == np.round(median))
+    return np.where(average, AVERAGE, codes)
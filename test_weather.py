@@ -1,5 +1,58 @@
-from weather_data_download import WeatherDataDownload
+import asyncio
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import io
+import json
+import multiprocessing
+import subprocess
+import sys
+import threading
+import time
+import types
+import numpy as np
+import pytest
+import requests
+import geocoding_cache
+import openmeteo_fixtures
+import weather_data_download
+from batch_report import (PROCESS_START_METHOD, REPORT_FIELDS, ReportWriter,
+                          analyze_city, read_progress)
+from batch_report import main as batch_report_main
+from benchmark import find_regressions, read_history, run_benchmarks
+from benchmark import main as benchmark_main
+from cached_report import cached_month_stats
+from climate_store import ClimateStore
+from climatology import Climatology
+from forecast_cache import ForecastCache
+from geocoding_cache import GeocodingCache
+from hourly_aggregates import (NIGHT_WINDOW, daily_aggregates, reduce_window,
+                               rolling, rolling_mean)
+from metrics import metrics, record_response
+from openmeteo_fixtures import (FixtureSessionManager, decode_responses,
+                                encode_response, synthetic_response)
+from openmeteo_stub_server import StubServer, StubSettings
+from quantile_sketch import KLLSketch
+from query_planner import month_window, plan_month_query
+from session_manager import SessionManager
+from spatial_index import SpatialIndex, snap_to_grid
+from streaming_pipeline import (STREAM_REPORT_FIELDS, RunningStats,
+                                read_city_years, reduce_months,
+                                run_streaming_report)
+from temperature_classifier import QuantileTable, classify_day
+from weather_calendar import day_start_hours, year_calendar
+from weather_data_download import (WeatherDataDownload, archive_params,
+                                   forecast_params, _chunk_locations,
+                                   _consecutive_year_runs, _missing_ranges)
 from weather_data_statistics import WeatherDataStatistics
+from weather_download_async import AsyncRateLimiter, AsyncWeatherDataDownload
+from weather_report import print_comparison, print_month_stats
+from weather_variables import decode_response, variable_params
+
+#Startup budget of the cron entry point, in microseconds. It imports in about
+#0.1s, the HTTP stack alone takes longer than this budget
+IMPORT_TIME_BUDGET_US = 400000
 
 def test_find_lat_long():
     """
@@ -29,6 +82,53 @@ def test_find_lat_long():
     weather_down_irvineFAIL = WeatherDataDownload('Irvinewieuhf')
     assert weather_down_irvineFAIL.find_lat_long() == [0, 0]
 
+def test_geocoding_cache(tmp_path, monkeypatch):
+    """
+    Tests the 'GeocodingCache' used by 'find_lat_long'.
+
+    This tests that a stored result survives reopening the on-disk index, 
+    that lookups ignore case and extra whitespace, and that a cached city is 
+    resolved without touching the network.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Store a result and an unknown city, then reopen the index from disk
+    cache_path = str(tmp_path / 'geocoding.sqlite')
+    cache = GeocodingCache(cache_path)
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    cache.put('Irvinewieuhf', {})
+    cache.close()
+    cache = GeocodingCache(cache_path)
+
+    #Test normalized lookups and the not found marker
+    assert cache.get('  IRVINE ') == {'latitude': 33.66946,
+                                      'longitude': -117.82311}
+    assert cache.get('irvinewieuhf') == {}
+    assert cache.get('Huntington Beach') is None
+
+    #Test that the downloader answers from the cache
+    weather_down_irvine = WeatherDataDownload('irvine', cache)
+    assert weather_down_irvine.find_lat_long() == ['33.66946', '-117.82311']
+    weather_down_irvineFAIL = WeatherDataDownload('Irvinewieuhf', cache)
+    assert weather_down_irvineFAIL.find_lat_long() == [0, 0]
+
+    #Test that API errors are raised instead of cached as not found
+    for status, body in ((429, {'error': True, 'reason': 'Too many'}),
+                         (200, {'error': True, 'reason': 'Bad name'})):
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        monkeypatch.setattr(requests, 'get', 
+                            lambda *args, **kwargs: response)
+        with pytest.raises((requests.HTTPError, ValueError)):
+            cache.lookup('Huntington Beach')
+    assert cache.get('Huntington Beach') is None
+    cache.close()
+    assert GeocodingCache(cache_path).get('Huntington Beach') is None
+
 def test_get_historical_data():
     """
     Tests the 'get_historical_data' method from 'WeatherDataDownload'.
@@ -55,6 +155,747 @@ def test_get_historical_data():
     assert len(weather_down_hb.daily_temperature_2m_max) == 366
     assert len(weather_down_hb.daily_temperature_2m_min) == 366
 
+def test_historical_data_many_batching(tmp_path, monkeypatch):
+    """
+    Tests how 'get_historical_data_many' from 'WeatherDataDownload' splits 
+    its work into archive requests.
+
+    This tests that consecutive years share one date range, that the 
+    locations are chunked to the batch size and URL length limits and that 
+    a year synced only in part is downloaded whole.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Test that consecutive years are grouped into runs
+    assert _consecutive_year_runs([2023, 2020, 2021, 2022, 2018]) == [
+        (2018, 2018), (2020, 2023)]
+
+    #Test that locations are chunked by count and by coordinates length
+    locations = [('33.66946', '-117.82311')] * 5
+    assert [len(batch) for batch in 
+            _chunk_locations(locations, 2, 100, 6000)] == [2, 2, 1]
+    assert [len(batch) for batch in 
+            _chunk_locations(locations, 100, 100, 40)] == [2, 2, 1]
+
+    #A year holding only one synced month is not read back as complete
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    monkeypatch.setattr(weather_data_download, 
+                        'get_default_geocoding_cache', lambda: cache)
+    session_manager = FixtureSessionManager()
+    store = ClimateStore(str(tmp_path / 'store'))
+    WeatherDataDownload('Irvine', cache, session_manager, 
+                        store).get_month_history(12, 2023)
+    results = WeatherDataDownload.get_historical_data_many(['Irvine'], 2023,
+        session_manager=session_manager, climate_store=store)
+    max_temps, min_temps = results['Irvine'][2023]
+    assert not np.isnan(max_temps).any() and not np.isnan(min_temps).any()
+    assert len(session_manager.client.requests) == 2
+
+    #Once the whole year is stored it is read without any request
+    WeatherDataDownload.get_historical_data_many(['Irvine'], 2023,
+        session_manager=session_manager, climate_store=store)
+    assert len(session_manager.client.requests) == 2
+    cache.close()
+
+def test_async_rate_limiter():
+    """
+    Tests the 'AsyncRateLimiter' used by 'AsyncWeatherDataDownload'.
+
+    This tests that requests beyond the burst are spread out at the 
+    configured rate.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    async def acquire_many(limiter, count):
+        for _ in range(count):
+            await limiter.acquire()
+
+    #Test that 6 requests at 50 per second with a burst of 1 take 0.1s
+    start = time.monotonic()
+    asyncio.run(acquire_many(AsyncRateLimiter(50), 6))
+    assert time.monotonic() - start >= 0.09
+
+def test_session_manager(tmp_path):
+    """
+    Tests the 'SessionManager' shared by 'WeatherDataDownload' instances.
+
+    This tests that the clients are created once and reused, and that the 
+    archive and forecast clients keep their own expiry policies.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Create a session manager with a larger connection pool
+    manager = SessionManager(str(tmp_path / 'cache'), pool_maxsize=32)
+    archive = manager.archive_client()
+    forecast = manager.forecast_client()
+
+    #Test reuse, expiry policies and pool sizing
+    assert manager.archive_client() is archive
+    assert manager.forecast_client() is forecast
+    assert archive._session.settings.expire_after == -1
+    assert forecast._session.settings.expire_after == 3600
+    assert archive._session.get_adapter('https://')._pool_maxsize == 32
+    manager.close()
+
+def _write_store_days(root, first_day):
+    #Worker of test_climate_store, writes ten days one at a time
+    store = ClimateStore(root)
+    for day in range(first_day, first_day + 10):
+        store.write_range(33.66946, -117.82311, 'temperature_2m_max',
+                          datetime.date(2019, 1, 1) + datetime.timedelta(day),
+                          np.array([day], dtype=np.float32))
+
+def test_climate_store(tmp_path):
+    """
+    Tests the 'ClimateStore' that keeps downloaded daily series.
+
+    This tests that a stored year is read back memory-mapped, that ranges 
+    can span years, that merging a range keeps the days already stored, 
+    which days count as downloaded and that concurrent writers do not lose 
+    days.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Store a full leap year and read it back
+    store = ClimateStore(str(tmp_path))
+    year_2020 = np.arange(366, dtype=np.float32)
+    store.write_year('33.66946', '-117.82311', 'temperature_2m_max', 2020,
+                     year_2020)
+    stored = store.read_year(33.66946, -117.82311, 'temperature_2m_max', 2020)
+    assert isinstance(stored, np.memmap)
+    assert np.array_equal(stored, year_2020)
+    assert store.read_year(33.66946, -117.82311, 'temperature_2m_min',
+                           2020) is None
+
+    #Merge a range spanning the new year, NaN days keep the stored value
+    store.write_range(33.66946, -117.82311, 'temperature_2m_max',
+                      datetime.date(2020, 12, 30),
+                      np.array([np.nan, 1000, 1001], dtype=np.float32))
+    values = store.read_range(33.66946, -117.82311, 'temperature_2m_max',
+                              datetime.date(2020, 12, 29),
+                              datetime.date(2021, 1, 2))
+    assert np.array_equal(values[:4], [363, 364, 1000, 1001])
+    assert np.isnan(values[4])
+
+    #Only days with values, or flagged as answered, count as downloaded
+    store.write_range(33.66946, -117.82311, 'temperature_2m_max',
+                      datetime.date(2021, 1, 2),
+                      np.array([np.nan, np.nan, 5], dtype=np.float32),
+                      np.array([False, True, False]))
+    fetched = store.read_fetched(33.66946, -117.82311, 'temperature_2m_max',
+                                 datetime.date(2020, 12, 31),
+                                 datetime.date(2021, 1, 5))
+    assert fetched.tolist() == [True, True, False, True, True, False]
+
+    #Processes writing the same year concurrently keep each other's days
+    with concurrent.futures.ProcessPoolExecutor(
+            4, mp_context=multiprocessing.get_context(
+                PROCESS_START_METHOD)) as pool:
+        for future in [pool.submit(_write_store_days, str(tmp_path), day)
+                       for day in range(0, 40, 10)]:
+            future.result(timeout=60)
+    values = store.read_range(33.66946, -117.82311, 'temperature_2m_max',
+                              datetime.date(2019, 1, 1),
+                              datetime.date(2019, 2, 9))
+    assert values.tolist() == list(range(40))
+
+def test_sync_historical_data_from_store(tmp_path):
+    """
+    Tests the 'sync_historical_data' method from 'WeatherDataDownload'.
+
+    This tests that missing days are grouped into as few requests as 
+    possible, that a range the climate store already holds is answered 
+    without any request and that days the archive has no data for are not 
+    downloaded again.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Test that missing stretches close to each other are fetched together
+    missing = np.zeros(100, dtype=bool)
+    missing[3:5] = True
+    missing[10] = True
+    missing[50:60] = True
+    assert _missing_ranges(missing, 5) == [(3, 10), (50, 59)]
+    assert _missing_ranges(missing, 0) == [(3, 4), (10, 10), (50, 59)]
+    assert _missing_ranges(np.zeros(3, dtype=bool), 5) == []
+
+    #Fill the store for 2022 and 2023, then sync a range across both years
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    store = ClimateStore(str(tmp_path / 'store'))
+    for year in (2022, 2023):
+        store.write_year(33.66946, -117.82311, 'temperature_2m_max', year,
+                         np.full(365, 70, dtype=np.float32))
+        store.write_year(33.66946, -117.82311, 'temperature_2m_min', year,
+                         np.full(365, 50, dtype=np.float32))
+    weather_down_irvine = WeatherDataDownload('Irvine', cache,
+                                              climate_store=store)
+    max_temps, min_temps = weather_down_irvine.sync_historical_data(
+        datetime.date(2022, 12, 1), datetime.date(2023, 1, 31))
+    assert len(max_temps) == 62 and len(min_temps) == 62
+
+    #Test that a stored year is used by get_historical_data
+    weather_down_irvine.get_historical_data(2023)
+    assert len(weather_down_irvine.daily_temperature_2m_max) == 365
+
+    #Days the archive has no data for are remembered and not asked for again
+    def respond_with_gaps(params):
+        start_date = datetime.date.fromisoformat(params['start_date'])
+        end_date = datetime.date.fromisoformat(params['end_date'])
+        values = np.full((end_date - start_date).days + 1, 60.0)
+        values[::7] = np.nan
+        values[-3:] = np.nan
+        start_time = int(datetime.datetime.combine(start_date, 
+            datetime.time(), datetime.timezone.utc).timestamp())
+        return encode_response(33.66946, -117.82311, start_time, 
+            {name: values for name in params['daily']})
+
+    session_manager = FixtureSessionManager(respond_with_gaps)
+    weather_down_irvine = WeatherDataDownload('Irvine', cache, 
+        session_manager, store)
+    max_temps, _ = weather_down_irvine.sync_historical_data(
+        datetime.date(2021, 3, 1), datetime.date(2021, 3, 31))
+    assert np.isnan(max_temps).sum() == 7
+    weather_down_irvine.sync_historical_data(datetime.date(2021, 3, 1), 
+                                             datetime.date(2021, 3, 31))
+    assert len(session_manager.client.requests) == 1
+
+    #Recent days without data may still be filled in, so they are retried
+    today = datetime.date.today()
+    weather_down_irvine.sync_historical_data(
+        today - datetime.timedelta(days=30), today)
+    weather_down_irvine.sync_historical_data(
+        today - datetime.timedelta(days=30), today)
+    assert len(session_manager.client.requests) == 3
+    assert session_manager.client.requests[-1][1]['start_date'] == (
+        today - datetime.timedelta(days=2)).isoformat()
+
+def test_weather_calendar(tmp_path, monkeypatch):
+    """
+    Tests the shared calendar tables of 'weather_calendar' in leap years and 
+    across daylight saving changes, and that downloads use each city's 
+    timezone.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    calendar = year_calendar(2020)
+    assert calendar is year_calendar(2020)
+    assert calendar.month_rows(3) == slice(60, 91)
+    assert calendar.month_rows(7) == slice(182, 213)
+    assert calendar.row(datetime.date(2020, 12, 31)) == 365
+    assert month_window(2024, 2)[1] == datetime.date(2024, 2, 29)
+    weather_stat = WeatherDataStatistics('Irvine')
+    march = weather_stat.extract_data_for_month(np.arange(366), 3, 2020)
+    assert (march[0], len(march)) == (60, 31)
+    with pytest.raises(ValueError):
+        weather_stat.extract_data_for_month(np.arange(365), 3, 2020)
+
+    #New York moves its clocks forward on March 10 2024, so March 11 starts 
+    #an hour early in the continuous hourly series
+    day_starts = day_start_hours(datetime.date(2024, 3, 8), 4, 
+                                 'America/New_York')
+    assert list(day_starts) == [0, 24, 48, 71]
+    assert day_start_hours(datetime.date(2024, 3, 8), 4, 'auto') is None
+    day_max = reduce_window(np.arange(120), 4, (6, 18), np.fmax, day_starts)
+    assert list(day_max) == [17, 41, 65, 88]
+
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Berlin', {'latitude': 52.52437, 'longitude': 13.41053, 
+                         'timezone': 'Europe/Berlin'})
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    session_manager = FixtureSessionManager()
+    store = ClimateStore(str(tmp_path / 'store'))
+    for city, timezone in (('Berlin', 'Europe/Berlin'), ('Irvine', 'auto')):
+        downloader = WeatherDataDownload(city, cache, session_manager, store)
+        assert downloader.timezone == timezone
+        downloader.get_historical_data(2020)
+        downloader.get_forecast_data()
+        assert len(downloader.daily_temperature_2m_max) == 366
+        assert [params['timezone'] for _, params 
+                in session_manager.client.requests[-2:]] == [timezone] * 2
+
+    #Test that batched downloads request every timezone separately
+    cache.put('Paris', {'latitude': 48.85341, 'longitude': 2.3488, 
+                        'timezone': 'Europe/Paris'})
+    cache.put('Potsdam', {'latitude': 52.39886, 'longitude': 13.06566, 
+                          'timezone': 'Europe/Berlin'})
+    monkeypatch.setattr(weather_data_download, 
+                        'get_default_geocoding_cache', lambda: cache)
+    session_manager = FixtureSessionManager()
+    results = WeatherDataDownload.get_historical_data_many(
+        ['Potsdam', 'Paris', 'Berlin'], 2021, session_manager=session_manager,
+        climate_store=ClimateStore(str(tmp_path / 'batch')))
+    assert len(results['Paris'][2021][0]) == 365
+    assert [(params['timezone'], params['latitude']) for _, params 
+            in session_manager.client.requests] == [
+        ('Europe/Berlin', '52.39886,52.52437'), ('Europe/Paris', '48.85341')]
+
+    #Cities sharing coordinates but not a timezone share no days
+    cache.put('Kehl', {'latitude': 48.85341, 'longitude': 2.3488, 
+                       'timezone': 'Europe/Berlin'})
+    store = ClimateStore(str(tmp_path / 'shared'))
+    session_manager = FixtureSessionManager()
+    results = WeatherDataDownload.get_historical_data_many(
+        ['Paris', 'Kehl'], 2021, session_manager=session_manager, 
+        climate_store=store)
+    assert len(session_manager.client.requests) == 2
+    assert store.read_year(48.85341, 2.3488, 'temperature_2m_max', 2021, 
+                           'Europe/Paris') is not None
+    assert store.read_year(48.85341, 2.3488, 'temperature_2m_max', 
+                           2021) is None
+
+    #The async and streaming engines count days in the city's timezone too
+    class FixtureAsyncClient:
+        async def weather_api(self, url, params):
+            return session_manager.client.weather_api(url, params)
+
+    session_manager = FixtureSessionManager()
+    engine = AsyncWeatherDataDownload(geocoding_cache=cache)
+    engine._openmeteo = FixtureAsyncClient()
+    engine._semaphore = asyncio.Semaphore(1)
+    city_data = asyncio.run(engine.download_city('Berlin', 2021))
+    assert city_data['timezone'] == 'Europe/Berlin'
+    assert len(city_data['daily_temperature_2m_max']) == 365
+    run_streaming_report(['Paris'], 12, [2021], ReportWriter(io.StringIO()),
+                         cache, session_manager, store)
+    assert [params['timezone'] for _, params in 
+            session_manager.client.requests] == [
+        'Europe/Berlin', 'Europe/Berlin', 'Europe/Paris']
+    cache.close()
+
+def test_weather_variables(tmp_path, monkeypatch):
+    """
+    Tests that the variable registry of 'weather_variables' builds request 
+    parameters, decodes responses by variable instead of by position, and 
+    that further daily variables share the temperatures' request.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    assert variable_params(('temperature_2m_max', 'precipitation_sum'), 
+                           ('wind_speed_10m',)) == {
+        'daily': ['temperature_2m_max', 'precipitation_sum'],
+        'hourly': ['wind_speed_10m']}
+    assert variable_params() == {}
+    with pytest.raises(ValueError):
+        variable_params(('sunshine',))
+    with pytest.raises(ValueError):
+        variable_params(('temperature_2m',))
+
+    #The response lists the variables in another order than requested
+    values = {'precipitation_sum': np.array([0.0, 0.5]), 
+              'temperature_2m_min': np.array([50.0, 51.0]),
+              'temperature_2m_max': np.array([70.0, 71.0])}
+    response = decode_responses(encode_response(33.7, -117.8, 0, values))[0]
+    columns = decode_response(response, ('temperature_2m_max', 
+                                         'temperature_2m_min', 
+                                         'precipitation_sum'))
+    assert list(columns) == ['temperature_2m_max', 'temperature_2m_min', 
+                             'precipitation_sum']
+    for name, column in columns.items():
+        assert column.tolist() == values[name].tolist()
+
+    #Test that a missing variable is never read from another variable's 
+    #series, while an unlabeled series is matched by request order
+    with pytest.raises(KeyError):
+        decode_response(response, ('temperature_2m_max', 'rain_sum', 
+                                   'precipitation_sum'))
+    monkeypatch.setitem(openmeteo_fixtures.FIXTURE_VARIABLES, 'unlabeled', 
+                        (0, 0, 0))
+    response = decode_responses(encode_response(33.7, -117.8, 0, {
+        'temperature_2m_max': values['temperature_2m_max'], 
+        'unlabeled': values['precipitation_sum']}))[0]
+    columns = decode_response(response, ('temperature_2m_max', 
+                                         'precipitation_sum'))
+    assert columns['precipitation_sum'].tolist() == [0.0, 0.5]
+
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    session_manager = FixtureSessionManager()
+    downloader = WeatherDataDownload('Irvine', cache, session_manager, 
+                                     ClimateStore(str(tmp_path / 'store')))
+    for _ in range(2):
+        downloader.get_historical_data(2020, variables=(
+            'precipitation_sum', 'wind_speed_10m_max'))
+    assert len(session_manager.client.requests) == 1
+    _, params = session_manager.client.requests[0]
+    assert params['daily'] == ['temperature_2m_max', 'temperature_2m_min', 
+                               'precipitation_sum', 'wind_speed_10m_max']
+    assert list(downloader.daily_series) == params['daily']
+    precipitation = downloader.daily_series['precipitation_sum']
+    assert len(precipitation) == 366 and (precipitation >= 0).all()
+    assert (downloader.daily_temperature_2m_max > 
+            downloader.daily_temperature_2m_min).mean() > 0.9
+    cache.close()
+
+def test_query_planner(tmp_path):
+    """
+    Tests that month-scoped requests only ask for the month's days and the 
+    variables used, through 'plan_month_query', 'archive_params' and the 
+    'get_month_history' method from 'WeatherDataDownload'.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    plan = plan_month_query(2, [2024, 2023], ('temperature_2m_max',))
+    assert plan.windows == (
+        (datetime.date(2023, 2, 1), datetime.date(2023, 2, 28)),
+        (datetime.date(2024, 2, 1), datetime.date(2024, 2, 29)))
+    assert archive_params('1', '2', '2023-02-01', '2023-02-28', 
+                          plan.variables)['daily'] == ['temperature_2m_max']
+
+    #Test that stored Decembers are enough, without any other month or the 
+    #min temperatures
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    store = ClimateStore(str(tmp_path / 'store'))
+    for year in (2021, 2022, 2023):
+        store.write_range(33.66946, -117.82311, 'temperature_2m_max', 
+                          datetime.date(year, 12, 1), 
+                          np.full(31, year - 1950, dtype=np.float32))
+    weather_down_irvine = WeatherDataDownload('Irvine', cache,
+                                              climate_store=store)
+    history = weather_down_irvine.get_month_history(
+        12, [2021, 2022, 2023], ('temperature_2m_max',))
+    assert [series[0] for series in history['temperature_2m_max']] == [
+        71, 72, 73]
+
+    #Test that a month-only comparison reads the month from the store
+    weather_stat = WeatherDataStatistics('Irvine', weather_down_irvine)
+    table = weather_stat.quantile_table(12, years=[2021, 2022, 2023])
+    assert list(table.breakpoints) == [71, 71, 72, 73, 73]
+
+def test_fixture_downloads(tmp_path, capsys):
+    """
+    Tests the download and decoding paths of 'WeatherDataDownload' offline, 
+    against FlatBuffers fixtures, and that the benchmark suite runs.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    session_manager = FixtureSessionManager()
+    weather_down_irvine = WeatherDataDownload('Irvine', cache, 
+        session_manager, ClimateStore(str(tmp_path / 'store')))
+    weather_down_irvine.get_historical_data(2024)
+    weather_down_irvine.get_forecast_data()
+    assert len(weather_down_irvine.daily_temperature_2m_max) == 366
+    assert not np.isnan(weather_down_irvine.daily_temperature_2m_min).any()
+    assert (weather_down_irvine.today_max_day_temp > 
+            weather_down_irvine.today_min_night_temp)
+    assert len(session_manager.client.requests) == 2
+
+    #Test that every benchmark runs at the smallest scale
+    results = run_benchmarks((1,), (1,), rounds=1)
+    assert 'decode_historical[cities=1]' in results
+    assert 'extract_max_min[cities=1,years=1]' in results
+    assert find_regressions(results, {
+        name: {'min': timing['min'] / 2} for name, timing in results.items()
+        if timing['min'] > 0})
+
+    #Test that runs go to the given history and the ranges are not printed
+    history = tmp_path / 'history.jsonl'
+    capsys.readouterr()
+    for _ in range(2):
+        assert benchmark_main(['--quick', '--rounds', '1', '--output', 
+            str(tmp_path / 'bench.txt'), '--history', str(history)]) == 0
+    assert len(read_history(str(history))) == 2
+    assert '(today' not in capsys.readouterr().out
+
+def test_spatial_index(tmp_path):
+    """
+    Tests that cities in the same grid cell share one download, and the 
+    radius and nearest city queries of 'SpatialIndex'.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    assert snap_to_grid(33.66946, -117.82311) == ['33.7', '-117.8']
+    assert snap_to_grid('33.68', '-117.79') == ['33.7', '-117.8']
+
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    cache.put('Tustin', {'latitude': 33.70, 'longitude': -117.79})
+    cache.put('San Diego', {'latitude': 32.71571, 'longitude': -117.16472})
+    cache.put('Atlantis', {})
+    session_manager = FixtureSessionManager()
+    store = ClimateStore(str(tmp_path / 'store'))
+    for city in ('Irvine', 'Tustin'):
+        downloader = WeatherDataDownload(city, cache, session_manager, 
+                                         store, grid_resolution=0.1)
+        downloader.get_historical_data(2023)
+        assert len(downloader.daily_temperature_2m_max) == 365
+    assert len(session_manager.client.requests) == 1
+
+    index = SpatialIndex.from_geocoding_cache(cache)
+    assert len(index) == 3
+    assert sorted(index.cities_in_cell(33.7, -117.8)) == ['irvine', 'tustin']
+    nearby = index.within(33.66946, -117.82311, 20)
+    assert [name for name, _ in nearby] == ['irvine', 'tustin']
+    assert nearby[0][1] == 0
+    assert 4 < nearby[1][1] < 5
+    name, distance = index.nearest(32.8, -117.2)
+    assert name == 'san diego' and 9 < distance < 11
+    assert [name for name, _ in index.within(33.0, -117.5, 150)] == [
+        'san diego', 'irvine', 'tustin']
+    cache.close()
+
+def test_hourly_ingestion(tmp_path):
+    """
+    Tests the daily, night and rolling aggregates of 'hourly_aggregates' 
+    against plain loops, and the hourly mode of 'WeatherDataDownload'.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    rng = np.random.default_rng(0)
+    hourly = rng.normal(60, 10, 366 * 24).astype(np.float32)
+    daily = daily_aggregates({'temperature_2m': hourly}, 366)
+    day_max = [hourly[day * 24 + 6:day * 24 + 18].max() for day in range(366)]
+    night_min = [hourly[day * 24 + 18:day * 24 + 30].min() 
+                 for day in range(365)]
+    assert np.array_equal(daily['temperature_2m_day_max'], day_max)
+    #The last night is missing its morning, its evening is still used
+    assert np.array_equal(daily['temperature_2m_night_min'][:365], night_min)
+    assert daily['temperature_2m_night_min'][365] == hourly[-6:].min()
+    assert np.isnan(reduce_window(np.full(48, np.nan), 2, NIGHT_WINDOW)).all()
+
+    weekly = rolling(day_max, 7)
+    assert np.isnan(weekly[:6]).all()
+    assert weekly[6] == max(day_max[:7]) and weekly[-1] == max(day_max[-7:])
+    assert rolling_mean(day_max, 7)[10] == pytest.approx(
+        np.mean(day_max[4:11]))
+
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    session_manager = FixtureSessionManager()
+    weather_down_irvine = WeatherDataDownload('Irvine', cache, 
+        session_manager, ClimateStore(str(tmp_path / 'store')))
+    for _ in range(2):
+        weather_down_irvine.get_historical_data(2024, hourly=True)
+    assert len(weather_down_irvine.daily_temperature_2m_max) == 366
+    assert (np.asarray(weather_down_irvine.daily_temperature_2m_max) > 
+            weather_down_irvine.daily_temperature_2m_min).all()
+    #One request for the leap year and the next morning, the second call is 
+    #read from the store
+    (url, params), = session_manager.client.requests
+    assert params['hourly'] == ['temperature_2m'] and 'daily' not in params
+    assert (params['start_date'], params['end_date']) == ('2024-01-01', 
+                                                          '2025-01-01')
+    weather_down_irvine.get_forecast_data(hourly=True)
+    assert (weather_down_irvine.today_max_day_temp > 
+            weather_down_irvine.today_min_night_temp)
+    cache.close()
+
+def test_streaming_pipeline(tmp_path):
+    """
+    Tests that the streaming pipeline's running aggregates match the 
+    in-memory 'WeatherDataStatistics' and 'Climatology' results, and that 
+    its rows stream through 'ReportWriter'.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    rng = np.random.default_rng(0)
+    values = rng.normal(60, 10, 1000)
+    values[::7] = np.nan
+    halves = RunningStats(), RunningStats()
+    halves[0].update(values[:300])
+    halves[1].update(values[300:])
+    halves[0].merge(halves[1])
+    assert halves[0].count[0] == np.sum(~np.isnan(values))
+    assert halves[0].mean[0] == pytest.approx(np.nanmean(values))
+    assert halves[0].std()[0] == pytest.approx(np.nanstd(values))
+    assert halves[0].maximum[0] == np.nanmax(values)
+
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    cache.put('Boston', {'latitude': 42.35843, 'longitude': -71.05977})
+    cache.put('Atlantis', {})
+    session_manager = FixtureSessionManager()
+    store = ClimateStore(str(tmp_path / 'store'))
+    years = [2020, 2021, 2022]
+    city_years = read_city_years(['Irvine', 'Atlantis', 'Boston'], years,
+                                 cache, session_manager, store)
+    summaries = list(reduce_months(city_years))
+    assert [summary.city for summary in summaries] == ['Irvine', 'Boston']
+    assert summaries[0].years == tuple(years)
+
+    for summary in summaries:
+        downloader = WeatherDataDownload(summary.city, cache, 
+                                         session_manager, store)
+        weather_stat = WeatherDataStatistics(summary.city, downloader)
+        climatology = weather_stat.load_climatology(years)
+        for month in (2, 7, 12):
+            in_memory = [weather_stat.match_against_historical_weather(
+                month, year) for year in years]
+            streamed = summary.month_stats(month)
+            assert streamed.max_day_temp_month == max(
+                stats.max_day_temp_month for stats in in_memory)
+            assert streamed.min_night_temp_month == min(
+                stats.min_night_temp_month for stats in in_memory)
+            expected = climatology.month_stats('temperature_2m_max', month)
+            assert summary.day.mean[month - 1] == pytest.approx(
+                expected['mean'])
+            assert summary.day.std()[month - 1] == pytest.approx(
+                expected['std'])
+            assert summary.day.count[month - 1] == expected['count']
+            table = summary.day.quantile_table(month - 1)
+            assert np.allclose(table.breakpoints[1:4], 
+                               expected['percentiles'][1:4], atol=1)
+
+    output = io.StringIO()
+    writer = ReportWriter(output, 'csv', fields=STREAM_REPORT_FIELDS)
+    written = run_streaming_report(iter(['Irvine', 'Boston']), 7, years, 
+        writer, cache, session_manager, store, 
+        forecast=lambda summary: (200, -100), prefetch_size=1)
+    assert written == 2
+    lines = output.getvalue().splitlines()
+    assert lines[0] == ','.join(STREAM_REPORT_FIELDS)
+    assert 'Record heat in the day for this month' in lines[1]
+    assert 'Record cold at night for this month' in lines[2]
+
+    #Test that a failing city is reported and the others are written
+    def respond(params):
+        if params['latitude'].startswith('39.'):
+            raise ConnectionError('archive unavailable')
+        return synthetic_response(params)
+
+    cache.put('Denver', {'latitude': 39.73915, 'longitude': -104.9847})
+    errors = []
+    written = run_streaming_report(['Denver', 'Irvine'], 7, years, 
+        ReportWriter(io.StringIO(), 'jsonl', fields=STREAM_REPORT_FIELDS), 
+        cache, FixtureSessionManager(respond), store, 
+        forecast=lambda summary: (70, 50), 
+        on_error=lambda city, error: errors.append(city))
+    assert written == 1 and errors == ['Denver']
+    cache.close()
+
+def test_stub_server(tmp_path, monkeypatch):
+    """
+    Tests the download engine end to end against the local stand-in server 
+    'StubServer', including retries on server errors and rate limiting.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    settings = StubSettings(error_rate=0.3, seed=1)
+    with StubServer(settings=settings) as server:
+        urls = server.environment()
+        monkeypatch.setattr(geocoding_cache, 'GEOCODING_URL', 
+                            urls['OPENMETEO_GEOCODING_URL'])
+        monkeypatch.setattr(weather_data_download, 'ARCHIVE_URL', 
+                            urls['OPENMETEO_ARCHIVE_URL'])
+        monkeypatch.setattr(weather_data_download, 'FORECAST_URL', 
+                            urls['OPENMETEO_FORECAST_URL'])
+        session_manager = SessionManager(str(tmp_path / 'cache'), 
+                                         backoff_factor=0.01)
+        weather_down_irvine = WeatherDataDownload('Irvine', 
+            GeocodingCache(str(tmp_path / 'geocoding.sqlite')), 
+            session_manager, ClimateStore(str(tmp_path / 'store')))
+        weather_down_irvine.get_historical_data(2023)
+        weather_down_irvine.get_forecast_data()
+        assert len(weather_down_irvine.daily_temperature_2m_max) == 365
+        assert server.stats['errors'] > 0
+        assert server.stats['requests'] == server.stats['errors'] + 3
+
+        #Test that requests over the rate limit are answered with 429
+        settings.error_rate = 0
+        settings.rate_limit = 1
+        client = session_manager.forecast_client()
+        with pytest.raises(Exception, match='Too many'):
+            for _ in range(3):
+                client.weather_api(urls['OPENMETEO_FORECAST_URL'], 
+                    forecast_params('33.7', '-117.8'), force_refresh=True)
+        assert server.stats['rate_limited'] == 1
+        session_manager.close()
+
+def test_metrics(tmp_path, monkeypatch):
+    """
+    Tests that 'metrics' records the stages, API calls and cache hits of 
+    'WeatherDataDownload' and 'WeatherDataStatistics' when enabled, exports 
+    them and records nothing when disabled.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    weather_down_irvine = WeatherDataDownload('Irvine', cache, 
+        FixtureSessionManager(), ClimateStore(str(tmp_path / 'store')))
+    weather_down_irvine.get_historical_data(2023)
+    weather_stat = WeatherDataStatistics('Irvine', weather_down_irvine)
+    weather_stat.match_against_historical_weather(12)
+    weather_stat.compare_day_temps(70)
+    record_response(types.SimpleNamespace(url='https://api.open-meteo.com/x',
+                                          from_cache=True))
+
+    snapshot = metrics.snapshot()
+    counters = {(entry['name'], tuple(entry['labels'].values())): 
+                entry['value'] for entry in snapshot['counters']}
+    assert counters[('api_calls', ('archive',))] == 1
+    assert snapshot['tallies'] == [
+        {'name': 'api_calls', 'key': 'Irvine', 'value': 1}]
+    assert counters[('cache_hits', ('api.open-meteo.com',))] == 1
+    stages = {(entry['name'], entry['labels'].get('stage')) 
+              for entry in snapshot['timers']}
+    assert {('geocode', None), ('download', None), ('decode', None), 
+            ('store', None), ('statistics', 'match'), 
+            ('statistics', 'compare')} <= stages
+    text = metrics.to_prometheus()
+    assert '# TYPE weather_api_calls_total counter' in text
+    assert 'weather_api_calls_total{api="archive"} 1' in text
+    assert 'Irvine' not in text
+    assert 'weather_decode_seconds_count 1' in text
+    assert json.loads(metrics.to_json()) == snapshot
+
+    #Test that nothing is recorded when disabled
+    metrics.enabled = False
+    metrics.reset()
+    with metrics.timer('decode'):
+        metrics.count('api_calls')
+        metrics.tally('api_calls', 'Irvine')
+    assert metrics.snapshot() == {'counters': [], 'tallies': [], 
+                                  'timers': []}
+
 def test_get_forecast_data():
     """
     Tests the 'get_forecast_data' method from 'WeatherDataDownload'.
@@ -123,10 +964,575 @@ def test_extract_hist_weather_data_and_stats():
     assert round(temp_2023_mins[334]) == round(47.8157) #dec 1
     assert round(temp_2023_mins[364]) == round(51.235703) #dec 31
 
-def test_compare_temps_using_2023_hist_data():
+def test_vectorized_month_statistics():
+    """
+    Tests the 'extract_data_for_month', 'max_temp', 'min_temp' and 
+    'monthly_extremes' methods from 'WeatherDataStatistics' offline.
+
+    This tests that months are sliced on the real calendar in leap and 
+    non-leap years and that missing days (NaN) are ignored.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Use the day of the year as the temperature, so slices are easy to check
+    weather_stat = WeatherDataStatistics('Huntington Beach')
+    temps_2023 = np.arange(365, dtype=np.float32)
+    temps_2020 = np.arange(366, dtype=np.float32)
+
+    #Test July and December in a non-leap year and a leap year
+    assert list(weather_stat.extract_data_for_month(temps_2023, 7)[[0, -1]]
+                ) == [181, 211]
+    assert list(weather_stat.extract_data_for_month(temps_2023, 12)[[0, -1]]
+                ) == [334, 364]
+    assert list(weather_stat.extract_data_for_month(temps_2020, 12)[[0, -1]]
+                ) == [335, 365]
+
+    #Test that missing days are skipped and a missing month gives NaN
+    temps_2023[0:31] = np.nan
+    temps_2023[40] = np.nan
+    assert weather_stat.max_temp(temps_2023[31:59]) == 58
+    assert np.isnan(weather_stat.min_temp(temps_2023[0:31]))
+    extremes = weather_stat.monthly_extremes(temps_2023, temps_2023 - 10)
+    assert np.isnan(extremes['max_day'][0])
+    assert extremes['min_day'][1] == 31 and extremes['max_day'][11] == 364
+    assert extremes['min_night'][11] == 324
+
+def test_match_against_given_data(tmp_path):
+    """
+    Tests that 'match_against_historical_weather' from 
+    'WeatherDataStatistics' reuses data it is given instead of downloading.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Test with series passed straight to the method
+    weather_stat = WeatherDataStatistics('Huntington Beach')
+    temps_2023 = np.arange(365, dtype=np.float32)
+    weather_stat.match_against_historical_weather(12, 2023, temps_2023,
+                                                  temps_2023 - 10)
+    assert weather_stat.max_day_temp_month == 364
+    assert weather_stat.min_night_temp_month == 324
+    assert weather_stat.downloader is None
+
+    #Test with a downloader that already holds the year
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    weather_down_irvine = WeatherDataDownload('Irvine', cache)
+    weather_down_irvine.daily_temperature_2m_max = temps_2023 + 1
+    weather_down_irvine.daily_temperature_2m_min = temps_2023 - 1
+    weather_down_irvine.historical_year = 2023
+    weather_stat = WeatherDataStatistics('Irvine', weather_down_irvine)
+    weather_stat.match_against_historical_weather(1)
+    assert weather_stat.max_day_temp_month == 31
+    assert weather_stat.find_lat_long() == ['33.66946', '-117.82311']
+
+def test_quantile_classification():
+    """
+    Tests the 'compare_day_temps', 'compare_night_temps', 
+    'classify_day_temps' and 'classify_night_temps' methods from 
+    'WeatherDataStatistics' offline, and the fleet classification of 
+    'classify_day'.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #December day temps spread evenly from 60 to 76, night temps 40 to 56
+    temps_2023 = np.zeros(365, dtype=np.float32)
+    temps_2023[334:] = np.linspace(60, 76, 31)
+    weather_stat = WeatherDataStatistics('Huntington Beach')
+    weather_stat.match_against_historical_weather(12, 2023, temps_2023,
+                                                  temps_2023 - 20)
+
+    #Test the messages of the linear quartiles, 64, 68 and 72
+    assert (weather_stat.compare_day_temps(60).message == 
+        'Extremely cold in the day for this month')
+    assert (weather_stat.compare_day_temps(67.6).message == 
+        'Average temperature in the day for this month')
+    assert (weather_stat.compare_day_temps(68.1).message == 
+        'Moderately warm in the day for this month')
+    assert (weather_stat.compare_night_temps(39).message == 
+        'Record cold at night for this month')
+    assert (weather_stat.compare_night_temps(48.4).message == 
+        'Average temperature at night for this month')
+    assert (weather_stat.compare_night_temps(56).message == 
+        'Extremely hot at night for this month')
+
+    #Test that comparisons follow the empirical quartiles, not the range: 
+    #most days near 60 with one hot day put 62 above the median
+    skewed = temps_2023.copy()
+    skewed[334:] = np.append(np.linspace(58, 62, 30), 90)
+    weather_stat.match_against_historical_weather(12, 2023, skewed, 
+                                                  skewed - 20)
+    assert weather_stat.compare_day_temps(61.9).code == 5
+    assert weather_stat.compare_night_temps(41.9).code == 5
+    weather_stat.match_against_historical_weather(12, 2023, temps_2023,
+                                                  temps_2023 - 20)
+
+    #Test the empirical tables on an array of temperatures
+    assert list(weather_stat.classify_day_temps([59, 61, 65, 68, 70, 73, 77],
+                                                12)) == [0, 1, 2, 3, 4, 5, 6]
+    assert list(weather_stat.classify_night_temps([39, 41, 45, 48, 50, 53, 
+                                                   57], 12)) == [
+        0, 1, 2, 3, 4, 5, 6]
+
+    #Test one table per city, one temperature per city
+    tables = np.vstack([QuantileTable.from_range(60, 76).breakpoints,
+                        QuantileTable.from_range(40, 56).breakpoints])
+    assert list(classify_day(tables, [77, 50])) == [6, 4]
+
+def test_quantile_sketches(tmp_path):
+    """
+    Tests the accuracy, merging and serialization of 'KLLSketch', and the 
+    approximate mode of 'WeatherDataStatistics' against the exact one.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    rng = np.random.default_rng(0)
+    values = rng.normal(60, 10, 100000)
+    sketches = [KLLSketch(seed=worker) for worker in range(8)]
+    for sketch, part in zip(sketches, np.array_split(values, 8)):
+        for chunk in np.array_split(part, 50):
+            sketch.update(chunk)
+    merged = KLLSketch.from_array(sketches[0].to_array())
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    assert merged.count == len(values) and len(merged) < 1000
+    fractions = np.linspace(0, 1, 11)
+    ranks = np.searchsorted(np.sort(values), merged.quantiles(fractions))
+    assert np.abs(ranks / len(values) - fractions).max() < 0.02
+    assert merged.quantiles([0, 1]).tolist() == [values.min(), values.max()]
+    assert merged.rank(60)[0] == pytest.approx(np.mean(values <= 60), 
+                                               abs=0.02)
+
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    store = ClimateStore(str(tmp_path / 'store'))
+    years = list(range(2015, 2023))
+    exact = WeatherDataStatistics('Irvine', WeatherDataDownload('Irvine', 
+        cache, FixtureSessionManager(), store))
+    approximate = WeatherDataStatistics('Irvine', WeatherDataDownload(
+        'Irvine', cache, FixtureSessionManager(), store), approximate=True)
+    exact_table = exact.quantile_table(7, years=years)
+    approximate_table = approximate.quantile_table(7, years=years)
+    assert approximate_table.breakpoints[0] == exact_table.breakpoints[0]
+    assert approximate_table.breakpoints[4] == exact_table.breakpoints[4]
+    assert np.allclose(approximate_table.breakpoints, 
+                       exact_table.breakpoints, atol=1.5)
+
+    #Later runs merge the stored sketches without reading any series
+    session_manager = FixtureSessionManager()
+    rerun = WeatherDataStatistics('Irvine', WeatherDataDownload('Irvine', 
+        cache, session_manager, store), approximate=True)
+    assert np.array_equal(rerun.month_sketch(7, years=years).quantiles(
+        fractions), approximate.month_sketch(7, years=years).quantiles(
+        fractions))
+    assert session_manager.client.requests == []
+
+    month_stats = approximate.match_against_historical_weather(7, 2022)
+    record = approximate.compare_day_temps(200, month_stats)
+    assert record.code == 6
+    assert record.high_temp == month_stats.max_day_temp_month
+    assert approximate.compare_night_temps(-100, month_stats).code == 0
+
+    #Without years, a climatology or a match there is nothing to build from
+    for mode in (False, True):
+        unmatched = WeatherDataStatistics('Irvine', WeatherDataDownload(
+            'Irvine', cache, FixtureSessionManager(), store), 
+            approximate=mode)
+        with pytest.raises(ValueError, match='load_climatology'):
+            unmatched.quantile_table(7)
+        with pytest.raises(ValueError, match='load_climatology'):
+            unmatched.month_sketch(7)
+
+    #The month_stats the caller passes wins over a loaded climatology
+    def respond(params):
+        return synthetic_response(params, seed=int(params['start_date'][:4]))
+
+    weather_stat = WeatherDataStatistics('Irvine', WeatherDataDownload(
+        'Irvine', cache, FixtureSessionManager(respond), 
+        ClimateStore(str(tmp_path / 'years'))))
+    month_stats = weather_stat.match_against_historical_weather(7, 2020)
+    weather_stat.load_climatology([2018, 2022])
+    record = weather_stat.compare_day_temps(91, month_stats)
+    assert record.code == 6
+    assert record.high_temp == month_stats.max_day_temp_month
+    assert (record.low_temp, record.high_temp) == pytest.approx(
+        (81.46233, 90.16607))
+    record = weather_stat.compare_day_temps(91)
+    assert record.code == 5
+    assert (record.low_temp, record.high_temp) == pytest.approx(
+        (80.43610, 91.67697))
+    cache.close()
+
+def test_print_range(capsys):
+    """
+    Tests the 'print_range', 'format_range' and 'print_ranges' methods from 
+    'WeatherDataStatistics'.
+
+    This tests the per-degree visual, that a bad forecast value far outside 
+    the range does not recurse or draw thousands of dashes when scaled, and 
+    that many ranges are printed together.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Test the per-degree visual, with today outside the range
+    weather_stat = WeatherDataStatistics('Huntington Beach')
+    weather_stat.print_range(60.2, 64.4, 62)
+    weather_stat.print_range(60.2, 64.4, 65.6)
+    assert capsys.readouterr().out == (
+        '60F - (today 62F) - 64F \n60F - - - 64F - (today 66F) \n')
+
+    #Test that a bad value is scaled into a fixed width
+    line = weather_stat.format_range(50, 70, -999, width=20)
+    assert line.startswith('(today -999F) ') and line.count('-') < 25
+
+    #Test that a month without data shows placeholders instead of raising
+    assert (weather_stat.format_range(np.nan, np.nan, 61.6) == 
+            'n/a - (today 62F) - n/a ')
+    assert (weather_stat.format_range(np.float32(np.nan), 70, np.nan, 
+                                      width=10) == 
+            'n/a - (today n/a) - n/a ')
+
+    #Test that every city gets its own labeled line
+    weather_stat.print_ranges([(50, 70, 60), (40, 45, 47)], width=10,
+                              labels=['La Jolla', 'Irvine'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'La Jolla  50F - - - (today 60F) - - - - 70F '
+    assert lines[1].startswith('Irvine    40F ')
+
+def test_structured_results():
+    """
+    Tests that the 'WeatherDataStatistics' methods return their results 
+    without printing, and that 'print_month_stats' and 'print_comparison' 
+    print them.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    temps_2023 = np.zeros(365, dtype=np.float32)
+    temps_2023[334:] = np.linspace(60, 76, 31)
+    weather_stat = WeatherDataStatistics('Huntington Beach')
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        month_stats = weather_stat.match_against_historical_weather(
+            12, 2023, temps_2023, temps_2023 - 20)
+        day = weather_stat.compare_day_temps(77)
+    assert output.getvalue() == ''
+    assert month_stats == (12, 2023, 76, 60, 56, 40)
+    assert day.code == 6 and (day.low_temp, day.high_temp) == (60, 76)
+
+    #Test that a comparison against another table leaves the instance alone
+    other = QuantileTable.from_range(50, 56)
+    assert weather_stat.compare_night_temps(49, table=other).code == 0
+    assert weather_stat.compare_night_temps(49).code == 4
+
+    print_month_stats(month_stats, output)
+    print_comparison(day, file=output)
+    assert output.getvalue().splitlines() == [
+        'Max Day Temperature of the Month:    76.0',
+        'Min Day Temperature of the Month:    60.0',
+        'Max Night Temperature of the Month:  56.0',
+        'Min Night Temperature of the Month:  40.0',
+        '60F - - - - - - - - - - - - - - - 76F (today 77F) ',
+        'Record heat in the day for this month'
+    ]
+
+def test_forecast_cache():
+    """
+    Tests that 'ForecastCache' serves the last good forecast immediately, 
+    refreshes it in the background before it expires and keeps serving it, 
+    marked stale, when a refresh fails, but never past its day or for too 
+    long.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Noon in this computer's timezone, the days below must not change
+    start = datetime.datetime(2024, 6, 1, 12).timestamp()
+    now = [start]
+    results = [(61, 41), (62, 42), ConnectionError('forecast API down'),
+               ConnectionError('forecast API down')]
+    refresh_allowed = threading.Event()
+    def fetch(latitude, longitude, refresh, hourly, timezone):
+        #Hold every background refresh until the test lets it through
+        if refresh:
+            refresh_allowed.wait(5)
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    cache = ForecastCache(ttl=3600, refresh_ahead=300, fetch=fetch, 
+                          clock=lambda: now[0])
+    reading = cache.get('32.8', '-117.2')
+    assert reading[:2] == (61, 41) and not reading.stale
+
+    #Test that a fresh forecast is a cache read, and one close to expiry is 
+    #still served while a refresh replaces it
+    now[0] = start + 1000
+    reading = cache.get('32.8', '-117.2')
+    assert reading.age == 1000 and not reading.refreshing
+    now[0] = start + 3400
+    reading = cache.get('32.8', '-117.2')
+    assert reading[:2] == (61, 41) and reading.refreshing
+    refreshed = cache.refresh('32.8', '-117.2')
+    refresh_allowed.set()
+    refreshed.result()
+    assert cache.get('32.8', '-117.2')[:2] == (62, 42)
+
+    #Test that a failed refresh keeps the last good forecast
+    refresh_allowed.clear()
+    now[0] = start + 10000
+    reading = cache.get('32.8', '-117.2')
+    assert reading.stale and reading[:2] == (62, 42)
+    refreshed = cache.refresh('32.8', '-117.2')
+    refresh_allowed.set()
+    assert isinstance(refreshed.exception(), ConnectionError)
+    reading = cache.get('32.8', '-117.2')
+    assert reading[:2] == (62, 42) and isinstance(reading.error, 
+                                                  ConnectionError)
+    cache.close()
+
+    #Test that yesterday's forecast is replaced before it is served, and 
+    #that a forecast is not served too long after its refreshes fail
+    results[:] = [(61, 41), (62, 42), ConnectionError('forecast API down')]
+    now[0] = start + 11.5 * 3600
+    cache = ForecastCache(ttl=3600, refresh_ahead=300, fetch=fetch, 
+                          clock=lambda: now[0])
+    assert cache.max_stale == 6 * 3600
+    assert cache.get('32.8', '-117.2')[:2] == (61, 41)
+    now[0] = start + 12.5 * 3600
+    reading = cache.get('32.8', '-117.2')
+    assert reading[:2] == (62, 42) and reading.age == 0
+    now[0] = start + 18.5 * 3600
+    with pytest.raises(ConnectionError):
+        cache.get('32.8', '-117.2')
+    assert results == []
+    cache.close()
+
+    #Test that hourly aggregates are downloaded and cached separately
+    session_manager = FixtureSessionManager()
+    cache = ForecastCache(session_manager)
+    daily = cache.get('32.8', '-117.2')
+    hourly = cache.get('32.8', '-117.2', hourly=True)
+    assert cache.get('32.8', '-117.2', hourly=True)[:2] == hourly[:2]
+    assert daily[:2] != hourly[:2]
+    cache.get('32.8', '-117.2', timezone='America/Los_Angeles')
+    assert [('hourly' in params, params['timezone']) for _, params 
+            in session_manager.client.requests] == [
+        (False, 'auto'), (True, 'auto'), (False, 'America/Los_Angeles')]
+    cache.close()
+
+def test_cached_report(tmp_path):
+    """
+    Tests that 'cached_month_stats' answers from the local stores only, and 
+    that importing the cron entry point 'cached_report' never loads the HTTP 
+    stack or pandas, measured with `python -X importtime`.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    store = ClimateStore(str(tmp_path / 'store'))
+    assert cached_month_stats('Irvine', 12, 2023, cache, store) is None
+    store.write_range(33.66946, -117.82311, 'temperature_2m_max',
+                      datetime.date(2023, 12, 1), np.arange(60, 91))
+    store.write_range(33.66946, -117.82311, 'temperature_2m_min',
+                      datetime.date(2023, 12, 1), np.arange(40, 71))
+    weather_stat, month_stats = cached_month_stats('Irvine', 12, 2023, 
+                                                   cache, store)
+    assert month_stats[2:] == (90, 60, 70, 40)
+    assert cached_month_stats('Irvine', 11, 2023, cache, store) is None
+    assert cached_month_stats('Nowhere', 12, 2023, cache, store) is None
+
+    #Test that downloads stored under the grid cell are found
+    session_manager = FixtureSessionManager()
+    downloader = WeatherDataDownload('Irvine', cache, session_manager, 
+                                     store, grid_resolution=0.1)
+    downloader.get_historical_data(2022)
+    assert cached_month_stats('Irvine', 7, 2022, cache, store) is None
+    weather_stat, month_stats = cached_month_stats('Irvine', 7, 2022, 
+        cache, store, grid_resolution=0.1)
+    assert month_stats.max_day_temp_month == np.nanmax(
+        downloader.daily_temperature_2m_max[181:212])
+    assert len(session_manager.client.requests) == 1
+
+    #Test the import time of the entry point in a fresh interpreter
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import cached_report'],
+        capture_output=True, text=True, check=True)
+    imported = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                imported[name.strip()] = int(cumulative)
+    for heavy in ('pandas', 'requests', 'requests_cache', 'niquests',
+                  'openmeteo_requests', 'retry_requests'):
+        assert heavy not in imported
+    assert imported['cached_report'] < IMPORT_TIME_BUDGET_US
+
+def test_batch_report_rows(tmp_path):
+    """
+    Tests the statistics stage and the resumable writer of the batch report.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Analyze a city with December day temps from 60 to 76
+    temps_2023 = np.zeros(365, dtype=np.float32)
+    temps_2023[334:] = np.linspace(60, 76, 31)
+    city_data = {
+        'city': 'Huntington Beach', 'latitude': '33.6603',
+        'longitude': '-117.99923', 'year': 2023,
+        'daily_temperature_2m_max': temps_2023,
+        'daily_temperature_2m_min': temps_2023 - 20,
+        'today_max_day_temp': 77.0, 'today_min_night_temp': 39.0
+    }
+    row = analyze_city(city_data, 12)
+    assert row['max_day_temp_month'] == 76
+    assert row['day_message'] == 'Record heat in the day for this month'
+    assert row['night_message'] == 'Record cold at night for this month'
+
+    #Test that statistics workers do not inherit locks held by threads
+    with metrics._lock, concurrent.futures.ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context(
+                PROCESS_START_METHOD)) as pool:
+        assert pool.submit(analyze_city, city_data, 12).result(
+            timeout=60) == row
+
+    #Test that written rows are streamed and recorded as finished, like
+    #cities that failed for good
+    output = io.StringIO()
+    progress_path = str(tmp_path / 'progress.txt')
+    writer = ReportWriter(output, 'jsonl', progress_path)
+    writer.write(row)
+    writer.write_failure('Atlantis', 'not found')
+    writer.close()
+    assert json.loads(output.getvalue()) == row
+    assert read_progress(progress_path) == {'Huntington Beach', 'Atlantis'}
+
+def test_batch_report_resume(tmp_path, monkeypatch):
+    """
+    Tests the batch report end to end, from the city list to the report 
+    file, against FlatBuffers fixtures.
+
+    This tests that every found city gets one row, that cities not found 
+    fail once and that a resumed run only works on the cities left.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Irvine', {'latitude': 33.66946, 'longitude': -117.82311})
+    cache.put('Denver', {'latitude': 39.73915, 'longitude': -104.9847})
+    cache.put('Atlantis', {})
+    session_manager = FixtureSessionManager()
+    store = ClimateStore(str(tmp_path / 'store'))
+    monkeypatch.setattr(weather_data_download, 
+                        'get_default_geocoding_cache', lambda: cache)
+    monkeypatch.setattr(weather_data_download, 
+                        'get_default_session_manager', lambda: session_manager)
+    monkeypatch.setattr(weather_data_download, 
+                        'get_default_climate_store', lambda: store)
+
+    #The first run is cut short after two cities
+    cities_path = tmp_path / 'cities.txt'
+    output_path = str(tmp_path / 'report.csv')
+    progress_path = str(tmp_path / 'progress.txt')
+    arguments = [str(cities_path), '--month', '12', '--year', '2023', 
+                 '--format', 'csv', '--output', output_path, 
+                 '--progress', progress_path, '--io-threads', '2', 
+                 '--workers', '1']
+    cities_path.write_text('Irvine\nAtlantis\n', encoding='utf-8')
+    assert batch_report_main(arguments) == 1
+    assert read_progress(progress_path) == {'Irvine', 'Atlantis'}
+    requests_made = len(session_manager.client.requests)
+
+    #The resumed run skips both, the city not found included
+    cities_path.write_text('Irvine\nAtlantis\nDenver\n', encoding='utf-8')
+    assert batch_report_main(arguments) == 0
+    assert read_progress(progress_path) == {'Irvine', 'Atlantis', 'Denver'}
+    assert {params['latitude'] for _, params in 
+            session_manager.client.requests[requests_made:]} == {'39.73915'}
+
+    with open(output_path, encoding='utf-8', newline='') as report_file:
+        rows = list(csv.DictReader(report_file))
+    assert [row['city'] for row in rows] == ['Irvine', 'Denver']
+    assert list(rows[0]) == REPORT_FIELDS
+    for row in rows:
+        assert row['year'] == '2023' and row['month'] == '12'
+        assert float(row['max_day_temp_month']) >= float(
+            row['min_day_temp_month'])
+    cache.close()
+
+def test_climatology():
+    """
+    Tests the 'Climatology' built by 'load_climatology' from 
+    'WeatherDataStatistics'.
+
+    This tests that leap and non-leap years line up on the same calendar and 
+    that the per-month and per-day statistics match a direct computation.
+
+    Raises
+    ------
+    AssertionError
+        Passes silently unless any of the assertions fail.
+    """
+    #Build a climatology from a leap year and a non-leap year
+    max_2020 = np.arange(366, dtype=np.float32)
+    max_2021 = np.arange(365, dtype=np.float32) + 1000
+    climatology = Climatology([2020, 2021], [max_2020, max_2021],
+                              [max_2020 - 10, max_2021 - 10])
+    assert climatology.daily_temperature_2m_max.shape == (2, 366)
+
+    #Test that December 31 lines up and February 29 only has one year
+    dec_31 = climatology.day_stats('temperature_2m_max', 
+                                   datetime.date(2021, 12, 31))
+    assert dec_31['min'] == 365 and dec_31['max'] == 1364
+    feb_29 = climatology.day_stats('temperature_2m_max', 
+                                   datetime.date(2020, 2, 29))
+    assert feb_29['count'] == 1 and feb_29['mean'] == 59
+
+    #Test the March statistics against numpy on the raw values
+    march = np.concatenate((max_2020[60:91], max_2021[59:90]))
+    stats = climatology.month_stats('temperature_2m_max', 3)
+    assert stats['min'] == march.min() and stats['max'] == march.max()
+    assert np.isclose(stats['mean'], march.mean())
+    assert np.isclose(stats['std'], march.std())
+    assert np.allclose(stats['percentiles'], 
+                       np.percentile(march, (10, 25, 50, 75, 90)))
+
+def test_compare_temps_using_2023_hist_data(tmp_path):
     """
     Tests the 'compare_day_temps' and 'compare_night_temps' methods from 
-    WeatherDataStatistics using the default 2023 historical data.
+    WeatherDataStatistics using the default 2023 historical data, from 
+    FlatBuffers fixtures. December's day quartiles are 51.7, 55.8, 57.5, 
+    60.3 and 63.5, its night quartiles 37.2, 41.5, 43.4, 45.8 and 48.0.
 
     Raises
     ------
@@ -134,44 +1540,54 @@ def test_compare_temps_using_2023_hist_data():
         Passes silently unless any of the assertions fail.
     """
     #Create test instances and match to 2023 data
-    weather_stat_hb = WeatherDataStatistics('Huntington Beach')
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Huntington Beach', {'latitude': 33.6603, 
+                                   'longitude': -117.99923})
+    weather_stat_hb = WeatherDataStatistics('Huntington Beach', 
+        WeatherDataDownload('Huntington Beach', cache, 
+                            FixtureSessionManager(), 
+                            ClimateStore(str(tmp_path / 'store'))))
     weather_stat_hb.match_against_historical_weather(12)
 
     #Test that each statement is correct for today's possible weather
-    assert (weather_stat_hb.compare_day_temps(59) == 
+    assert (weather_stat_hb.compare_day_temps(50).message == 
         'Extremely cold in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(62) ==
+    assert (weather_stat_hb.compare_day_temps(54).message ==
         'Considerably cold in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(66) == 
+    assert (weather_stat_hb.compare_day_temps(56).message == 
         'Moderately cold in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(67.5) == 
+    assert (weather_stat_hb.compare_day_temps(57.2).message == 
         'Average temperature in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(69) == 
+    assert (weather_stat_hb.compare_day_temps(59).message == 
         'Moderately warm in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(72) == 
+    assert (weather_stat_hb.compare_day_temps(62).message == 
         'Considerably warm in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(76) == 
+    assert (weather_stat_hb.compare_day_temps(64).message == 
         'Record heat in the day for this month')
     
-    assert (weather_stat_hb.compare_night_temps(46) == 
+    assert (weather_stat_hb.compare_night_temps(36).message == 
         'Record cold at night for this month')
-    assert (weather_stat_hb.compare_night_temps(48) == 
+    assert (weather_stat_hb.compare_night_temps(40).message == 
         'Considerably cold at night for this month')
-    assert (weather_stat_hb.compare_night_temps(51) == 
+    assert (weather_stat_hb.compare_night_temps(42).message == 
         'Moderately cold at night for this month')
-    assert (weather_stat_hb.compare_night_temps(53) == 
+    assert (weather_stat_hb.compare_night_temps(43.4).message == 
         'Average temperature at night for this month')
-    assert (weather_stat_hb.compare_night_temps(54) == 
+    assert (weather_stat_hb.compare_night_temps(45).message == 
         'Moderately warm at night for this month')
-    assert (weather_stat_hb.compare_night_temps(57) == 
+    assert (weather_stat_hb.compare_night_temps(47).message == 
         'Considerably warm at night for this month')
-    assert (weather_stat_hb.compare_night_temps(59) == 
+    assert (weather_stat_hb.compare_night_temps(49).message == 
         'Extremely hot at night for this month')
+    cache.close()
 
-def test_compare_temps_using_2022_hist_data():
+def test_compare_temps_using_2022_hist_data(tmp_path):
     """
     Tests the 'compare_day_temps' and 'compare_night_temps' methods from 
-    WeatherDataStatistics using historical data from 2022.
+    WeatherDataStatistics using historical data from 2022, from FlatBuffers 
+    fixtures with other values than 2023's. December's day quartiles are 
+    52.0, 55.8, 58.6, 60.3 and 65.1, its night quartiles 36.6, 39.8, 41.7, 
+    43.7 and 50.5.
     
     Raises
     ------
@@ -179,36 +1595,44 @@ def test_compare_temps_using_2022_hist_data():
         Passes silently unless any of the assertions fail.
     """
     #Create test instances and match to 2022 data
-    weather_stat_hb = WeatherDataStatistics('Huntington Beach')
+    cache = GeocodingCache(str(tmp_path / 'geocoding.sqlite'))
+    cache.put('Huntington Beach', {'latitude': 33.6603, 
+                                   'longitude': -117.99923})
+    session_manager = FixtureSessionManager(
+        lambda params: synthetic_response(params, seed=2022))
+    weather_stat_hb = WeatherDataStatistics('Huntington Beach', 
+        WeatherDataDownload('Huntington Beach', cache, session_manager, 
+                            ClimateStore(str(tmp_path / 'store'))))
     weather_stat_hb.match_against_historical_weather(12, 2022)
 
     #Test that each statement is correct for today's possible weather
-    assert (weather_stat_hb.compare_day_temps(52) == 
+    assert (weather_stat_hb.compare_day_temps(51).message == 
         'Extremely cold in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(56) == 
+    assert (weather_stat_hb.compare_day_temps(55).message == 
         'Considerably cold in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(60) == 
+    assert (weather_stat_hb.compare_day_temps(57).message == 
         'Moderately cold in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(62.75) == 
+    assert (weather_stat_hb.compare_day_temps(58.55).message == 
         'Average temperature in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(65) == 
+    assert (weather_stat_hb.compare_day_temps(60).message == 
         'Moderately warm in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(69) == 
+    assert (weather_stat_hb.compare_day_temps(63).message == 
         'Considerably warm in the day for this month')
-    assert (weather_stat_hb.compare_day_temps(73) == 
+    assert (weather_stat_hb.compare_day_temps(66).message == 
         'Record heat in the day for this month')
 
-    assert (weather_stat_hb.compare_night_temps(41) == 
+    assert (weather_stat_hb.compare_night_temps(36).message == 
         'Record cold at night for this month')
-    assert (weather_stat_hb.compare_night_temps(43) == 
+    assert (weather_stat_hb.compare_night_temps(38).message == 
         'Considerably cold at night for this month')
-    assert (weather_stat_hb.compare_night_temps(47) == 
+    assert (weather_stat_hb.compare_night_temps(41).message == 
         'Moderately cold at night for this month')
-    assert (weather_stat_hb.compare_night_temps(49.4) == 
+    assert (weather_stat_hb.compare_night_temps(41.8).message == 
         'Average temperature at night for this month')
-    assert (weather_stat_hb.compare_night_temps(51) == 
+    assert (weather_stat_hb.compare_night_temps(43).message == 
         'Moderately warm at night for this month')
-    assert (weather_stat_hb.compare_night_temps(54) == 
+    assert (weather_stat_hb.compare_night_temps(47).message == 
         'Considerably warm at night for this month')
-    assert (weather_stat_hb.compare_night_temps(57) == 
+    assert (weather_stat_hb.compare_night_temps(51).message == 
         'Extremely hot at night for this month')
+    cache.close()
@@ -0,0 +1,275 @@
+import datetime
+import functools
+from typing import NamedTuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+
+#Calendar shared by the downloads, the climate store and the statistics: the
+#row of every date in a year's daily series, the rows of every month and the
+#UTC offset of every local day. Tables are built once per (year, timezone).
+
+#Lets the Open-Meteo API pick the timezone from the coordinates, for cities
+#whose geocoding result has none
+AUTO_TIMEZONE = 'auto'
+
+class YearCalendar(NamedTuple):
+    """
+    The date -> row table of one year in one timezone, see year_calendar().
+    `month_starts` holds 13 rows, month m spans rows [month_starts[m - 1],
+    month_starts[m]). `utc_offsets` holds the UTC offset in seconds at the
+    local midnight of every day, None for an unknown timezone.
+    """
+    year: int
+    timezone: str
+    days: int
+    month_starts: np.ndarray
+    utc_offsets: np.ndarray
+
+    def row(self, date):
+        """
+        Returns the row of a date of this year.
+
+        Parameters
+        ----------
+        date : datetime.date
+            The date.
+
+        Returns
+        -------
+        int
+            0 for January 1, `days - 1` for December 31.
+        """
+        if date.year != self.year:
+            raise ValueError(f'{date} is not in {self.year}')
+        return date.toordinal() - self._first_ordinal()
+
+    def date(self, row):
+        """
+        Returns the date of a row.
+
+        Parameters
+        ----------
+        row : int
+            The row, from 0 to `days - 1`.
+
+        Returns
+        -------
+        datetime.date
+            The date.
+        """
+        return datetime.date.fromordinal(self._first_ordinal() + int(row))
+
+    def month_rows(self, month):
+        """
+        Returns the rows of a month.
+
+        Parameters
+        ----------
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+
+        Returns
+        -------
+        slice
+            The month's rows in a series of the whole year.
+        """
+        return slice(int(self.month_starts[month - 1]),
+                     int(self.month_starts[month]))
+
+    def last_day(self, month):
+        """
+        Returns the last day of a month.
+
+        Parameters
+        ----------
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+
+        Returns
+        -------
+        datetime.date
+            The last day, e.g. February 29 in leap years.
+        """
+        return self.date(self.month_starts[month] - 1)
+
+    def _first_ordinal(self):
+        return datetime.date(self.year, 1, 1).toordinal()
+
+
+@functools.lru_cache(maxsize=None)
+def year_calendar(year, timezone=AUTO_TIMEZONE):
+    """
+    Returns the calendar of a year in a timezone, built on first use and
+    shared afterwards.
+
+    Parameters
+    ----------
+    year : int
+        The year.
+    timezone : str, optional
+        An IANA timezone, e.g. 'Europe/Berlin'. Defaults to AUTO_TIMEZONE,
+        whose UTC offsets are unknown.
+
+    Returns
+    -------
+    YearCalendar
+        The read-only tables of the year.
+    """
+    first = datetime.date(year, 1, 1)
+    days = days_in_year(year)
+    month_starts = np.array(
+        [datetime.date(year, month, 1).toordinal() - first.toordinal()
+         for month in range(1, 13)] + [days])
+    month_starts.flags.writeable = False
+
+    utc_offsets = None
+    zone = _zone(timezone)
+    if zone is not None:
+        utc_offsets = np.array([
+            datetime.datetime.combine(first + datetime.timedelta(days=day),
+                                      datetime.time(), zone)
+            .utcoffset().total_seconds() for day in range(days)
+        ], dtype=np.int32)
+        utc_offsets.flags.writeable = False
+    return YearCalendar(year, timezone, days, month_starts, utc_offsets)
+
+
+def month_boundaries(days_in_year):
+    """
+    Returns the index of the first day of every month within a year of daily
+    values, for callers that only know the length of the series.
+
+    Parameters
+    ----------
+    days_in_year : int
+        365, or 366 for leap years.
+
+    Returns
+    -------
+    numpy.ndarray
+        13 indices, month m spans [boundaries[m - 1], boundaries[m]).
+    """
+    return year_calendar(2000 if days_in_year == 366 else 2001).month_starts
+
+
+def day_start_hours(start_date, days, timezone):
+    """
+    Returns the row of every local midnight in an hourly series that starts
+    at the local midnight of `start_date`. Hourly series are continuous, so
+    after a daylight saving change a local day starts an hour earlier or
+    later than `day * 24`.
+
+    Parameters
+    ----------
+    start_date : datetime.date
+        The day of the first hour.
+    days : int
+        The number of days.
+    timezone : str
+        The timezone of the series.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        One row per day, or None when every day starts at `day * 24`
+        (no offset change, or an unknown timezone).
+    """
+    offsets = []
+    date = start_date
+    end_date = start_date + datetime.timedelta(days=days)
+    while date < end_date:
+        calendar = year_calendar(date.year, timezone)
+        if calendar.utc_offsets is None:
+            return None
+        last = min(end_date, datetime.date(date.year + 1, 1, 1))
+        offsets.append(calendar.utc_offsets[
+            calendar.row(date):calendar.row(date) + (last - date).days])
+        date = last
+    offsets = np.concatenate(offsets)
+    if (offsets == offsets[0]).all():
+        return None
+    return np.arange(days) * 24 + (offsets[0] - offsets) // 3600
+
+
+def local_today(timezone=AUTO_TIMEZONE, now=None):
+    """
+    Returns today's date in a timezone.
+
+    Parameters
+    ----------
+    timezone : str, optional
+        An IANA timezone, defaults to the local time of this computer.
+    now : float, optional
+        The Unix time to take the date of, defaults to the current time.
+
+    Returns
+    -------
+    datetime.date
+        Today's date.
+    """
+    if now is None:
+        return datetime.datetime.now(_zone(timezone)).date()
+    return datetime.datetime.fromtimestamp(now, _zone(timezone)).date()
+
+
+def resolve_timezone(location):
+    """
+    Returns the timezone of a geocoding result.
+
+    Parameters
+    ----------
+    location : dict
+        The geocoding result, empty for a city not found.
+
+    Returns
+    -------
+    str
+        The result's IANA timezone, or AUTO_TIMEZONE if it has none.
+    """
+    if location and location.get('timezone'):
+        return location['timezone']
+    return AUTO_TIMEZONE
+
+
+def days_in_year(year):
+    """
+    Returns the number of days in the given year.
+
+    Parameters
+    ----------
+    year : int
+        The year.
+
+    Returns
+    -------
+    int
+        366 for leap years, otherwise 365.
+    """
+    return (datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days
+
+
+def day_of_year_index(date):
+    """
+    Returns the row of the given date within its year's series.
+
+    Parameters
+    ----------
+    date : datetime.date
+        The date.
+
+    Returns
+    -------
+    int
+        0 for January 1, 364 or 365 for December 31.
+    """
+    return date.timetuple().tm_yday - 1
+
+
+@functools.lru_cache(maxsize=None)
+def _zone(timezone):
+    if timezone == AUTO_TIMEZONE:
+        return None
+    try:
+        return ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
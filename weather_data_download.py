@@ -1,8 +1,25 @@
-import openmeteo_requests
-import requests_cache
-import pandas as pd
-from retry_requests import retry
-import requests
+import datetime
+import os
+import numpy as np
+from climate_store import get_default_climate_store
+from geocoding_cache import get_default_geocoding_cache
+from hourly_aggregates import (HOURLY_AGGREGATES, HOURLY_VARIABLES, 
+                               daily_aggregates)
+from metrics import metrics
+from query_planner import DAILY_VARIABLES, plan_month_query
+from session_manager import get_default_session_manager
+from spatial_index import snap_to_grid
+from weather_calendar import (AUTO_TIMEZONE, day_start_hours, days_in_year,
+                              resolve_timezone)
+from weather_variables import decode_response, variable_params
+
+#Point the APIs at other servers, e.g. the local stand-in server of 
+#openmeteo_stub_server.py, with the OPENMETEO_ARCHIVE_URL and 
+#OPENMETEO_FORECAST_URL variables
+ARCHIVE_URL = os.environ.get(
+    'OPENMETEO_ARCHIVE_URL', 'https://archive-api.open-meteo.com/v1/archive')
+FORECAST_URL = os.environ.get(
+    'OPENMETEO_FORECAST_URL', 'https://api.open-meteo.com/v1/forecast')
 
 class WeatherDataDownload:
     """
@@ -17,37 +34,94 @@ class WeatherDataDownload:
         The latitude of the given city.
     longitude: float
         The longitude of the given city.
+    timezone : str
+        The city's timezone from its geocoding result, days and "today" are 
+        local to it. 'auto' lets the API resolve it from the coordinates.
+    geocoding_cache : GeocodingCache
+        The cache used to look up the city's coordinates.
+    session_manager : SessionManager
+        Provides the shared, cached Open-Meteo API clients.
+    climate_store : ClimateStore
+        The local store that downloaded daily series are kept in.
     daily_temperature_2m_max : list of float
         The historical list of maximum daily temperatures(°F) for the city
         for a given year.
     daily_temperature_2m_min : list of float
         The historical list of minimum daily temperatures(°F) for the city 
         for a given year.
+    historical_year : int
+        The year of `daily_temperature_2m_max` and 
+        `daily_temperature_2m_min`, None before any download.
+    daily_series : dict
+        Maps every daily variable of the last `get_historical_data()` call, 
+        e.g. 'precipitation_sum', to its series for `historical_year`.
     today_max_day_temp : float
         The forecasted maximum temperature(°F) for the city for today.
     today_min_night_temp : float
         The forecasted minimum temperature(°F) for the city for tonight.
+    forecast_cache : ForecastCache
+        Serves forecasts without waiting on the API, None to always download.
+    forecast_reading : ForecastReading
+        The last forecast served by `forecast_cache`, with its age.
+    grid_resolution : float
+        The grid spacing in degrees that coordinates are snapped to, so 
+        cities in the same grid cell share downloads, None to keep the exact 
+        geocoded coordinates.
 
     Methods
     -------
-    __init_(city_name)
+    __init_(city_name, geocoding_cache=None, session_manager=None, 
+            climate_store=None, forecast_cache=None, grid_resolution=None)
         Initializes the class instance with the given city name and retrieves 
         the city's latitude and longitude coordinates.
     find_lat_long()
         Finds the latitude and longitude for the given city using the Open-
-        Meteo geocoding API.
-    get_historical_data(year=2023)
+        Meteo geocoding API, answering repeat lookups from the geocoding 
+        cache.
+    get_historical_data(year=2023, hourly=False, variables=())
         Downloads the historical weather data (daily max and min 
-        temperatures) of the given city for the given year, defaults to 2023 
-        data.
-    get_forecast_data()
+        temperatures, and any further daily variables) of the given city for 
+        the given year, defaults to 2023 data. Years already in the climate 
+        store are read from disk.
+    sync_historical_data(start_date, end_date, merge_gap_days=30, 
+                         variables=DAILY_VARIABLES)
+        Downloads only the days of the given range that the climate store 
+        lacks and merges them into the store.
+    sync_hourly_data(start_date, end_date, aggregates=HOURLY_AGGREGATES)
+        Downloads hourly data for the days of the given range that the 
+        climate store lacks, and stores the daily aggregates of it.
+    get_month_history(month, years, variables=DAILY_VARIABLES)
+        Downloads one month of many years, without the rest of each year.
+    fetch_plan(plan)
+        Syncs every window of a query plan with the climate store.
+    get_historical_data_many(cities, years=2023, batch_size=100, 
+                             session_manager=None, climate_store=None,
+                             grid_resolution=None)
+        Downloads the historical weather data of many cities at once, packing 
+        many coordinates into each archive request.
+    get_forecast_data(hourly=False)
         Downloads the weather forecast for the given city for today, 
         including max and min temperatures.
     
     """
 
+    #Limits for one multi-location request, the Open-Meteo API rejects 
+    #requests with too many locations or too long of a URL
+    max_locations_per_request = 100
+    max_coordinates_length = 6000
+
+    #Days of hourly data in one archive request, a year of hours is decoded 
+    #and reduced at a time so memory stays flat over decades
+    max_hourly_days_per_request = 366
+
+    #The archive lags the present by a few days, a day it has no data for is 
+    #only taken as final, and not downloaded again, once it is this old
+    archive_delay_days = 7
+
     
-    def __init__(self, city_name):
+    def __init__(self, city_name, geocoding_cache=None, session_manager=None,
+                 climate_store=None, forecast_cache=None,
+                 grid_resolution=None):
         """
         Initializes the class instance with the given city name and retrieves 
         the city's latitude and longitude coordinates.
@@ -56,13 +130,43 @@ class WeatherDataDownload:
         ----------
         city_name : str
             The name of the city that weather data will be downloaded for.
+        geocoding_cache : GeocodingCache, optional
+            The cache used to look up the city's coordinates, defaults to the 
+            cache shared by the whole process.
+        session_manager : SessionManager, optional
+            Provides the Open-Meteo API clients, defaults to the session 
+            manager shared by the whole process.
+        climate_store : ClimateStore, optional
+            The local store for downloaded daily series, defaults to the 
+            store shared by the whole process.
+        forecast_cache : ForecastCache, optional
+            Serves the last good forecast while refreshing it in the 
+            background, by default every forecast is downloaded.
+        grid_resolution : float, optional
+            Snaps the coordinates to the center of their grid cell, e.g. 
+            spatial_index.GRID_RESOLUTION for the archive's grid, by default 
+            the exact geocoded coordinates are used.
         """
         self.city_name = city_name
+        if geocoding_cache is None:
+            geocoding_cache = get_default_geocoding_cache()
+        self.geocoding_cache = geocoding_cache
+        if session_manager is None:
+            session_manager = get_default_session_manager()
+        self.session_manager = session_manager
+        if climate_store is None:
+            climate_store = get_default_climate_store()
+        self.climate_store = climate_store
+        self.forecast_cache = forecast_cache
+        self.forecast_reading = None
+        self.grid_resolution = grid_resolution
         latlong = self.find_lat_long()
         self.latitude = latlong[0]
         self.longitude = latlong[1]
         self.daily_temperature_2m_max = [] #list for max temps
         self.daily_temperature_2m_min = [] #list for min temps
+        self.daily_series = {} #every daily variable by name
+        self.historical_year = None #year of the max and min temps lists
 
     
     def find_lat_long(self):
@@ -72,7 +176,10 @@ class WeatherDataDownload:
         External Source: DONT FORGET ABOUT THIS OK ASK DAD FOR THE EXTERNAL 
         CODE SOURCE
         Finds the latitude and longitude for the given city using the Open-
-        Meteo geocoding API.
+        Meteo geocoding API. Results are kept in the geocoding cache, so only 
+        the first lookup of a city goes to the network. With a 
+        `grid_resolution` the coordinates of the grid cell are returned. The 
+        city's timezone is kept as `timezone`.
 
         Returns
         -------
@@ -80,17 +187,22 @@ class WeatherDataDownload:
             A list containing the latitude and longitude as strings. If the 
             city is not found, it says it cannot find the given city.
         """
-        #Send a request to Open-Meteo geocoding API to fetch the city's 
-        #location data
-        result_city = requests.get(url =
-        'https://geocoding-api.open-meteo.com/v1/search?name=' + 
-        self.city_name + '&count-1&language=en&format=json')
-        location = result_city.json()
+        #Look the city up in the geocoding cache, which only sends a request 
+        #to the Open-Meteo geocoding API when the city is not cached yet
+        with metrics.timer('geocode'):
+            location = self.geocoding_cache.lookup(self.city_name)
+        self.timezone = resolve_timezone(location)
 
         #If results exist, extract the city's latitude and longitude data
-        if 'results' in location:
-            latitude = str(location['results'][0]['latitude'])
-            longitude = str(location['results'][0]['longitude'])
+        if location:
+            if self.grid_resolution:
+                #Cities in the same grid cell get the same coordinates, so 
+                #they share requests and climate store entries
+                return snap_to_grid(location['latitude'], 
+                                    location['longitude'], 
+                                    self.grid_resolution)
+            latitude = str(location['latitude'])
+            longitude = str(location['longitude'])
             return [latitude, longitude]
 
         #If results do not exist, tell the user that the location was not 
@@ -100,7 +212,7 @@ class WeatherDataDownload:
             return [0, 0]
 
     
-    def get_historical_data(self, year=2023):
+    def get_historical_data(self, year=2023, hourly=False, variables=()):
         """
         External code was moderately adapted to fit the purpose of this class 
         and the WeatherDataStatistics class.
@@ -114,64 +226,411 @@ class WeatherDataDownload:
         temperatures) of the given city for the given year, defaults to 2023 
         data.
 
+        A year that is already in the climate store is read from disk, 
+        memory-mapped, without any request or decoding. Days missing from the 
+        store are downloaded and added to it, see `sync_historical_data()`.
+
+        In hourly mode the max temperatures are the highs between 06:00 and 
+        18:00 and the min temperatures the lows of the night from 18:00 to 
+        06:00, derived from hourly data, see `sync_hourly_data()`.
+
+        Further daily variables, e.g. ('precipitation_sum',), are downloaded 
+        in the same archive request as the temperatures and decoded in the 
+        same pass.
+
         Parameters
         ----------
         year : int, optional
             Historical data for the given city will be retrieved from this 
             year, defaults to 2023.
+        hourly : bool, optional
+            Derives the max and min temperatures from hourly data, defaults 
+            to the archive's daily max and min temperatures.
+        variables : tuple of str, optional
+            Further daily variables, see weather_variables.WEATHER_VARIABLES, 
+            defaults to none.
 
         Returns
         -------
         None
             The data is saved as instance variables 
-            `daily_temperature_2m_max` and `daily_temperature_2m_min`. 
+            `daily_temperature_2m_max`, `daily_temperature_2m_min`, 
+            `daily_series` and `historical_year`. 
         """
-        # Setup the Open-Meteo API client with cache and retry on error
-        cache_session = requests_cache.CachedSession('.cache',
-                        expire_after = -1)
-        retry_session = retry(cache_session, retries = 5,
-                        backoff_factor = 0.2)
-        openmeteo = openmeteo_requests.Client(session = retry_session)
+        start_date = datetime.date(year, 1, 1)
+        end_date = datetime.date(year, 12, 31)
+        if hourly:
+            names = tuple(HOURLY_AGGREGATES)
+            series = self.sync_hourly_data(start_date, end_date)
+            extra = tuple(variable for variable in variables 
+                          if variable not in names)
+            if extra:
+                #Hourly and daily series are separate requests
+                series += self.sync_historical_data(start_date, end_date, 
+                                                    variables=extra)
+        else:
+            extra = tuple(variable for variable in variables 
+                          if variable not in DAILY_VARIABLES)
+            names = DAILY_VARIABLES
+            series = self.sync_historical_data(start_date, end_date, 
+                                               variables=names + extra)
+        self.daily_series = dict(zip(names + extra, series))
+        self.daily_temperature_2m_max, self.daily_temperature_2m_min = (
+            series[:2])
+        self.historical_year = year
 
-        start_year_date = f'{year}-01-01'  # Jan 1 of the given year
-        end_year_date = f'{year}-12-31'  # Dec 31 of the given year
-        
-        # Make sure all required weather variables are listed here
-        # The order of variables in hourly or daily is important to assign 
-        #them correctly below
-        url = 'https://archive-api.open-meteo.com/v1/archive'
-        params = {
-        	'latitude': self.latitude,
-        	'longitude': self.longitude,
-            'start_date': start_year_date,
-        	'end_date': end_year_date,
-        	'daily': ['temperature_2m_max', 'temperature_2m_min'],
-        	'temperature_unit': 'fahrenheit',
-        	'wind_speed_unit': 'mph',
-        	'precipitation_unit': 'inch',
-        	'timezone': 'America/Los_Angeles'
-        }
-        responses = openmeteo.weather_api(url, params=params)
-
-        # Process first location. Add a for-loop for multiple locations or 
-        #weather models
-        response = responses[0]
-        '''print(f'Coordinates {response.Latitude()}°N {response.Longitude()}
-        °E')
-        print(f'Elevation {response.Elevation()} m asl')
-        print(f'Timezone {response.Timezone()} 
-        {response.TimezoneAbbreviation()}')
-        print(f'Timezone difference to GMT+0 {response.UtcOffsetSeconds()} 
-        s')'''
-
-        # Process daily data. The order of variables needs to be the same as 
-        #requested.
-        daily = response.Daily()
-        self.daily_temperature_2m_max = daily.Variables(0).ValuesAsNumpy()
-        self.daily_temperature_2m_min = daily.Variables(1).ValuesAsNumpy()
+
+    def sync_historical_data(self, start_date, end_date, merge_gap_days=30,
+                             variables=DAILY_VARIABLES):
+        """
+        Brings the climate store up to date for the given date range, which 
+        may span many years. Only the days the store lacks are downloaded, in 
+        as few archive requests as possible, and merged into the store.
+
+        Missing days close to each other are fetched in one request, since 
+        downloading a few known days again is cheaper than another round 
+        trip. Days the archive has no data for are remembered by the store 
+        and not asked for again, unless they are recent enough for the 
+        archive to fill them in later, see `archive_delay_days`.
+
+        Parameters
+        ----------
+        start_date : datetime.date
+            The first day of the range.
+        end_date : datetime.date
+            The last day of the range.
+        merge_gap_days : int, optional
+            Missing stretches separated by at most this many stored days are 
+            fetched together, defaults to 30.
+        variables : tuple of str, optional
+            The daily variables to sync, only these are requested. Defaults 
+            to the daily max and min temperatures.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            One series per variable for the range, by default the daily 
+            maximum and daily minimum temperatures(°F), NaN for days the 
+            archive has no data for.
+        """
+        missing = self._missing_days(variables, start_date, end_date)
+        gaps = _missing_ranges(missing, merge_gap_days)
+        if not gaps:
+            return self._stored_series(variables, start_date, end_date)
+
+        # Reuse the shared Open-Meteo API client with cache and retry on error
+        openmeteo = self.session_manager.archive_client()
+
+        for first, last in gaps:
+            gap_start = start_date + datetime.timedelta(days=int(first))
+            gap_end = start_date + datetime.timedelta(days=int(last))
+
+            params = archive_params(self.latitude, self.longitude,
+                                    gap_start.isoformat(), gap_end.isoformat(),
+                                    variables, timezone=self.timezone)
+            metrics.count('api_calls', api='archive')
+            metrics.tally('api_calls', self.city_name)
+            with metrics.timer('download', api='archive'):
+                responses = openmeteo.weather_api(ARCHIVE_URL, params=params)
+
+            # Process first location, every variable in one pass
+            with metrics.timer('decode'):
+                columns = decode_response(responses[0], variables)
+
+            #Merge the downloaded days into the local climate store
+            settled = _settled_days(gap_start, (gap_end - gap_start).days + 1,
+                                    self.archive_delay_days)
+            with metrics.timer('store'):
+                for variable, values in columns.items():
+                    self.climate_store.write_range(self.latitude, 
+                        self.longitude, variable, gap_start, values, settled,
+                        self.timezone)
+
+        return self._stored_series(variables, start_date, end_date)
+
+
+    def sync_hourly_data(self, start_date, end_date, 
+                         aggregates=HOURLY_AGGREGATES):
+        """
+        Brings the climate store up to date with daily aggregates of hourly 
+        data, e.g. the lows of every night from 18:00 to 06:00. Only the days 
+        the store lacks are downloaded. The hourly values are streamed into 
+        float32 buffers of at most `max_hourly_days_per_request` days, 
+        reduced to daily values and dropped, so only the daily aggregates are 
+        kept.
+
+        Parameters
+        ----------
+        start_date : datetime.date
+            The first day of the range.
+        end_date : datetime.date
+            The last day of the range.
+        aggregates : dict, optional
+            Maps each derived daily variable to its (hourly variable, window, 
+            reduce), defaults to the day highs and the night lows.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            One daily series per aggregate for the range, NaN for days the 
+            archive has no data for.
+        """
+        names = tuple(aggregates)
+        missing = self._missing_days(names, start_date, end_date)
+        chunks = _split_ranges(_missing_ranges(missing, 0),
+                               self.max_hourly_days_per_request)
+        if not chunks:
+            return self._stored_series(names, start_date, end_date)
+
+        openmeteo = self.session_manager.archive_client()
+        hourly_variables = tuple(dict.fromkeys(
+            variable for variable, _, _ in aggregates.values()))
+        for first, last in chunks:
+            chunk_start = start_date + datetime.timedelta(days=int(first))
+            days = last - first + 1
+            #Nights run into the morning after the last day
+            chunk_end = chunk_start + datetime.timedelta(days=days)
+            params = archive_params(self.latitude, self.longitude,
+                                    chunk_start.isoformat(), 
+                                    chunk_end.isoformat(), (),
+                                    hourly_variables, self.timezone)
+            metrics.count('api_calls', api='archive_hourly')
+            metrics.tally('api_calls', self.city_name)
+            with metrics.timer('download', api='archive_hourly'):
+                responses = openmeteo.weather_api(ARCHIVE_URL, params=params)
+
+            with metrics.timer('decode'):
+                series = decode_response(responses[0], 
+                                         hourly=hourly_variables)
+            with metrics.timer('aggregate'):
+                #Local days are 23 or 25 hours long on daylight saving 
+                #changes, the response names the timezone it applied
+                day_starts = day_start_hours(chunk_start, days, 
+                    _response_timezone(responses[0], self.timezone))
+                daily = daily_aggregates(series, days, aggregates, 
+                                         day_starts)
+
+            settled = _settled_days(chunk_start, days, 
+                                    self.archive_delay_days)
+            with metrics.timer('store'):
+                for name, values in daily.items():
+                    self.climate_store.write_range(self.latitude, 
+                        self.longitude, name, chunk_start, values, settled, 
+                        self.timezone)
+
+        return self._stored_series(names, start_date, end_date)
+
+
+    def _missing_days(self, names, start_date, end_date):
+        #Days of the range that any of the variables was never downloaded for
+        return np.logical_or.reduce([~self.climate_store.read_fetched(
+            self.latitude, self.longitude, name, start_date, end_date, 
+            self.timezone) for name in names])
+
+
+    def _stored_series(self, names, start_date, end_date):
+        #The stored series of every variable for the range
+        return tuple(self.climate_store.read_range(self.latitude, 
+                         self.longitude, name, start_date, end_date, 
+                         self.timezone)
+                     for name in names)
+
+
+    def get_month_history(self, month, years, variables=DAILY_VARIABLES):
+        """
+        Downloads one month of many years, e.g. every December from 2014 to 
+        2023, asking the archive only for the days and variables of the 
+        month instead of whole years.
+
+        Parameters
+        ----------
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+        years : int or list of int
+            The years of the month.
+        variables : tuple of str, optional
+            The daily variables to download, defaults to the daily max and 
+            min temperatures.
+
+        Returns
+        -------
+        dict
+            Maps each variable to a list with the month's daily series of 
+            every year, in increasing order of years.
+        """
+        return self.fetch_plan(plan_month_query(month, years, variables))
+
+
+    def fetch_plan(self, plan):
+        """
+        Syncs every window of a query plan with the climate store, 
+        downloading only the plan's variables and the days the store lacks.
+
+        Parameters
+        ----------
+        plan : QueryPlan
+            The date windows and variables to fetch.
+
+        Returns
+        -------
+        dict
+            Maps each variable of the plan to a list with one series per 
+            window.
+        """
+        columns = {variable: [] for variable in plan.variables}
+        for start_date, end_date in plan.windows:
+            series = self.sync_historical_data(start_date, end_date, 
+                                               variables=plan.variables)
+            for variable, values in zip(plan.variables, series):
+                columns[variable].append(values)
+        return columns
+
+
+    @classmethod
+    def get_historical_data_many(cls, cities, years=2023, batch_size=100,
+                                 session_manager=None, climate_store=None,
+                                 grid_resolution=None):
+        """
+        Downloads the historical weather data (daily max and min 
+        temperatures) of many cities for the given years. The Open-Meteo 
+        archive API accepts comma-separated latitudes and longitudes, so many 
+        cities are packed into each request and the multi-location response 
+        is fanned out into per-city arrays. Consecutive years are fetched in 
+        the same request, and every request holds cities of one timezone, so 
+        days are local like those of get_historical_data(). Years the 
+        climate store holds every day of are read from disk, the others, 
+        e.g. years only synced for a month, are downloaded whole and added to 
+        it.
+
+        Parameters
+        ----------
+        cities : list of str
+            The names of the cities that weather data will be downloaded for.
+        years : int or list of int, optional
+            Historical data will be retrieved for these years, defaults to 
+            2023.
+        batch_size : int, optional
+            The number of locations packed into one request, defaults to 100 
+            and is capped by `max_locations_per_request`.
+        session_manager : SessionManager, optional
+            Provides the Open-Meteo API client, defaults to the session 
+            manager shared by the whole process.
+        climate_store : ClimateStore, optional
+            The local store for downloaded daily series, defaults to the 
+            store shared by the whole process.
+        grid_resolution : float, optional
+            Snaps coordinates to their grid cell, so cities in one cell and 
+            timezone are downloaded once, by default the exact coordinates 
+            are used.
+
+        Returns
+        -------
+        dict
+            Maps each city name to a dict that maps each year to a tuple of 
+            the daily maximum and daily minimum temperatures(°F) for that 
+            year. Cities that cannot be found are left out.
+        """
+        if isinstance(years, int):
+            years = [years]
+
+        # Reuse the shared Open-Meteo API client with cache and retry on error
+        if session_manager is None:
+            session_manager = get_default_session_manager()
+        openmeteo = session_manager.archive_client()
+        if climate_store is None:
+            climate_store = get_default_climate_store()
+
+        #Geocode every city, cities sharing coordinates and timezone share 
+        #one location in the request
+        locations = {}
+        for city in cities:
+            downloader = cls(city, session_manager=session_manager,
+                             climate_store=climate_store,
+                             grid_resolution=grid_resolution)
+            if downloader.latitude == 0 and downloader.longitude == 0:
+                continue
+            key = (downloader.latitude, downloader.longitude, 
+                   downloader.timezone)
+            locations.setdefault(key, []).append(city)
+
+        #Read every location and year the climate store holds in full, only 
+        #the rest needs to be downloaded
+        results = {city: {} for names in locations.values() for city in names}
+        missing = {}
+        for year in years:
+            first_day = datetime.date(year, 1, 1)
+            last_day = datetime.date(year, 12, 31)
+            for location, names in locations.items():
+                latitude, longitude, timezone = location
+                if not all(climate_store.read_fetched(latitude, longitude, 
+                               variable, first_day, last_day, timezone).all()
+                           for variable in DAILY_VARIABLES):
+                    missing.setdefault(year, []).append(location)
+                    continue
+                stored = tuple(climate_store.read_year(latitude, longitude, 
+                                                       variable, year, 
+                                                       timezone)
+                               for variable in DAILY_VARIABLES)
+                for city in names:
+                    results[city][year] = stored
+
+        for first_year, last_year in _consecutive_year_runs(missing):
+            #Locations missing any year of the run are fetched for all of it
+            run_locations = list(dict.fromkeys(
+                location for year in range(first_year, last_year + 1)
+                for location in missing[year]
+            ))
+            #A request counts days in a single timezone
+            by_timezone = {}
+            for location in run_locations:
+                by_timezone.setdefault(location[2], []).append(location)
+            batches = [(timezone, batch) 
+                       for timezone, group in by_timezone.items()
+                       for batch in _chunk_locations(group, batch_size,
+                           cls.max_locations_per_request,
+                           cls.max_coordinates_length)]
+            for timezone, batch in batches:
+                params = archive_params(
+                    ','.join(lat for lat, _, _ in batch),
+                    ','.join(lon for _, lon, _ in batch),
+                    f'{first_year}-01-01', f'{last_year}-12-31',
+                    timezone=timezone
+                )
+                metrics.count('api_calls', api='archive_batch')
+                metrics.count('locations_requested', len(batch))
+                with metrics.timer('download', api='archive_batch'):
+                    responses = openmeteo.weather_api(ARCHIVE_URL, 
+                                                      params=params)
+
+                #Responses come back in the same order as the locations
+                for location, response in zip(batch, responses):
+                    with metrics.timer('decode'):
+                        max_temps, min_temps = decode_response(
+                            response, DAILY_VARIABLES).values()
+
+                    #Split the run of years back into single years
+                    start = 0
+                    for year in range(first_year, last_year + 1):
+                        end = start + days_in_year(year)
+                        year_max = max_temps[start:end]
+                        year_min = min_temps[start:end]
+                        settled = _settled_days(datetime.date(year, 1, 1), 
+                                                end - start, 
+                                                cls.archive_delay_days)
+                        climate_store.write_year(*location[:2],
+                            'temperature_2m_max', year, year_max, settled, 
+                            timezone)
+                        climate_store.write_year(*location[:2],
+                            'temperature_2m_min', year, year_min, settled, 
+                            timezone)
+                        for city in locations[location]:
+                            results[city][year] = (year_max, year_min)
+                        start = end
+
+        return results
         
 
-    def get_forecast_data(self):
+    def get_forecast_data(self, hourly=False):
         """
         External code was moderately adapted to fit the purpose of this class 
         and the WeatherDataStatistics class.
@@ -184,49 +643,246 @@ class WeatherDataDownload:
         Downloads the weather forecast for the given city for today, 
         including max and min temperatures.
 
+        With a forecast cache, the last good forecast is served immediately 
+        and `forecast_reading` tells how old it is.
+
+        Parameters
+        ----------
+        hourly : bool, optional
+            Derives today's high between 06:00 and 18:00 and tonight's low 
+            from 18:00 to 06:00 from the hourly forecast, defaults to the 
+            daily max and min temperatures. A forecast cache keeps both 
+            kinds apart.
+
         Returns
         -------
         None
             The data is saved as instance variables `today_max_day_temp` and 
             `today_min_night_temp`.
         """
-        # Setup the Open-Meteo API client with cache and retry on error
-        cache_session = requests_cache.CachedSession('.cache', expire_after = 
-                        3600)
-        retry_session = retry(cache_session, retries = 5, backoff_factor = 
-                        0.2)
-        openmeteo = openmeteo_requests.Client(session = retry_session)
-
-        # Make sure all required weather variables are listed here
-        # The order of variables in hourly or daily is important to assign 
-        #them correctly below
-        url = 'https://api.open-meteo.com/v1/forecast'
-        params = {
-        	'latitude': self.latitude,
-        	'longitude': self.longitude,
-        	'daily': ['temperature_2m_max', 'temperature_2m_min'],
-        	'temperature_unit': 'fahrenheit',
-        	'wind_speed_unit': 'mph',
-        	'timezone': 'America/Los_Angeles',
-        	'forecast_days': 1
+        #Serve the last good forecast of a shared cache, it is refreshed in 
+        #the background
+        if self.forecast_cache is not None:
+            self.forecast_reading = self.forecast_cache.get(self.latitude, 
+                self.longitude, hourly, self.timezone)
+            self.today_max_day_temp = self.forecast_reading.today_max_day_temp
+            self.today_min_night_temp = (
+                self.forecast_reading.today_min_night_temp)
+            return
+
+        # Reuse the shared Open-Meteo API client with cache and retry on error
+        openmeteo = self.session_manager.forecast_client()
+        metrics.count('api_calls', api='forecast')
+        metrics.tally('api_calls', self.city_name)
+        self.today_max_day_temp, self.today_min_night_temp = fetch_forecast(
+            openmeteo, self.latitude, self.longitude, hourly=hourly, 
+            timezone=self.timezone)
+
+
+def fetch_forecast(openmeteo, latitude, longitude, hourly=False, 
+                   timezone=AUTO_TIMEZONE, **kwargs):
+    """
+    Downloads today's max and min temperatures of one location.
+
+    Parameters
+    ----------
+    openmeteo : openmeteo_requests.Client
+        The forecast API client.
+    latitude : str
+        The latitude of the location.
+    longitude : str
+        The longitude of the location.
+    hourly : bool, optional
+        Derives today's high and tonight's low from the hourly forecast, 
+        defaults to the daily max and min temperatures.
+    timezone : str, optional
+        The location's timezone, which decides what today is. Defaults to 
+        AUTO_TIMEZONE.
+    **kwargs
+        Passed on to the request, e.g. `force_refresh=True` to bypass the 
+        HTTP cache.
+
+    Returns
+    -------
+    tuple of float
+        Today's maximum and minimum temperatures(°F).
+    """
+    params = forecast_params(latitude, longitude, hourly, timezone)
+    with metrics.timer('download', api='forecast'):
+        responses = openmeteo.weather_api(FORECAST_URL, params=params, 
+                                          **kwargs)
+
+    # Process first location. Add a for-loop for multiple locations or 
+    #weather models
+    response = responses[0]
+
+    if hourly:
+        with metrics.timer('decode'):
+            series = decode_response(response, hourly=HOURLY_VARIABLES)
+        daily = daily_aggregates(series, 1)
+        return (daily['temperature_2m_day_max'][0], 
+                daily['temperature_2m_night_min'][0])
+
+    with metrics.timer('decode'):
+        daily = decode_response(response, DAILY_VARIABLES)
+    return (daily['temperature_2m_max'][0], 
+            daily['temperature_2m_min'][0])
+
+
+def archive_params(latitude, longitude, start_date, end_date, 
+                   variables=DAILY_VARIABLES, hourly_variables=(), 
+                   timezone=AUTO_TIMEZONE):
+    """
+    Builds the query parameters of an Open-Meteo archive request for the 
+    given daily and hourly variables, by default the daily max and min 
+    temperatures.
+
+    Parameters
+    ----------
+    latitude : str
+        The latitude, or comma-separated latitudes, of the locations.
+    longitude : str
+        The longitude, or comma-separated longitudes, of the locations.
+    start_date : str
+        The first day of the request, formatted as YYYY-MM-DD.
+    end_date : str
+        The last day of the request, formatted as YYYY-MM-DD.
+    variables : tuple of str, optional
+        The daily variables, see weather_variables.WEATHER_VARIABLES.
+    hourly_variables : tuple of str, optional
+        The hourly variables, defaults to none.
+    timezone : str, optional
+        The timezone days are counted in, defaults to AUTO_TIMEZONE so the 
+        API resolves it from each location's coordinates.
+
+    Returns
+    -------
+    dict
+        The query parameters for the archive API.
+    """
+    params = {
+        'latitude': latitude,
+        'longitude': longitude,
+        'start_date': start_date,
+        'end_date': end_date,
+        'temperature_unit': 'fahrenheit',
+        'wind_speed_unit': 'mph',
+        'precipitation_unit': 'inch',
+        'timezone': timezone
+    }
+    params.update(variable_params(variables, hourly_variables))
+    return params
+
+
+def forecast_params(latitude, longitude, hourly=False, 
+                    timezone=AUTO_TIMEZONE):
+    """
+    Builds the query parameters of an Open-Meteo forecast request for 
+    today's max and min temperatures.
+
+    Parameters
+    ----------
+    latitude : str
+        The latitude of the location.
+    longitude : str
+        The longitude of the location.
+    hourly : bool, optional
+        Asks for the hourly temperatures of today and tomorrow morning 
+        instead of the daily max and min, defaults to False.
+    timezone : str, optional
+        The timezone that decides what today is, defaults to AUTO_TIMEZONE.
+
+    Returns
+    -------
+    dict
+        The query parameters for the forecast API.
+    """
+    if hourly:
+        #Tonight runs into tomorrow morning
+        return {
+            'latitude': latitude,
+            'longitude': longitude,
+            **variable_params(hourly=HOURLY_VARIABLES),
+            'temperature_unit': 'fahrenheit',
+            'wind_speed_unit': 'mph',
+            'timezone': timezone,
+            'forecast_days': 2
         }
-        responses = openmeteo.weather_api(url, params=params)
-
-        # Process first location. Add a for-loop for multiple locations or 
-        #weather models
-        response = responses[0]
-        '''print(f'Coordinates {response.Latitude()}°N {response.Longitude()}
-        °E')
-        print(f'Elevation {response.Elevation()} m asl')
-        print(f'Timezone {response.Timezone()} 
-        {response.TimezoneAbbreviation()}')
-        print(f'Timezone difference to GMT+0 {response.UtcOffsetSeconds()} 
-        s')'''
-
-        # Process daily data. The order of variables needs to be the same as 
-        #requested.
-        daily = response.Daily()
-        daily_temperature_2m_max = daily.Variables(0).ValuesAsNumpy()
-        daily_temperature_2m_min = daily.Variables(1).ValuesAsNumpy()
-        self.today_max_day_temp = daily_temperature_2m_max[0]
-        self.today_min_night_temp = daily_temperature_2m_min[0]
\ No newline at end of file
+    return {
+        'latitude': latitude,
+        'longitude': longitude,
+        **variable_params(DAILY_VARIABLES),
+        'temperature_unit': 'fahrenheit',
+        'wind_speed_unit': 'mph',
+        'timezone': timezone,
+        'forecast_days': 1
+    }
+
+
+def _response_timezone(response, default):
+    #The timezone the API applied, e.g. the one it resolved for 'auto'
+    timezone = response.Timezone()
+    if isinstance(timezone, bytes):
+        timezone = timezone.decode()
+    return timezone or default
+
+
+def _missing_ranges(missing, merge_gap_days):
+    #Turn a mask of missing days into (first, last) index ranges, joining 
+    #ranges separated by at most merge_gap_days stored days
+    missing_days = np.flatnonzero(missing)
+    if len(missing_days) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(missing_days) > merge_gap_days + 1)
+    firsts = np.concatenate(([missing_days[0]], missing_days[breaks + 1]))
+    lasts = np.concatenate((missing_days[breaks], [missing_days[-1]]))
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+
+def _settled_days(start_date, days, delay_days):
+    #Flag the days old enough that the archive will not fill them in anymore
+    last_settled = datetime.date.today() - datetime.timedelta(days=delay_days)
+    return np.arange(days) <= (last_settled - start_date).days
+
+
+def _split_ranges(ranges, max_days):
+    #Split (first, last) index ranges into pieces of at most max_days days
+    pieces = []
+    for first, last in ranges:
+        for start in range(first, last + 1, max_days):
+            pieces.append((start, min(last, start + max_days - 1)))
+    return pieces
+
+
+def _consecutive_year_runs(years):
+    #Group the years into (first, last) runs of consecutive years, so every 
+    #run can be fetched with a single date range
+    runs = []
+    for year in sorted(set(years)):
+        if runs and runs[-1][1] + 1 == year:
+            runs[-1][1] = year
+        else:
+            runs.append([year, year])
+    return [tuple(run) for run in runs]
+
+
+def _chunk_locations(locations, batch_size, max_locations, max_length):
+    #Split the locations, (latitude, longitude, ...) tuples, into batches 
+    #that stay within the API's location count and URL length limits
+    batch_size = min(batch_size, max_locations)
+    batches = []
+    batch = []
+    length = 0
+    for location in locations:
+        latitude, longitude = location[:2]
+        location_length = len(latitude) + len(longitude) + 2
+        if batch and (len(batch) >= batch_size or 
+                      length + location_length > max_length):
+            batches.append(batch)
+            batch = []
+            length = 0
+        batch.append(location)
+        length += location_length
+    if batch:
+        batches.append(batch)
+    return batches
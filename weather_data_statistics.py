@@ -1,5 +1,42 @@
 import datetime
-from weather_data_download import WeatherDataDownload
+import sys
+from typing import NamedTuple
+import numpy as np
+from climatology import Climatology
+from geocoding_cache import get_default_geocoding_cache
+from metrics import metrics
+from quantile_sketch import DEFAULT_K, KLLSketch
+from query_planner import month_window
+from temperature_classifier import DAY_MESSAGES, NIGHT_MESSAGES, QuantileTable
+from weather_calendar import days_in_year, month_boundaries, year_calendar
+from weather_data_download import WeatherDataDownload, _consecutive_year_runs
+from weather_report import format_range, format_ranges
+
+class MonthStats(NamedTuple):
+    """
+    Historical extremes of one month, returned by 
+    WeatherDataStatistics.match_against_historical_weather().
+    """
+    month: int
+    year: int
+    max_day_temp_month: float
+    min_day_temp_month: float
+    max_night_temp_month: float
+    min_night_temp_month: float
+
+
+class TemperatureComparison(NamedTuple):
+    """
+    Comparison of today's temperature with the month's historical range, 
+    returned by WeatherDataStatistics.compare_day_temps() and 
+    compare_night_temps(). `code` ranges from 0 (coldest) to 6 (warmest).
+    """
+    temperature: float
+    code: int
+    message: str
+    low_temp: float
+    high_temp: float
+
 
 class WeatherDataStatistics:
     """
@@ -12,6 +49,9 @@ class WeatherDataStatistics:
     city_name : str
         The name of the given city, the data for which this class will 
         analyze.
+    month_stats : MonthStats
+        The result of the last match_against_historical_weather(), the four 
+        attributes below are read from it.
     max_day_temp_month : float
         The historical highest daily maximum temperature recorded for the 
         given month.
@@ -24,39 +64,73 @@ class WeatherDataStatistics:
     min_night_temp_month : float
         The historical lowest daily minimum temperature recorded for the 
         given month.
+    downloader : WeatherDataDownload
+        The data provider for the city, None until data is first needed.
+    climatology : Climatology
+        The multi-year climatology loaded last by load_climatology().
+    approximate : bool
+        Whether quantile tables and comparisons use quantile sketches instead 
+        of the daily values.
+    sketch_k : int
+        The accuracy of the quantile sketches, see KLLSketch.
 
     Methods
     -------
-    __init__(city_name)
+    __init__(city_name, downloader=None, approximate=False, 
+             sketch_k=DEFAULT_K)
         Initializes the class instance with the given city name.
+    get_downloader()
+        Returns the downloader used as data provider, creating it on first 
+        use.
     find_lat_long()
         Finds the latitude and longitude for the given city using the Open-
         Meteo geocoding API, same as in WeatherDataDownload.
-    extract_data_for_month(daily_extreme, month)
+    extract_data_for_month(daily_extreme, month, year=None)
         Made for match_against_historical_weather(), extracts the daily 
         extreme temperatures for the given month.
     max_temp(daily_temp)
         Finds the max temperature from a list of temperatures.
     min_temp(daily_temp)
         Finds the min temperature from a list of temperatures.
-    match_against_historical_weather(today_month, year=2023)
+    monthly_extremes(daily_max, daily_min)
+        Finds the extremes of all twelve months for both series at once.
+    match_against_historical_weather(today_month, year=2023, 
+                                     daily_max=None, daily_min=None)
         Compares today's temperatures against historical data for a given 
         month and year.
-    compare_day_temps(today_max_day_temp)
+    month_series(month, year)
+        Returns the daily max and min temperatures of one month, downloading 
+        only that month if needed.
+    load_climatology(years, percentiles=(10, 25, 50, 75, 90))
+        Loads the daily max and min temperatures of many years and computes 
+        their per-month and per-day-of-year statistics.
+    quantile_table(month, variable='temperature_2m_max', years=None)
+        Returns the empirical quantile table of a variable for the given 
+        month.
+    month_sketch(month, variable='temperature_2m_max', years=None)
+        Returns the merged quantile sketch of a month over many years.
+    classify_day_temps(temps, month)
+        Classifies many daytime maximum temperatures at once.
+    classify_night_temps(temps, month)
+        Classifies many nighttime minimum temperatures at once.
+    compare_day_temps(today_max_day_temp, month_stats=None, table=None)
         Compares today's maximum daytime temperature to the historical data 
         for the given month.
-    compare_night_temps(today_min_night_temp)
+    compare_night_temps(today_min_night_temp, month_stats=None, table=None)
         Compares today's minimum nighttime temperature to the historical data 
         for the given month.
-    print_range(low_temp, high_temp, today_temp)
+    print_range(low_temp, high_temp, today_temp, width=None)
         Prints a nice visual of a range of temperatures from low to high, 
         including today's temperature.
-    print_range_recursive(i)
-        Made for print_range(), uses recursion to print a temperature range 
-        with markers for today's temperature.
+    format_range(low_temp, high_temp, today_temp, width=None)
+        Builds the visual of print_range() as a single string, optionally 
+        scaled to a fixed width.
+    print_ranges(ranges, width=None, labels=None)
+        Prints the range visuals of many cities with a single write.
     """
 
-    def __init__(self, city_name):
+    def __init__(self, city_name, downloader=None, approximate=False,
+                 sketch_k=DEFAULT_K):
         """
         Initializes the class instance with the given city name.
 
@@ -65,15 +139,67 @@ class WeatherDataStatistics:
         city_name : str
             The name of the city, this class aims to analyze the city's 
             weather data.
+        downloader : WeatherDataDownload, optional
+            An existing downloader for the city whose coordinates and 
+            downloaded data are reused. If not given, one is created the 
+            first time data is needed.
+        approximate : bool, optional
+            Builds quantile tables from per-month quantile sketches kept in 
+            the climate store, in constant memory however many years are 
+            used. Defaults to the exact daily values.
+        sketch_k : int, optional
+            The accuracy of the quantile sketches, the rank error is about 
+            1.65 / sketch_k. Defaults to DEFAULT_K.
         """
         self.city_name = city_name
+        self.downloader = downloader
+        self.approximate = approximate
+        self.sketch_k = sketch_k
+        self.climatology = None
+        self._climatologies = {}
+        self.month_stats = None
+        self._match_series = (None, None, None, None)
+        self._quantile_tables = {}
+
+    #The month's extremes used to be separate attributes, they are now read 
+    #from the last MonthStats
+    @property
+    def max_day_temp_month(self):
+        return self.month_stats.max_day_temp_month
+
+    @property
+    def min_day_temp_month(self):
+        return self.month_stats.min_day_temp_month
+
+    @property
+    def max_night_temp_month(self):
+        return self.month_stats.max_night_temp_month
+
+    @property
+    def min_night_temp_month(self):
+        return self.month_stats.min_night_temp_month
+
+    def get_downloader(self):
+        """
+        Returns the downloader used as data provider for the city, creating 
+        (and geocoding) it only the first time it is needed.
+
+        Returns
+        -------
+        WeatherDataDownload
+            The downloader for the city.
+        """
+        if self.downloader is None:
+            self.downloader = WeatherDataDownload(self.city_name)
+        return self.downloader
 
     #Locates city_name to a real world city with latitude and longitude 
     #coordinates
     def find_lat_long(self):
         """
         Finds the latitude and longitude for the given city using the Open-
-        Meteo geocoding API, same as in WeatherDataDownload.
+        Meteo geocoding API, same as in WeatherDataDownload. Results are kept 
+        in the shared geocoding cache.
 
         Returns
         -------
@@ -81,20 +207,18 @@ class WeatherDataStatistics:
             A list containing the latitude and longitude as strings. If the 
             city is not found, it says it cannot find the given city.
         """
-        #Send a request to Open-Meteo geocoding API to fetch the city's 
-        #location data
-        result_city = requests.get(
-            url =
-            'https://geocoding-api.open-meteo.com/v1/search?name=' + 
-            self.city_name + '&count-1&language=en&format=json'
-                                  )
-        
-        location = result_city.json()
+        #Reuse the downloader's coordinates when there is one already
+        if self.downloader is not None:
+            return [self.downloader.latitude, self.downloader.longitude]
+
+        #Look the city up in the shared geocoding cache, which only sends a 
+        #request to the Open-Meteo geocoding API on a miss
+        location = get_default_geocoding_cache().lookup(self.city_name)
         
         #If results exist, extract the city's latitude and longitude data
-        if 'results' in location:
-            longitude = str(location['results'][0]['longitude'])
-            latitude = str(location['results'][0]['latitude'])
+        if location:
+            longitude = str(location['longitude'])
+            latitude = str(location['latitude'])
             return [latitude, longitude]
 
         #If results do not exist, tell the user that the location was not 
@@ -103,10 +227,12 @@ class WeatherDataStatistics:
             print('LOCATION', self.city_name, 'NOT FOUND :(')
             return [0, 0]
     
-    def extract_data_for_month(self, daily_extreme, month):
+    def extract_data_for_month(self, daily_extreme, month, year=None):
         """
         Made for match_against_historical_weather(), extracts the daily 
-        extreme temperatures for the given month.
+        extreme temperatures for the given month, using the rows of the 
+        shared calendar. Without a year, leap years are recognized by their 
+        366 values.
 
         Parameters
         ----------
@@ -115,27 +241,30 @@ class WeatherDataStatistics:
         month : int
             The month for which data is to be extracted (1 = January, 2 = 
             February, ..., 12 = December).
+        year : int, optional
+            The year of the series, checked against its length.
 
         Returns
         -------
         list of float
             A list of daily extreme temperatures for the specified month.
         """
-        days_prior = 0
-        days_per_month = [31, 28, 31, 30, 31, 30, 30, 31, 30, 31, 30, 31] 
-        for idx, i in enumerate(days_per_month):
-            if idx + 1 >= month:
-                break
-            else:
-                days_prior = days_prior + i
-        
-        return daily_extreme[
-        days_prior : days_prior + days_per_month[month-1] : 1
-        ]
+        if year is None:
+            #Look up the precomputed month boundaries for a 365 or 366 day 
+            #year
+            boundaries = month_boundaries(len(daily_extreme))
+            return daily_extreme[boundaries[month - 1] : boundaries[month]]
+
+        calendar = year_calendar(year)
+        if len(daily_extreme) != calendar.days:
+            raise ValueError(f'{year} has {calendar.days} days, got '
+                             f'{len(daily_extreme)}')
+        return daily_extreme[calendar.month_rows(month)]
 
     def max_temp(self, daily_temp): 
         """
-        Finds the max temperature from a list of temperatures.
+        Finds the max temperature from a list of temperatures. Missing days 
+        (NaN) are ignored.
 
         Parameters
         ----------
@@ -145,18 +274,18 @@ class WeatherDataStatistics:
         Returns
         -------
         float
-            The maximum temperature found in the list.
+            The maximum temperature found in the list, NaN if the list has no 
+            known temperature.
         """
-        max_temp = -1000 #impossibly cold initial temperature that any city 
-        #on Earth can not be  
-        for i in daily_temp:
-            if i > max_temp:
-                max_temp = i
-        return max_temp
+        daily_temp = np.asarray(daily_temp)
+        if np.isnan(daily_temp).all():
+            return np.nan
+        return np.nanmax(daily_temp)
 
     def min_temp(self, daily_temp): 
         """
-        Finds the min temperature from a list of temperatures.
+        Finds the min temperature from a list of temperatures. Missing days 
+        (NaN) are ignored.
 
         Parameters
         ----------
@@ -166,184 +295,452 @@ class WeatherDataStatistics:
         Returns
         -------
         float
-            The minimum temperature found in the list.
+            The minimum temperature found in the list, NaN if the list has no 
+            known temperature.
+
+        """
+        daily_temp = np.asarray(daily_temp)
+        if np.isnan(daily_temp).all():
+            return np.nan
+        return np.nanmin(daily_temp)
+
+    def monthly_extremes(self, daily_max, daily_min):
+        """
+        Finds the extremes of all twelve months for both the daily maximum and 
+        the daily minimum series of a year in one reduction. Missing days 
+        (NaN) are ignored.
 
+        Parameters
+        ----------
+        daily_max : list of float
+            The daily maximum temperatures of the year, 365 or 366 values.
+        daily_min : list of float
+            The daily minimum temperatures of the year, same length.
+
+        Returns
+        -------
+        dict
+            Maps 'max_day', 'min_day', 'max_night' and 'min_night' to arrays 
+            of 12 monthly values (index 0 = January), NaN for months without 
+            data.
         """
-        min_temp = 1000 #impossibly warm initial temperature that any city on 
-        #Earth can not be
-        for i in daily_temp:
-            if i < min_temp:
-                min_temp = i
-        return min_temp
+        series = np.vstack((daily_max, daily_min))
+        starts = month_boundaries(series.shape[1])[:-1]
+
+        #fmax/fmin skip NaN unless a whole month is missing
+        highs = np.fmax.reduceat(series, starts, axis=1)
+        lows = np.fmin.reduceat(series, starts, axis=1)
+        return {'max_day': highs[0], 'min_day': lows[0],
+                'max_night': highs[1], 'min_night': lows[1]}
 
-    def match_against_historical_weather(self, today_month, year=2023):
+    def match_against_historical_weather(self, today_month, year=2023,
+                                         daily_max=None, daily_min=None):
         """
         Compares today's temperatures against historical data for a given 
         month and year.
 
+        The historical data is taken from, in order: the given series, the 
+        downloader's data if it already holds the given year, or the 
+        downloader's climate store, which only downloads the missing days of 
+        the month, see month_series().
+
         Parameters
         ----------
         today_month : int
             The current month (1 = January, 2 = February, ..., 12 = December).
         year : int, optional
             The year for which historical data is to be used, default is 2023.
+        daily_max : list of float, optional
+            The daily maximum temperatures of the year, if already available.
+        daily_min : list of float, optional
+            The daily minimum temperatures of the year, if already available.
 
         Returns
         -------
-        None
-            Returns nothing but prints out statistical information about the 
-            given city's historical data.
-        """
-        #Placeholder instances to download historical weather
-        temporary_downloader = WeatherDataDownload(self.city_name)
-        temporary_downloader.get_historical_data(year)
-
-        #Extract temperatures for the given month
-        max_temps_month = self.extract_data_for_month(
-            temporary_downloader.daily_temperature_2m_max, today_month
-        )
-        min_temps_month = self.extract_data_for_month(
-            temporary_downloader.daily_temperature_2m_min, today_month
-        )
-
-        #Find the max/min temperatures of the day and the night for the given 
-        #month
-        self.max_day_temp_month = self.max_temp(max_temps_month)
-        self.min_day_temp_month = self.min_temp(max_temps_month)
-        self.max_night_temp_month = self.max_temp(min_temps_month)
-        self.min_night_temp_month = self.min_temp(min_temps_month)
-
-        #Print out the analyzed historical data
-        print('Max Day Temperature of the Month:   ' ,
-              self.max_day_temp_month)
-        print('Min Day Temperature of the Month:   ' ,
-              self.min_day_temp_month)
-        print('Max Night Temperature of the Month: ' ,
-              self.max_night_temp_month)
-        print('Min Night Temperature of the Month: ' ,
-              self.min_night_temp_month)
-        
+        MonthStats
+            The month's historical extremes, also kept as `month_stats` for 
+            compare_day_temps() and compare_night_temps(). Nothing is printed, 
+            see weather_report.print_month_stats().
+        """
+        #Only go to the data provider when the series were not given
+        if daily_max is None or daily_min is None:
+            month_max, month_min = self.month_series(today_month, year)
+
+            #Find the max/min temperatures of the day and the night for the 
+            #month
+            with metrics.timer('statistics', stage='match'):
+                month_stats = MonthStats(
+                    today_month, year,
+                    self.max_temp(month_max), self.min_temp(month_max),
+                    self.max_temp(month_min), self.min_temp(month_min)
+                )
+        else:
+            month_max = self.extract_data_for_month(daily_max, today_month,
+                                                    year)
+            month_min = self.extract_data_for_month(daily_min, today_month,
+                                                    year)
+
+            #Whole years are reduced for all months in one pass
+            with metrics.timer('statistics', stage='match'):
+                extremes = self.monthly_extremes(daily_max, daily_min)
+                index = today_month - 1
+                month_stats = MonthStats(
+                    today_month, year,
+                    extremes['max_day'][index], extremes['min_day'][index],
+                    extremes['max_night'][index], 
+                    extremes['min_night'][index]
+                )
+
+        #Remember the result for the compare methods in one assignment, and 
+        #drop tables built from an earlier match of the same year
+        self._match_series = (year, today_month, month_max, month_min)
+        self.month_stats = month_stats
+        self._quantile_tables = {key: table for key, table 
+                                 in self._quantile_tables.items() 
+                                 if key[0] != year}
+        return month_stats
+
         
-    def compare_day_temps(self, today_max_day_temp):
+    def month_series(self, month, year):
         """
-        Compares today's maximum daytime temperature to the historical data 
-        for the given month.
+        Returns the daily max and min temperatures of one month, from the 
+        downloader's data if it already holds the year, or else from the 
+        climate store, downloading only that month.
+
+        Parameters
+        ----------
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+        year : int
+            The year of the month.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The daily maximum and daily minimum temperatures(°F) of the 
+            month.
+        """
+        downloader = self.get_downloader()
+        if downloader.historical_year == year:
+            return (
+                self.extract_data_for_month(
+                    downloader.daily_temperature_2m_max, month, year),
+                self.extract_data_for_month(
+                    downloader.daily_temperature_2m_min, month, year)
+            )
+        return downloader.sync_historical_data(*month_window(year, month))
 
-        Prints out a message in human language comparing today's temperature 
-        with historical data. It also prints out a nice visual of today's 
-        temperature in comparision to historical data.
+        
+    def load_climatology(self, years, percentiles=(10, 25, 50, 75, 90)):
+        """
+        Loads the daily max and min temperatures of many years into one 
+        climatology and computes their per-month and per-day-of-year minimum, 
+        maximum, mean, standard deviation and percentiles in one vectorized 
+        pass. Climatologies are cached per set of years, so loading the same 
+        years again is free.
 
         Parameters
         ----------
-        today_max_day_temp : float
-            The maximum daytime temperature for today.
+        years : list of int
+            The years the climatology is built from.
+        percentiles : tuple of float, optional
+            The percentiles to compute, defaults to (10, 25, 50, 75, 90).
 
         Returns
         -------
-        str
-            A message indicating how today's daytime temperature compares to 
-            historical data. It also prints out a visual of today's daytime 
-            temperatures in comparision to historical records.
+        Climatology
+            The climatology, also saved as instance variable `climatology`.
         """
-        #Calculate the month's previous temperature range
-        range_day_temp = self.max_day_temp_month - self.min_day_temp_month
+        years = sorted(set(years))
+        key = (tuple(years), tuple(percentiles))
+        if key not in self._climatologies:
+            downloader = self.get_downloader()
+            daily_max = []
+            daily_min = []
+
+            #Sync every run of consecutive years in one go, then split the 
+            #run into single years
+            for first_year, last_year in _consecutive_year_runs(years):
+                max_temps, min_temps = downloader.sync_historical_data(
+                    datetime.date(first_year, 1, 1),
+                    datetime.date(last_year, 12, 31)
+                )
+                start = 0
+                for year in range(first_year, last_year + 1):
+                    end = start + days_in_year(year)
+                    daily_max.append(max_temps[start:end])
+                    daily_min.append(min_temps[start:end])
+                    start = end
+
+            with metrics.timer('statistics', stage='climatology'):
+                self._climatologies[key] = Climatology(years, daily_max, 
+                                                       daily_min, percentiles)
+
+        self.climatology = self._climatologies[key]
+        return self.climatology
 
-        #Calculate statistic quartiles
-        quartile_1d = range_day_temp / 4 + self.min_day_temp_month
-        quartile_2d =  range_day_temp / 2 + self.min_day_temp_month
-        quartile_3d =  range_day_temp * 3 / 4 + self.min_day_temp_month
         
-        #Print out the range visual
-        self.print_range(self.min_day_temp_month, self.max_day_temp_month,
-                         today_max_day_temp)
+    def quantile_table(self, month, variable='temperature_2m_max', 
+                       years=None):
+        """
+        Returns the empirical quantile table of a variable for the given 
+        month, built once from the given years, else from the loaded 
+        climatology if there is one, or else from the year used by 
+        match_against_historical_weather(). In approximate mode the table is 
+        built from the quantile sketches of the same years.
 
-        #Present a message after comparing today's temperature to history
-        if today_max_day_temp > self.max_day_temp_month:
-            message = 'Record heat in the day for this month'
+        Parameters
+        ----------
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+        variable : str, optional
+            'temperature_2m_max' (default) or 'temperature_2m_min'.
+        years : list of int, optional
+            Builds the table from this month of these years, downloading 
+            only the month and the variable.
 
-        elif today_max_day_temp > quartile_3d:
-            message = 'Considerably warm in the day for this month'
+        Returns
+        -------
+        QuantileTable
+            The table of the month's minimum, quartiles and maximum.
+
+        Raises
+        ------
+        ValueError
+            If no years are given, no climatology is loaded and 
+            match_against_historical_weather() has not run.
+        """
+        if years is not None:
+            source = tuple(sorted(set(years)))
+        elif self.climatology is not None:
+            source = tuple(self.climatology.years)
+        else:
+            source = self._matched_year()
+        key = (source, month, variable)
+
+        if key not in self._quantile_tables and self.approximate:
+            sketch_years = source if isinstance(source, tuple) else (source,)
+            self._quantile_tables[key] = QuantileTable.from_sketch(
+                self.month_sketch(month, variable, sketch_years))
+        elif key not in self._quantile_tables:
+            if years is not None:
+                history = self.get_downloader().get_month_history(
+                    month, source, (variable,))
+                values = np.concatenate(history[variable])
+            elif self.climatology is not None:
+                values = self.climatology.month_values(variable, month)
+            else:
+                year, matched_month, month_max, month_min = (
+                    self._match_series)
+                if matched_month != month:
+                    month_max, month_min = self.month_series(month, year)
+                values = (month_max if variable == 'temperature_2m_max' 
+                          else month_min)
+            self._quantile_tables[key] = QuantileTable.from_values(values)
+        return self._quantile_tables[key]
+
+    def month_sketch(self, month, variable='temperature_2m_max', 
+                     years=None):
+        """
+        Returns the quantile sketch of a variable's daily values in the 
+        given month over many years, merged from one sketch per year. Sketches 
+        are read from the climate store, or built from the month's series and 
+        stored once the month is complete.
 
-        elif today_max_day_temp > quartile_2d:
-            message = 'Moderately warm in the day for this month'
+        Parameters
+        ----------
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+        variable : str, optional
+            'temperature_2m_max' (default) or 'temperature_2m_min'.
+        years : list of int, optional
+            The years of the month, defaults to the year used by 
+            match_against_historical_weather().
+
+        Returns
+        -------
+        KLLSketch
+            The merged sketch.
+
+        Raises
+        ------
+        ValueError
+            If no years are given and match_against_historical_weather() has 
+            not run.
+        """
+        if years is None:
+            years = [self._matched_year()]
+        downloader = self.get_downloader()
+        store = downloader.climate_store
+        sketch = KLLSketch(self.sketch_k)
+        for year in sorted(set(years)):
+            year_sketch = store.read_sketch(downloader.latitude, 
+                downloader.longitude, variable, year, month, 
+                downloader.timezone)
+            if year_sketch is None:
+                month_max, month_min = self.month_series(month, year)
+                values = (month_max if variable == 'temperature_2m_max' 
+                          else month_min)
+                year_sketch = KLLSketch(self.sketch_k)
+                year_sketch.update(values)
+                #A month still missing days would be stored out of date
+                if not np.isnan(values).any():
+                    store.write_sketch(downloader.latitude, 
+                        downloader.longitude, variable, year, month, 
+                        year_sketch, downloader.timezone)
+            sketch.merge(year_sketch)
+        return sketch
+
+    def classify_day_temps(self, temps, month):
+        """
+        Classifies many daytime maximum temperatures at once against the 
+        empirical quantiles of the given month.
+
+        Parameters
+        ----------
+        temps : float or list of float
+            The maximum daytime temperatures to classify.
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+
+        Returns
+        -------
+        numpy.ndarray
+            One category code per temperature, indexes into DAY_MESSAGES 
+            from 0 (extremely cold) to 6 (record heat).
+        """
+        table = self.quantile_table(month, 'temperature_2m_max')
+        with metrics.timer('statistics', stage='classify'):
+            return table.classify_day(temps)
+
+    def classify_night_temps(self, temps, month):
+        """
+        Classifies many nighttime minimum temperatures at once against the 
+        empirical quantiles of the given month.
+
+        Parameters
+        ----------
+        temps : float or list of float
+            The minimum nighttime temperatures to classify.
+        month : int
+            The month (1 = January, 2 = February, ..., 12 = December).
+
+        Returns
+        -------
+        numpy.ndarray
+            One category code per temperature, indexes into NIGHT_MESSAGES 
+            from 0 (record cold) to 6 (extremely hot).
+        """
+        table = self.quantile_table(month, 'temperature_2m_min')
+        with metrics.timer('statistics', stage='classify'):
+            return table.classify_night(temps)
 
-        elif round(today_max_day_temp) == round(quartile_2d):
-            message = 'Average temperature in the day for this month'
         
-        elif today_max_day_temp > quartile_1d:
-            message = 'Moderately cold in the day for this month'
+    def compare_day_temps(self, today_max_day_temp, month_stats=None, 
+                          table=None):
+        """
+        Compares today's maximum daytime temperature to the historical data 
+        for the given month, against the empirical quartiles of the month's 
+        daily maximum temperatures, see quantile_table(). In approximate mode 
+        the quartiles are read from the month's quantile sketches.
 
-        elif today_max_day_temp > self.min_day_temp_month:
-            message = 'Considerably cold in the day for this month'
+        Nothing is printed, pass the result to 
+        weather_report.print_comparison() for the message and a nice visual 
+        of today's temperature in comparision to historical data.
 
-        elif today_max_day_temp <= self.min_day_temp_month:
-            message = 'Extremely cold in the day for this month'
+        Parameters
+        ----------
+        today_max_day_temp : float
+            The maximum daytime temperature for today.
+        month_stats : MonthStats, optional
+            The month and year to compare against, defaults to the result of 
+            the last match_against_historical_weather().
+        table : QuantileTable, optional
+            The quartiles to compare against, e.g. of many years that were 
+            aggregated elsewhere. By default the month's table is built once 
+            from the year of the given month_stats, or else from the loaded 
+            climatology or the last match.
 
-        print(message)
-        return message
+        Returns
+        -------
+        TemperatureComparison
+            The category code and a message indicating how today's daytime 
+            temperature compares to historical data, with the lowest and 
+            highest temperature of the table.
+        """
+        return self._compare_quantiles(today_max_day_temp, month_stats, 
+                                       'temperature_2m_max', table)
 
 
-    def compare_night_temps(self,today_min_night_temp):
+    def compare_night_temps(self, today_min_night_temp, month_stats=None, 
+                            table=None):
         """
         Compares today's minimum nighttime temperature to the historical data 
-        for the given month.
+        for the given month, against the empirical quartiles of the month's 
+        daily minimum temperatures, see quantile_table(). In approximate mode 
+        the quartiles are read from the month's quantile sketches.
 
-        Prints out a message in human language comparing today's temperature 
-        with historical data. It also prints out a nice visual of today's 
-        temperature in comparision to historical data.
+        Nothing is printed, pass the result to 
+        weather_report.print_comparison() for the message and a nice visual 
+        of today's temperature in comparision to historical data.
         
         Parameters
         ----------
         today_min_night_temp : float
             The maximum nighttime temperature for today.
+        month_stats : MonthStats, optional
+            The month and year to compare against, defaults to the result of 
+            the last match_against_historical_weather().
+        table : QuantileTable, optional
+            The quartiles to compare against. By default the month's table is 
+            built once from the year of the given month_stats, or else from 
+            the loaded climatology or the last match.
 
         Returns
         -------
-        str
-            A message indicating how today's nighttime temperature compares 
-            to historical data. It also prints out a visual of today's 
-            nighttime temperatures in comparision to historical records.
-        """
-        #Calculate the month's previous temperature range
-        range_night_temp = (
-        self.max_night_temp_month - self.min_night_temp_month)
-            
-        #Calculate statistic quartiles
-        quartile_1n = range_night_temp / 4 + self.min_night_temp_month
-        quartile_2n =  range_night_temp / 2 + self.min_night_temp_month
-        quartile_3n =  range_night_temp * 3 / 4 + self.min_night_temp_month
-
-        #Print out the range visual
-        self.print_range(self.min_night_temp_month, 
-                         self.max_night_temp_month, today_min_night_temp)
-
-        #Present a message after comparing today's temperature to history
-        if today_min_night_temp < self.min_night_temp_month:
-            message = 'Record cold at night for this month'
-
-        elif today_min_night_temp < quartile_1n:
-            message = 'Considerably cold at night for this month'
-
-        elif today_min_night_temp < quartile_2n:
-            message = 'Moderately cold at night for this month'
-
-        elif round(today_min_night_temp) == round(quartile_2n):
-            message = 'Average temperature at night for this month'
-        
-        elif today_min_night_temp < quartile_3n:
-            message = 'Moderately warm at night for this month'
-
-        elif today_min_night_temp < self.max_night_temp_month:
-            message = 'Considerably warm at night for this month'
-
-        elif today_min_night_temp >= self.max_night_temp_month:
-            message = 'Extremely hot at night for this month'
-        
-        print(message)
-        return message
+        TemperatureComparison
+            The category code and a message indicating how today's nighttime 
+            temperature compares to historical data, with the lowest and 
+            highest temperature of the table.
+        """
+        return self._compare_quantiles(today_min_night_temp, month_stats, 
+                                       'temperature_2m_min', table)
+
+    def _matched_year(self):
+        #The year of the last match, the default source of tables
+        if self._match_series[0] is None:
+            raise ValueError('pass years, call load_climatology() or call '
+                             'match_against_historical_weather() first')
+        return self._match_series[0]
+
+    def _compare_quantiles(self, temp, month_stats, variable, table):
+        #Classify against the month's table: the year of the given 
+        #month_stats, else the climatology's years or the matched series
+        given = month_stats is not None
+        if not given:
+            month_stats = self.month_stats
+        matched = self._match_series[:2] == (month_stats.year, 
+                                              month_stats.month)
+        if table is None and self.climatology is not None and not given:
+            table = self.quantile_table(month_stats.month, variable)
+        elif table is None and matched and self.climatology is None:
+            table = self.quantile_table(month_stats.month, variable)
+        elif table is None:
+            table = self.quantile_table(month_stats.month, variable, 
+                                        [month_stats.year])
+        with metrics.timer('statistics', stage='compare'):
+            if variable == 'temperature_2m_max':
+                code = int(table.classify_day(temp)[0])
+                message = DAY_MESSAGES[code]
+            else:
+                code = int(table.classify_night(temp)[0])
+                message = NIGHT_MESSAGES[code]
+        return TemperatureComparison(temp, code, message, 
+                                     table.breakpoints[0], 
+                                     table.breakpoints[-1])
 
     
-    def print_range(self, low_temp, high_temp, today_temp):
+    def print_range(self, low_temp, high_temp, today_temp, width=None):
         """
         Prints a nice visual of a range of temperatures from low to high with 
         today's temperature, looks something like:
@@ -365,77 +762,63 @@ class WeatherDataStatistics:
         today_temp : float
             The temperature for today, which will be displayed along the 
             dotted range.
+        width : int, optional
+            Scales the range to this many positions, see format_range(). By 
+            default there is one position per degree.
 
         Returns
         -------
         None
             Prints the temperature range.
         """
-        
-        #Round all temperatures to nearest integer
-        self.low_temp = round(low_temp)
-        self.high_temp = round(high_temp)
-        self.today_temp = round(today_temp)
-
-        #Create the bounds of the range's visuals
-        self.start_range = self.low_temp
-        self.end_range = self.high_temp
-        
-        #Change the start or end of the range if today's temperature is more 
-        #extreme than the historical extremes
-        if today_temp < low_temp:
-            self.start_range = self.today_temp
-        elif today_temp > high_temp:
-            self.end_range = self.today_temp 
+        #Build the whole line, then write it at once
+        sys.stdout.write(format_range(low_temp, high_temp, today_temp, 
+                                      width) + '\n')
+
+
+    def format_range(self, low_temp, high_temp, today_temp, width=None):
+        """
+        Builds the visual of print_range() as a single string, without 
+        printing it, see weather_report.format_range().
+
+        Parameters
+        ----------
+        low_temp : float
+            The historical lowest temperature in the range.
+        high_temp : float
+            The historical highest temperature in the range.
+        today_temp : float
+            The temperature for today.
+        width : int, optional
+            The number of positions of the scaled range, at least 2. By 
+            default there is one position per degree.
 
-        #Print the range
-        self.print_range_recursive(self.start_range)
-        print('') #print a new line after the visual
+        Returns
+        -------
+        str
+            The range visual, without a trailing new line.
+        """
+        return format_range(low_temp, high_temp, today_temp, width)
 
 
-    def print_range_recursive(self, i):
+    def print_ranges(self, ranges, width=None, labels=None):
         """
-        Made for print_range(), uses recursion to print a temperature range 
-        with markers for today's temperature.
+        Prints the range visuals of many cities with a single write, e.g. for 
+        a terminal dashboard.
 
-        Forms a recursive range starting at `i` and ending at 
-        `self.end_range`. It prints the historical lowest and highest 
-        temperatures at their respective positions and reveals the position 
-        of today's temperature. Any other temperature is displayed as a dash 
-        to visualize the temperature distances between the important 
-        temperatures.
-        
         Parameters
         ----------
-        i (int) :
-            The current index or starting temperature in the range. The 
-            recursion will start at this value.
+        ranges : list of tuple
+            One (low_temp, high_temp, today_temp) tuple per range.
+        width : int, optional
+            The number of positions of every scaled range, see 
+            format_range(). By default there is one position per degree.
+        labels : list of str, optional
+            A label, such as the city name, printed before each range.
 
         Returns
         -------
         None
-            Prints the visuals
+            Prints the temperature ranges.
         """
-        #If the temperature gets bigger than the upper range, end recursion
-        if i > self.end_range:
-            return
-        
-        #Print today's temperature
-        if i == self.today_temp:
-            print(f'(today {self.today_temp}F)', end=' ')
-    
-        #Print the low temperature
-        elif i == self.low_temp:
-            print(f'{self.low_temp}F', end=' ')
-        
-        #Print the high temperature
-        elif i == self.high_temp:
-            print(f'{self.high_temp}F', end=' ')
-        
-        #For all other temperatures in the range, print dashes
-        else:
-            print('-', end=' ')
-
-        #Use recursion to call the function with the next temperature in the 
-        #range
-        self.print_range_recursive(i + 1)
\ No newline at end of file
+        sys.stdout.write(format_ranges(ranges, width, labels))
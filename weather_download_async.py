@@ -0,0 +1,390 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+import niquests
+import openmeteo_requests
+from geocoding_cache import (GEOCODING_URL, first_geocoding_result,
+                             geocoding_params, get_default_geocoding_cache)
+from query_planner import DAILY_VARIABLES
+from weather_calendar import AUTO_TIMEZONE, resolve_timezone
+from weather_data_download import (ARCHIVE_URL, FORECAST_URL, archive_params,
+                                   forecast_params)
+from weather_variables import decode_response
+
+class AsyncRateLimiter:
+    """
+    Token bucket that limits how many requests per second are sent to one
+    host.
+
+    Attributes
+    ----------
+    rate : float
+        The number of requests allowed per second.
+    burst : int
+        The number of requests that may be sent back to back before the rate
+        applies.
+
+    Methods
+    -------
+    __init__(rate, burst=1)
+        Initializes a full bucket for the given rate.
+    acquire()
+        Waits until a request may be sent.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        Initializes a full bucket for the given rate.
+
+        Parameters
+        ----------
+        rate : float
+            The number of requests allowed per second.
+        burst : int, optional
+            The number of requests that may be sent back to back, defaults
+            to 1.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Waits until a request may be sent, then takes a token from the
+        bucket.
+        """
+        async with self._lock:
+            while True:
+                #Refill the bucket for the time passed since the last request
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncWeatherDataDownload:
+    """
+    Downloads the coordinates, historical weather and today's weather
+    forecast of many cities at once, information taken from Open-Meteo API.
+    All requests share one pooled HTTP client, the number of requests in
+    flight is bounded and every host has its own rate limit.
+
+    Use it as an async context manager, or call `download_many()` from
+    synchronous code.
+
+    Attributes
+    ----------
+    max_concurrency : int
+        The maximum number of requests in flight at once.
+    requests_per_second : float
+        The maximum number of requests per second sent to each host.
+    retries : int
+        The number of retries on connection errors and server errors.
+    backoff_factor : float
+        The factor used to compute the waiting time between retries.
+    geocoding_cache : GeocodingCache
+        The cache used to look up the cities' coordinates.
+
+    Methods
+    -------
+    __init__(max_concurrency=16, requests_per_second=10, retries=5,
+             backoff_factor=0.2, geocoding_cache=None)
+        Initializes the download engine, the HTTP client is opened on entry.
+    find_lat_long(city_name)
+        Finds the latitude and longitude for the given city.
+    get_historical_data(latitude, longitude, year=2023, 
+                        timezone=AUTO_TIMEZONE)
+        Downloads the daily max and min temperatures for the given year.
+    get_forecast_data(latitude, longitude, timezone=AUTO_TIMEZONE)
+        Downloads the forecasted max and min temperatures for today.
+    download_city(city_name, year=2023, forecast=True)
+        Geocodes the city and downloads its historical data and forecast.
+    download_all(cities, year=2023, forecast=True)
+        Downloads the data of all the given cities concurrently.
+    download_many(cities, year=2023, forecast=True, **kwargs)
+        Synchronous entry point that runs `download_all()` in a new event
+        loop.
+    """
+
+    def __init__(self, max_concurrency=16, requests_per_second=10,
+                 retries=5, backoff_factor=0.2, geocoding_cache=None):
+        """
+        Initializes the download engine, the HTTP client is opened on entry.
+
+        Parameters
+        ----------
+        max_concurrency : int, optional
+            The maximum number of requests in flight at once, defaults to 16.
+        requests_per_second : float, optional
+            The maximum number of requests per second sent to each host,
+            defaults to 10.
+        retries : int, optional
+            The number of retries on connection errors and server errors,
+            defaults to 5 like WeatherDataDownload.
+        backoff_factor : float, optional
+            The factor used to compute the waiting time between retries,
+            defaults to 0.2 like WeatherDataDownload.
+        geocoding_cache : GeocodingCache, optional
+            The cache used to look up the cities' coordinates, defaults to the
+            cache shared by the whole process.
+        """
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        if geocoding_cache is None:
+            geocoding_cache = get_default_geocoding_cache()
+        self.geocoding_cache = geocoding_cache
+        self._session = None
+        self._openmeteo = None
+        self._semaphore = None
+        self._limiters = {}
+
+    async def __aenter__(self):
+        #Same retry policy as the retry_requests wrapper used by
+        #WeatherDataDownload
+        retry_configuration = niquests.RetryConfiguration(
+            total = self.retries, read = self.retries,
+            connect = self.retries, backoff_factor = self.backoff_factor,
+            status_forcelist = (500, 502, 504), allowed_methods = None
+        )
+        self._session = niquests.AsyncSession(
+            retries = retry_configuration,
+            pool_connections = 4, pool_maxsize = self.max_concurrency
+        )
+        self._openmeteo = openmeteo_requests.AsyncClient(
+            session = self._session)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+        self._openmeteo = None
+
+    async def find_lat_long(self, city_name):
+        """
+        Finds the latitude and longitude for the given city using the Open-
+        Meteo geocoding API, answering repeat lookups from the geocoding
+        cache.
+
+        Parameters
+        ----------
+        city_name : str
+            The name of the city.
+
+        Returns
+        -------
+        list of str
+            A list containing the latitude and longitude as strings, or
+            [0, 0] if the city is not found.
+        """
+        location = await self._lookup(city_name)
+        if location:
+            return [str(location['latitude']), str(location['longitude'])]
+        return [0, 0]
+
+    async def get_historical_data(self, latitude, longitude, year=2023,
+                                  timezone=AUTO_TIMEZONE):
+        """
+        Downloads the historical weather data (daily max and min
+        temperatures) of the given location for the given year, with days
+        local to the given timezone like WeatherDataDownload.
+
+        Parameters
+        ----------
+        latitude : str
+            The latitude of the location.
+        longitude : str
+            The longitude of the location.
+        year : int, optional
+            Historical data will be retrieved from this year, defaults to
+            2023.
+        timezone : str, optional
+            The location's timezone, see weather_calendar.resolve_timezone(),
+            defaults to AUTO_TIMEZONE.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The daily maximum and daily minimum temperatures(°F).
+        """
+        params = archive_params(latitude, longitude, f'{year}-01-01',
+                                f'{year}-12-31', timezone=timezone)
+        async with self._request_slot(ARCHIVE_URL):
+            responses = await self._openmeteo.weather_api(ARCHIVE_URL,
+                                                          params=params)
+        daily = decode_response(responses[0], DAILY_VARIABLES)
+        return daily['temperature_2m_max'], daily['temperature_2m_min']
+
+    async def get_forecast_data(self, latitude, longitude,
+                                timezone=AUTO_TIMEZONE):
+        """
+        Downloads the weather forecast of the given location for today.
+
+        Parameters
+        ----------
+        latitude : str
+            The latitude of the location.
+        longitude : str
+            The longitude of the location.
+        timezone : str, optional
+            The location's timezone, which decides what today is. Defaults to
+            AUTO_TIMEZONE.
+
+        Returns
+        -------
+        tuple of float
+            The forecasted maximum temperature(°F) for today and minimum
+            temperature(°F) for tonight.
+        """
+        params = forecast_params(latitude, longitude, timezone=timezone)
+        async with self._request_slot(FORECAST_URL):
+            responses = await self._openmeteo.weather_api(FORECAST_URL,
+                                                          params=params)
+        daily = decode_response(responses[0], DAILY_VARIABLES)
+        return daily['temperature_2m_max'][0], daily['temperature_2m_min'][0]
+
+    async def download_city(self, city_name, year=2023, forecast=True):
+        """
+        Geocodes the city, then downloads its historical data and forecast
+        concurrently.
+
+        Parameters
+        ----------
+        city_name : str
+            The name of the city.
+        year : int, optional
+            Historical data will be retrieved from this year, defaults to
+            2023.
+        forecast : bool, optional
+            Whether today's forecast is downloaded too, defaults to True.
+
+        Returns
+        -------
+        dict or None
+            The city's data, keyed like the attributes of
+            WeatherDataDownload, or None if the city is not found.
+        """
+        location = await self._lookup(city_name)
+        if not location:
+            return None
+        latitude = str(location['latitude'])
+        longitude = str(location['longitude'])
+        #Days and today are local to the city, as in WeatherDataDownload
+        timezone = resolve_timezone(location)
+
+        downloads = [self.get_historical_data(latitude, longitude, year,
+                                              timezone)]
+        if forecast:
+            downloads.append(self.get_forecast_data(latitude, longitude,
+                                                    timezone))
+        results = await asyncio.gather(*downloads)
+
+        city_data = {
+            'city_name': city_name,
+            'latitude': latitude,
+            'longitude': longitude,
+            'timezone': timezone,
+            'daily_temperature_2m_max': results[0][0],
+            'daily_temperature_2m_min': results[0][1]
+        }
+        if forecast:
+            city_data['today_max_day_temp'] = results[1][0]
+            city_data['today_min_night_temp'] = results[1][1]
+        return city_data
+
+    async def download_all(self, cities, year=2023, forecast=True):
+        """
+        Downloads the data of all the given cities concurrently.
+
+        Parameters
+        ----------
+        cities : list of str
+            The names of the cities.
+        year : int, optional
+            Historical data will be retrieved from this year, defaults to
+            2023.
+        forecast : bool, optional
+            Whether today's forecast is downloaded too, defaults to True.
+
+        Returns
+        -------
+        dict
+            Maps each city name to its data, see `download_city()`. Cities
+            that cannot be found are left out.
+        """
+        results = await asyncio.gather(*(
+            self.download_city(city, year, forecast) for city in cities))
+        return {city: data for city, data in zip(cities, results)
+                if data is not None}
+
+    @classmethod
+    def download_many(cls, cities, year=2023, forecast=True, **kwargs):
+        """
+        Synchronous entry point that runs `download_all()` in a new event
+        loop.
+
+        Parameters
+        ----------
+        cities : list of str
+            The names of the cities.
+        year : int, optional
+            Historical data will be retrieved from this year, defaults to
+            2023.
+        forecast : bool, optional
+            Whether today's forecast is downloaded too, defaults to True.
+        **kwargs
+            Passed on to `__init__()`, for example `max_concurrency`.
+
+        Returns
+        -------
+        dict
+            Maps each city name to its data, see `download_city()`.
+        """
+        async def run():
+            async with cls(**kwargs) as engine:
+                return await engine.download_all(cities, year, forecast)
+        return asyncio.run(run())
+
+    async def _lookup(self, city_name):
+        #The city's geocoding result, an empty dict if it is not found
+        location = self.geocoding_cache.get(city_name)
+        if location is None:
+            async with self._request_slot(GEOCODING_URL):
+                response = await self._session.get(
+                    GEOCODING_URL, params = geocoding_params(city_name))
+            #Only a successful response without results means not found
+            response.raise_for_status()
+            location = first_geocoding_result(response.json())
+            self.geocoding_cache.put(city_name, location)
+        return location
+
+    def _request_slot(self, url):
+        #Every request waits for its host's rate limit, then holds one of the
+        #concurrency slots while it is in flight
+        host = urlsplit(url).hostname
+        if host not in self._limiters:
+            self._limiters[host] = AsyncRateLimiter(self.requests_per_second)
+        return _RequestSlot(self._semaphore, self._limiters[host])
+
+
+class _RequestSlot:
+    #Async context manager combining the rate limit and the concurrency limit
+
+    def __init__(self, semaphore, limiter):
+        self._semaphore = semaphore
+        self._limiter = limiter
+
+    async def __aenter__(self):
+        await self._limiter.acquire()
+        await self._semaphore.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
@@ -0,0 +1,153 @@
+import math
+import sys
+
+def print_month_stats(month_stats, file=None):
+    """
+    Prints the historical extremes of a month, as returned by
+    WeatherDataStatistics.match_against_historical_weather().
+
+    Parameters
+    ----------
+    month_stats : MonthStats
+        The month's historical extremes.
+    file : file, optional
+        Where to print, defaults to sys.stdout.
+
+    Returns
+    -------
+    None
+        Prints out statistical information about the city's historical data.
+    """
+    file = sys.stdout if file is None else file
+    file.write(
+        f'Max Day Temperature of the Month:    '
+        f'{month_stats.max_day_temp_month}\n'
+        f'Min Day Temperature of the Month:    '
+        f'{month_stats.min_day_temp_month}\n'
+        f'Max Night Temperature of the Month:  '
+        f'{month_stats.max_night_temp_month}\n'
+        f'Min Night Temperature of the Month:  '
+        f'{month_stats.min_night_temp_month}\n'
+    )
+
+
+def print_comparison(comparison, width=None, file=None):
+    """
+    Prints the visual of today's temperature within the month's historical
+    range, followed by the comparison message, as returned by
+    WeatherDataStatistics.compare_day_temps() or compare_night_temps().
+
+    Parameters
+    ----------
+    comparison : TemperatureComparison
+        The comparison of today's temperature with the month's history.
+    width : int, optional
+        Scales the range to this many positions, see format_range(). By
+        default there is one position per degree.
+    file : file, optional
+        Where to print, defaults to sys.stdout.
+
+    Returns
+    -------
+    None
+        Prints the temperature range and the message.
+    """
+    file = sys.stdout if file is None else file
+    line = format_range(comparison.low_temp, comparison.high_temp,
+                        comparison.temperature, width)
+    file.write(line + '\n' + comparison.message + '\n')
+
+
+def format_range(low_temp, high_temp, today_temp, width=None):
+    """
+    Builds a nice visual of a range of temperatures from low to high with
+    today's temperature as a single string, looks something like:
+        low_temp - - - - - (today today_temp) - - - - high_temp
+
+    Every degree from the start to the end of the range is one dash, except
+    the positions of the historical lowest and highest temperatures and of
+    today's temperature, which show their values. If today's temperature is
+    outside the historical range, the range is extended to include it. When
+    `width` is given the range is scaled to that many positions, so wide
+    ranges (or bad forecast values such as -999) stay one short line. A
+    month without data has NaN bounds, which show as 'n/a' around today's
+    temperature.
+
+    Parameters
+    ----------
+    low_temp : float
+        The historical lowest temperature in the range.
+    high_temp : float
+        The historical highest temperature in the range.
+    today_temp : float
+        The temperature for today.
+    width : int, optional
+        The number of positions of the scaled range, at least 2. By default
+        there is one position per degree.
+
+    Returns
+    -------
+    str
+        The range visual, without a trailing new line.
+    """
+    #Without historical extremes there is no range to place today in
+    if not (math.isfinite(low_temp) and math.isfinite(high_temp)):
+        today = (f'{round(today_temp)}F' if math.isfinite(today_temp)
+                 else 'n/a')
+        return f'n/a - (today {today}) - n/a '
+
+    #Round all temperatures to nearest integer
+    low = round(low_temp)
+    high = round(high_temp)
+    today = round(today_temp)
+
+    #Extend the range if today's temperature is more extreme than the
+    #historical extremes
+    start_range = today if today_temp < low_temp else low
+    end_range = today if today_temp > high_temp else high
+
+    #Map each temperature to its position along the range
+    if width is None:
+        positions = end_range - start_range + 1
+        scale = 1
+    else:
+        positions = width
+        scale = (width - 1) / max(end_range - start_range, 1)
+
+    def position(temp):
+        return round((temp - start_range) * scale)
+
+    #Start with dashes, then place the markers, today's last so it wins
+    parts = ['-'] * positions
+    parts[position(high)] = f'{high}F'
+    parts[position(low)] = f'{low}F'
+    parts[position(today)] = f'(today {today}F)'
+    return ' '.join(parts) + ' '
+
+
+def format_ranges(ranges, width=None, labels=None):
+    """
+    Builds the range visuals of many cities as one block of text, e.g. for a
+    terminal dashboard.
+
+    Parameters
+    ----------
+    ranges : list of tuple
+        One (low_temp, high_temp, today_temp) tuple per range.
+    width : int, optional
+        The number of positions of every scaled range, see format_range().
+    labels : list of str, optional
+        A label, such as the city name, printed before each range.
+
+    Returns
+    -------
+    str
+        One line per range, each ending with a new line.
+    """
+    lines = [format_range(low, high, today, width)
+             for low, high, today in ranges]
+    if labels is not None:
+        label_width = max((len(label) for label in labels), default=0)
+        lines = [f'{label:<{label_width}}  {line}'
+                 for label, line in zip(labels, lines)]
+    return ''.join(line + '\n' for line in lines)
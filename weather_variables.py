@@ -0,0 +1,174 @@
+from typing import NamedTuple
+from openmeteo_sdk.Aggregation import Aggregation
+from openmeteo_sdk.Variable import Variable
+
+#Registry of the Open-Meteo variables we can request, by their API name. Each
+#entry also holds how the FlatBuffers response labels the variable, so that a
+#response is decoded by name in one pass instead of by position.
+
+class WeatherVariable(NamedTuple):
+    """
+    One variable of the archive and forecast APIs: whether it is a daily or
+    an hourly series, and the (variable, altitude, aggregation) labels of its
+    series in a response.
+    """
+    frequency: str
+    variable: int
+    altitude: int = 0
+    aggregation: int = Aggregation.none
+
+    @property
+    def key(self):
+        #The labels that identify the series in a response
+        return self.variable, self.altitude, self.aggregation
+
+
+DAILY = 'daily'
+HOURLY = 'hourly'
+
+WEATHER_VARIABLES = {
+    #Daily temperatures(°F)
+    'temperature_2m_max': WeatherVariable(DAILY, Variable.temperature, 2,
+                                          Aggregation.maximum),
+    'temperature_2m_min': WeatherVariable(DAILY, Variable.temperature, 2,
+                                          Aggregation.minimum),
+    'temperature_2m_mean': WeatherVariable(DAILY, Variable.temperature, 2,
+                                           Aggregation.mean),
+    #Daily precipitation(inch) and hours with precipitation
+    'precipitation_sum': WeatherVariable(DAILY, Variable.precipitation, 0,
+                                         Aggregation.sum),
+    'rain_sum': WeatherVariable(DAILY, Variable.rain, 0, Aggregation.sum),
+    'snowfall_sum': WeatherVariable(DAILY, Variable.snowfall, 0,
+                                    Aggregation.sum),
+    'precipitation_hours': WeatherVariable(DAILY,
+                                           Variable.precipitation_hours),
+    #Daily wind(mph)
+    'wind_speed_10m_max': WeatherVariable(DAILY, Variable.wind_speed, 10,
+                                          Aggregation.maximum),
+    'wind_gusts_10m_max': WeatherVariable(DAILY, Variable.wind_gusts, 10,
+                                          Aggregation.maximum),
+    #Daily relative humidity(%)
+    'relative_humidity_2m_max': WeatherVariable(
+        DAILY, Variable.relative_humidity, 2, Aggregation.maximum),
+    'relative_humidity_2m_min': WeatherVariable(
+        DAILY, Variable.relative_humidity, 2, Aggregation.minimum),
+    'relative_humidity_2m_mean': WeatherVariable(
+        DAILY, Variable.relative_humidity, 2, Aggregation.mean),
+
+    #Hourly values
+    'temperature_2m': WeatherVariable(HOURLY, Variable.temperature, 2),
+    'precipitation': WeatherVariable(HOURLY, Variable.precipitation),
+    'rain': WeatherVariable(HOURLY, Variable.rain),
+    'snowfall': WeatherVariable(HOURLY, Variable.snowfall),
+    'wind_speed_10m': WeatherVariable(HOURLY, Variable.wind_speed, 10),
+    'wind_gusts_10m': WeatherVariable(HOURLY, Variable.wind_gusts, 10),
+    'relative_humidity_2m': WeatherVariable(HOURLY,
+                                            Variable.relative_humidity, 2),
+}
+
+#Labels of every registered variable, a series with other labels is unknown
+_REGISTERED_KEYS = frozenset(variable.key
+                             for variable in WEATHER_VARIABLES.values())
+
+def variable_params(daily=(), hourly=()):
+    """
+    Builds the `daily` and `hourly` query parameters of a request.
+
+    Parameters
+    ----------
+    daily : tuple of str, optional
+        The daily variables, see WEATHER_VARIABLES, defaults to none.
+    hourly : tuple of str, optional
+        The hourly variables, defaults to none.
+
+    Returns
+    -------
+    dict
+        The `daily` and `hourly` parameters, each only when it has
+        variables.
+
+    Raises
+    ------
+    ValueError
+        If a variable is not in the registry or has the other frequency.
+    """
+    params = {}
+    for frequency, names in ((DAILY, daily), (HOURLY, hourly)):
+        for name in names:
+            if name not in WEATHER_VARIABLES:
+                raise ValueError(f'unknown weather variable {name!r}')
+            if WEATHER_VARIABLES[name].frequency != frequency:
+                raise ValueError(f'{name!r} is not a {frequency} variable')
+        if names:
+            params[frequency] = list(names)
+    return params
+
+
+def decode_series(series, names):
+    """
+    Decodes the requested variables of one daily or hourly series of a
+    response, in a single pass over its variables. Each variable is matched
+    by its labels. A variable without a match falls back to the position it
+    was requested in, but only if the series there has labels that are not
+    in the registry, so a series is never mistaken for another variable.
+
+    Parameters
+    ----------
+    series : openmeteo_sdk.VariablesWithTime
+        The `Daily()` or `Hourly()` series of a response.
+    names : tuple of str
+        The variables, in the order they were requested.
+
+    Returns
+    -------
+    dict
+        Maps each variable to its values, one float32 column each.
+
+    Raises
+    ------
+    KeyError
+        If a requested variable is missing from the response.
+    """
+    items = [series.Variables(index)
+             for index in range(series.VariablesLength())]
+    keys = [(item.Variable(), item.Altitude(), item.Aggregation())
+            for item in items]
+    by_key = {}
+    for key, item in zip(keys, items):
+        by_key.setdefault(key, item)
+    columns = {}
+    for position, name in enumerate(names):
+        item = by_key.get(WEATHER_VARIABLES[name].key)
+        if item is None:
+            if position >= len(items) or keys[position] in _REGISTERED_KEYS:
+                raise KeyError(f'{name!r} is missing from the response')
+            item = items[position]
+        columns[name] = item.ValuesAsNumpy()
+    return columns
+
+
+def decode_response(response, daily=(), hourly=()):
+    """
+    Decodes every requested variable of one location of a response into
+    named columns.
+
+    Parameters
+    ----------
+    response : openmeteo_sdk.WeatherApiResponse
+        The response of one location.
+    daily : tuple of str, optional
+        The daily variables, in the order they were requested.
+    hourly : tuple of str, optional
+        The hourly variables, in the order they were requested.
+
+    Returns
+    -------
+    dict
+        Maps each daily and hourly variable to its values.
+    """
+    columns = {}
+    if daily:
+        columns.update(decode_series(response.Daily(), daily))
+    if hourly:
+        columns.update(decode_series(response.Hourly(), hourly))
+    return columns